@@ -1,16 +1,146 @@
 import os
 from . import api_blueprint
-from flask import request, jsonify, current_app
+from flask import request, jsonify, current_app, Response, stream_with_context, g
 from flask_cors import CORS, cross_origin
-from app.utils.helpers import generate_unique_account_number, generate_unique_transaction_id, calculate_balances
-from app.models import Account, Auth, Customer, CheckingAccount, SavingsAccount, Loan, University, StudentLoan, PersonalLoan, HomeLoan, Transaction
+from app.utils.helpers import generate_unique_account_number, generate_unique_transaction_id, calculate_balances, encode_cursor, decode_cursor, encode_transaction_cursor, decode_transaction_cursor, account_transactions, record_balance_snapshot, customer_portfolio, count_balance_points
+from app.utils.passwords import PasswordHashingBusy
+from app.utils.tokens import issue_token, verify_token
+from app.utils.settlement import submit_settlement
+from app.utils.cache import get_response_cache, invalidate_after_commit
+from app.utils.metrics import get_metrics
+from app.utils.statements import STATEMENT_FORMATS, parse_statement_range, deposit_account_numbers, statement_rows, parquet_available
+from app.utils.amortization import load_loan_book, summarize, schedules
+from app.utils.hot_accounts import slot_totals
+from app.utils.idempotency import IDEMPOTENCY_HEADER, IdempotencyError, request_fingerprint, begin_request, finish_request
+from app.utils.onboarding import onboard_accounts, approve_pending_accounts
+from app.utils.transfers import apply_transfer_batch, transfer_funds, pay_loan_from_account, run_transaction, TransferError
+from itsdangerous import BadSignature
+from app.models import Account, Auth, Customer, CheckingAccount, SavingsAccount, Loan, University, StudentLoan, PersonalLoan, HomeLoan, Transaction, FundingIntent
 from app import db
+from app.api.schemas import AccountRecord, CustomerAccount, LoanInfo, StudentInfo, HomeInfo, PendingAccount, PendingPage, Balances, LoanStatus, LoanSchedule, ScheduledPayment, LoanTotals, Portfolio, TransactionRecord, TransactionPage
+from app.database import read_only, pool_stats
 from datetime import datetime, timedelta
 from decimal import Decimal
-import stripe
 import os
-from sqlalchemy.orm import aliased
-
+import functools
+import hmac
+import logging
+import uuid
+import time
+from sqlalchemy import select
+from sqlalchemy.orm import aliased, joinedload
+
+logger = logging.getLogger(__name__)
+
+TRANSACTION_PAGE_SIZE = 50
+TRANSACTION_MAX_PAGE_SIZE = 500
+TRANSACTION_STREAM_BATCH_SIZE = 500
+TRANSFER_BATCH_MAX_SIZE = 5000
+ACCOUNT_BATCH_MAX_SIZE = 50000
+BALANCE_MAX_POINTS = 1000  # e.g. almost three years by day or eighty years by month
+PENDING_PAGE_SIZE = 100
+PENDING_MAX_PAGE_SIZE = 1000
+
+
+# Endpoints reachable without a session token
+PUBLIC_ENDPOINTS = {'api.hello_world', 'api.register', 'api.login', 'api.get_metrics_text'}
+
+@api_blueprint.before_request
+def authenticate():
+    # Resolve the caller from the signed token alone, no database lookup
+    if request.method == 'OPTIONS' or request.endpoint in PUBLIC_ENDPOINTS:
+        return None
+    header = request.headers.get('Authorization', '')
+    if not header.startswith('Bearer '):
+        return jsonify({'error': 'Authentication required'}), 401
+    started = time.perf_counter_ns()
+    try:
+        g.customer_id, g.is_admin = verify_token(header[len('Bearer '):])
+    except BadSignature:
+        return jsonify({'error': 'Invalid or expired token'}), 401
+    finally:
+        g.auth_verify_us = (time.perf_counter_ns() - started) / 1000
+    return None
+
+@api_blueprint.after_request
+def report_auth_timing(response):
+    if 'auth_verify_us' in g:
+        response.headers.add('Server-Timing', f'auth;dur={g.auth_verify_us / 1000:.3f}')
+    return response
+
+def can_access_customer(customer_id):
+    """True when the authenticated caller is an admin or is the given customer."""
+    if g.is_admin:
+        return True
+    try:
+        return int(customer_id) == g.customer_id
+    except (TypeError, ValueError):
+        return False
+
+def cached_for_customer(view):
+    """Serve a customer's successful responses from the response cache, keyed by the full request path.
+
+    The customer comes from the `customer_id` view argument or query parameter. Write paths
+    invalidate the customer's entries when they commit, so a cached response is never older
+    than the customer's last committed change.
+    """
+    @functools.wraps(view)
+    def wrapper(**kwargs):
+        cache = get_response_cache()
+        try:
+            customer_id = int(kwargs.get('customer_id', request.args.get('customer_id')))
+        except (TypeError, ValueError):
+            customer_id = None
+        # Anything the view should refuse goes straight to it, so access checks never see a cached body
+        if cache is None or customer_id is None or not can_access_customer(customer_id):
+            return view(**kwargs)
+
+        built = []
+        def build():
+            response = current_app.make_response(view(**kwargs))
+            built.append(response)
+            return response.get_data() if response.status_code == 200 else None
+
+        body, hit = cache.fetch(customer_id, request.full_path, build)
+        response = Response(body, 200, mimetype='application/json') if hit else built[0]
+        response.headers['X-Cache'] = 'HIT' if hit else 'MISS'
+        return response
+    return wrapper
+
+def idempotent(view):
+    """Run a money-moving view at most once per Idempotency-Key header of the caller; see app.utils.idempotency.
+
+    Requests without the header run as before. A replayed response carries Idempotent-Replayed.
+    """
+    @functools.wraps(view)
+    def wrapper(**kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if key is None:
+            return view(**kwargs)
+        fingerprint = request_fingerprint(request.endpoint, request.get_data())
+        try:
+            stored = begin_request(g.customer_id, key, fingerprint)
+        except IdempotencyError as e:
+            return jsonify({'error': e.message}), e.status_code, e.headers
+        if stored is not None:
+            return Response(stored.body, stored.status_code, mimetype='application/json',
+                            headers={'Idempotent-Replayed': 'true'})
+
+        try:
+            response = current_app.make_response(view(**kwargs))
+        except Exception:
+            db.session.rollback()
+            finish_request(g.customer_id, key, fingerprint)
+            raise
+        finish_request(g.customer_id, key, fingerprint, response.status_code, response.get_data())
+        return response
+    return wrapper
+
+@api_blueprint.errorhandler(PasswordHashingBusy)
+def password_hashing_busy(error):
+    # Shed login/registration bursts quickly rather than tying up every worker on bcrypt
+    db.session.rollback()
+    return jsonify({'error': 'Server busy, please retry'}), 503, {'Retry-After': '1'}
 
 @api_blueprint.route('/', methods=['GET'])
 def hello_world():
@@ -18,18 +148,24 @@ def hello_world():
 
 @api_blueprint.route('/accounts', methods=['GET'])
 def get_accounts():
-    accounts = Account.query.all()
-    accounts_list = [{
-        'account_number': acct.acct_no,
-        'account_name': acct.acct_name,
-        'account_street': acct.acct_street,
-        'account_city': acct.acct_city,
-        'account_state': acct.acct_state,
-        'account_zip': acct.acct_zip,
-        'account_type': acct.acct_type,
-        'date_opened': acct.date_opened.strftime('%Y-%m-%d'),  # Formatting date
-        'customer_id': acct.customerid
-    } for acct in accounts]
+    if not g.is_admin:
+        return jsonify({'error': 'Forbidden'}), 403
+    # Plain column tuples: no ORM objects to build for what is a straight table dump
+    rows = db.session.execute(select(
+        Account.acct_no, Account.acct_name, Account.acct_street, Account.acct_city, Account.acct_state,
+        Account.acct_zip, Account.acct_type, Account.date_opened, Account.customerid
+    ))
+    accounts_list = [AccountRecord(
+        account_number=acct_no,
+        account_name=acct_name,
+        account_street=acct_street,
+        account_city=acct_city,
+        account_state=acct_state,
+        account_zip=acct_zip,
+        account_type=acct_type,
+        date_opened=date_opened.date(),
+        customer_id=customerid
+    ) for acct_no, acct_name, acct_street, acct_city, acct_state, acct_zip, acct_type, date_opened, customerid in rows]
     return jsonify(accounts_list)
 
 @api_blueprint.route('/register', methods=['POST'])
@@ -74,10 +210,15 @@ def login():
 
     user = Auth.query.filter_by(username=username).first()
     if user and user.check_password(password):
+        # Upgrade hashes made with an older work factor while we have the plain password
+        if user.needs_rehash():
+            user.set_password(password)
+            db.session.commit()
         customer = Customer.query.get(user.customer_id)
         if customer:
             fullname = f"{customer.cfname} {customer.clname}"
-            return jsonify({'message': 'Login successful', 'username': username, 'customer_id': user.customer_id, 'fullname': fullname, 'is_admin': user.is_admin}), 200
+            token = issue_token(user.customer_id, user.is_admin)
+            return jsonify({'message': 'Login successful', 'username': username, 'customer_id': user.customer_id, 'fullname': fullname, 'is_admin': user.is_admin, 'token': token}), 200
         else:
             return jsonify({'error': 'Customer not found'}), 404
     else:
@@ -86,13 +227,16 @@ def login():
 @api_blueprint.route('/create_account', methods=['POST'])
 def create_account():
     data = request.get_json()
-
-    print(data)
+    # Field names only: the values are customer addresses and loan details
+    logger.debug('Create account request', extra={'fields': sorted(data)})
     required_fields = ['acctType', 'acctStreet', 'acctCity', 'acctState', 'acctZip', 'customerId']
 
     if not all(field in data for field in required_fields):
         return jsonify({'error': 'Missing required fields'}), 400
 
+    if not can_access_customer(data['customerId']):
+        return jsonify({'error': 'Forbidden'}), 403
+
     customer = Customer.query.get(data['customerId'])
     if not customer:
         return jsonify({'error': 'Customer not found'}), 404
@@ -109,7 +253,7 @@ def create_account():
         acct_type=data['acctType'],
         date_opened=datetime.utcnow(),
         customerid=data['customerId'],
-        status='pending'  # Assuming all new accounts start as 'pending'
+        status=Account.PENDING  # All new accounts start as pending
     )
     db.session.add(new_account)
     if data['acctType'] == 'Checking':
@@ -118,12 +262,16 @@ def create_account():
             service_charge=data.get('serviceCharge')
         )
         db.session.add(new_checking_account)
+        db.session.flush()  # Flush to apply the default opening balance
+        record_balance_snapshot(account_number, new_checking_account.balance)
     elif data['acctType'] == 'Savings':
         new_savings_account = SavingsAccount(
             acct_no=account_number,
             interest_rate=data.get('interestRate')
         )
         db.session.add(new_savings_account)
+        db.session.flush()  # Flush to apply the default opening balance
+        record_balance_snapshot(account_number, new_savings_account.balance)
     elif data['acctType'] == 'Loan':
         new_loan_account = Loan(
             acct_no=account_number,
@@ -176,14 +324,31 @@ def create_account():
 
 
 
+    invalidate_after_commit(customer.customerid)
     db.session.commit()
     return jsonify({'message': 'Account created', 'account_number': account_number}), 201
 
+@api_blueprint.route('/create_accounts/batch', methods=['POST'])
+def create_accounts_batch():
+    if not g.is_admin:
+        return jsonify({'error': 'Forbidden'}), 403
+    data = request.get_json()
+    rows = data.get('accounts')
+
+    if not isinstance(rows, list) or not rows:
+        return jsonify({'error': 'No accounts provided'}), 400
+    if len(rows) > ACCOUNT_BATCH_MAX_SIZE:
+        return jsonify({'error': f'At most {ACCOUNT_BATCH_MAX_SIZE} accounts per batch'}), 400
+
+    results = onboard_accounts(rows)
+    succeeded = sum(1 for result in results if result['status'] == 'ok')
+    return jsonify({'results': results, 'succeeded': succeeded, 'failed': len(results) - succeeded}), 200
+
 @api_blueprint.route('/get_accounts', methods=['GET'])
+@read_only
+@cached_for_customer
 def get_accounts_customer():
-    print('get accounts called!!')
     customer_id = request.args.get('customer_id')
-    print(customer_id)
     if not customer_id:
         return jsonify({'error': 'Customer ID is required'}), 400
 
@@ -192,64 +357,74 @@ def get_accounts_customer():
     except ValueError:
         return jsonify({'error': 'Invalid customer ID'}), 400
 
-    accounts = Account.query.filter_by(customerid=customer_id).all()
-    print(accounts)
+    if not can_access_customer(customer_id):
+        return jsonify({'error': 'Forbidden'}), 403
+
+    # Load the whole portfolio up front so building the response never goes back to the database
+    accounts = (Account.query
+                .options(joinedload(Account.checking_account),
+                         joinedload(Account.savings_account),
+                         joinedload(Account.loans).joinedload(Loan.student_loan).joinedload(StudentLoan.university),
+                         joinedload(Account.loans).joinedload(Loan.home_loan))
+                .filter_by(customerid=customer_id)
+                .all())
+    logger.debug('Loaded %d accounts', len(accounts), extra={'customer_id': customer_id})
     if not accounts:
         return jsonify({'message': 'No accounts found for this customer'}), 404
 
+    # Hot accounts hold part of their balance in slots
+    unfolded = slot_totals([account.acct_no for account in accounts if account.acct_type in ('Checking', 'Savings')])
     accounts_list = []
     for account in accounts:
-        account_info = {
-            'account_number': account.acct_no,
-            'account_name': account.acct_name,
-            'account_type': account.acct_type,
-            'date_opened': account.date_opened.strftime('%Y-%m-%d'),
-            'status': account.status
-        }
+        account_info = CustomerAccount(
+            account_number=account.acct_no,
+            account_name=account.acct_name,
+            account_type=account.acct_type,
+            date_opened=account.date_opened.date(),
+            status=account.status
+        )
 
         if account.acct_type == 'Checking':
-            checking = CheckingAccount.query.filter_by(acct_no=account.acct_no).first()
-            account_info['balance'] = checking.balance
+            checking = account.checking_account
+            account_info.balance = checking.balance + unfolded.get(account.acct_no, 0)
 
         if account.acct_type == 'Savings':
-            saving = SavingsAccount.query.filter_by(acct_no=account.acct_no).first()
-            account_info['balance'] = saving.balance
+            saving = account.savings_account
+            account_info.balance = saving.balance + unfolded.get(account.acct_no, 0)
 
         if account.acct_type == 'Loan':
-            loan = Loan.query.filter_by(acct_no=account.acct_no).first()
+            loan = account.loans[0] if account.loans else None
             if loan:
-                loan_info = {
-                    'loan_amount': loan.loan_amount,
-                    'loan_rate': loan.loan_rate,
-                    'loan_months': loan.loan_months,
-                    'loan_type': loan.loan_type
-                }
-                account_info['LoanInfo'] = loan_info
+                loan_info = LoanInfo(
+                    loan_amount=loan.loan_amount,
+                    loan_rate=loan.loan_rate,
+                    loan_months=loan.loan_months,
+                    loan_type=loan.loan_type
+                )
+                account_info.loan_info = loan_info
 
                 if loan.loan_type == 'Student':
-                    student_loan = StudentLoan.query.filter_by(acct_no=account.acct_no).join(University).first()
+                    student_loan = loan.student_loan
                     if student_loan:
-                        student_info = {
-                            'student_id': student_loan.studentid,
-                            'status': student_loan.status,
-                            'expected_date': student_loan.expecteddate.strftime('%Y-%m-%d'),
-                            'university_name': student_loan.university.universityname
-                        }
-                        loan_info['StudentInfo'] = student_info
+                        loan_info.student_info = StudentInfo(
+                            student_id=student_loan.studentid,
+                            status=student_loan.status,
+                            expected_date=student_loan.expecteddate.date(),
+                            university_name=student_loan.university.universityname
+                        )
                 elif loan.loan_type == 'Home':
-                    home_loan = HomeLoan.query.filter_by(acct_no=account.acct_no).first()
+                    home_loan = loan.home_loan
                     if home_loan:
-                        home_info = {
-                            'builtyear': home_loan.builtyear,
-                            'hianumber': home_loan.hianumber,
-                            'icname': home_loan.icname,
-                            'icstreet': home_loan.icstreet,
-                            'iccity': home_loan.iccity,
-                            'icstate': home_loan.icstate,
-                            'iczip': home_loan.iczip,
-                            'premium': home_loan.premium
-                        }
-                        loan_info['HomeInfo'] = home_info
+                        loan_info.home_info = HomeInfo(
+                            builtyear=home_loan.builtyear,
+                            hianumber=home_loan.hianumber,
+                            icname=home_loan.icname,
+                            icstreet=home_loan.icstreet,
+                            iccity=home_loan.iccity,
+                            icstate=home_loan.icstate,
+                            iczip=home_loan.iczip,
+                            premium=home_loan.premium
+                        )
 
         accounts_list.append(account_info)
 
@@ -257,158 +432,172 @@ def get_accounts_customer():
     return jsonify(accounts_list)
 
 @api_blueprint.route('/pending_accounts', methods=['GET'])
+@read_only
 def get_pending_accounts():
-    # Query to join Account, Customer, and optionally Loan based on account status 'Pending'
-    results = (db.session.query(Account, Customer, Loan)
-                .join(Customer, Account.customerid == Customer.customerid)
-                .outerjoin(Loan, Account.acct_no == Loan.acct_no)
-                .filter(Account.status == 'Pending')
-                .all())
+    if not g.is_admin:
+        return jsonify({'error': 'Forbidden'}), 403
+    try:
+        limit = min(int(request.args.get('limit', PENDING_PAGE_SIZE)), PENDING_MAX_PAGE_SIZE)
+    except ValueError:
+        return jsonify({'error': 'Invalid limit'}), 400
+    if limit < 1:
+        return jsonify({'error': 'Invalid limit'}), 400
+
+    # Oldest first, walked along the (status, date_opened) index with a keyset cursor
+    query = (db.session.query(Account.acct_no, Account.acct_type, Account.date_opened, Customer.customerid,
+                              Customer.cfname, Customer.clname, Loan.acct_no.label('loan_acct_no'),
+                              Loan.loan_type, Loan.loan_amount)
+             .join(Customer, Account.customerid == Customer.customerid)
+             .outerjoin(Loan, Account.acct_no == Loan.acct_no)
+             .filter(Account.status == Account.PENDING))
+    cursor = request.args.get('cursor')
+    if cursor:
+        try:
+            last_opened, last_acct_no = decode_cursor(cursor)
+            last_acct_no = int(last_acct_no)
+        except ValueError:
+            return jsonify({'error': 'Invalid cursor'}), 400
+        query = query.filter((Account.date_opened > last_opened) |
+                             ((Account.date_opened == last_opened) & (Account.acct_no > last_acct_no)))
+    # Fetch one extra row to know whether another page exists
+    results = query.order_by(Account.date_opened, Account.acct_no).limit(limit + 1).all()
+    next_cursor = None
+    if len(results) > limit:
+        results = results[:limit]
+        next_cursor = encode_cursor(results[-1].date_opened, results[-1].acct_no)
 
     accounts_list = []
-    for account, customer, loan in results:
+    for row in results:
         # Basic account and customer info
-        account_info = {
-            'customer_name': f"{customer.cfname} {customer.clname}",
-            'customer_id': customer.customerid,
-            'account_number': account.acct_no,
-            'account_type': account.acct_type,
-            'loan_type': None,
-            'loan_amount': None
-        }
+        account_info = PendingAccount(
+            customer_name=f"{row.cfname} {row.clname}",
+            customer_id=row.customerid,
+            account_number=row.acct_no,
+            account_type=row.acct_type
+        )
 
         # Include loan info if present
-        if loan:
-            account_info['loan_type'] = loan.loan_type if loan.loan_type else "N/A"
-            account_info['loan_amount'] = loan.loan_amount if loan.loan_amount else "N/A"
+        if row.loan_acct_no is not None:
+            account_info.loan_type = row.loan_type if row.loan_type else "N/A"
+            account_info.loan_amount = row.loan_amount if row.loan_amount else "N/A"
 
         accounts_list.append(account_info)
 
-    return jsonify(accounts_list)
+    return jsonify(PendingPage(accounts=accounts_list, next_cursor=next_cursor))
 
 
 @api_blueprint.route('/approve_accounts', methods=['POST'])
 def approve_accounts():
+    if not g.is_admin:
+        return jsonify({'error': 'Forbidden'}), 403
     data = request.get_json()
     account_numbers = data.get('account_numbers')
 
     if not account_numbers:
         return jsonify({'error': 'No account numbers provided'}), 400
 
-    accounts_to_approve = Account.query.filter(Account.acct_no.in_(account_numbers), Account.status == 'pending').all()
-
-    for account in accounts_to_approve:
-        account.status = 'approved'
+    if not isinstance(account_numbers, list):
+        return jsonify({'error': 'account_numbers must be a list'}), 400
+    try:
+        account_numbers = [int(acct_no) for acct_no in account_numbers]
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Invalid account number'}), 400
 
-    db.session.commit()
+    approved = run_transaction(approve_pending_accounts, account_numbers)
 
-    return jsonify({'message': f'{len(accounts_to_approve)} accounts approved successfully'}), 200
+    return jsonify({'message': f'{len(approved)} accounts approved successfully', 'approved': approved}), 200
 
 @api_blueprint.route('/balances/<int:customer_id>', methods=['GET'])
+@read_only
+@cached_for_customer
 def get_balances(customer_id):
-    # Retrieve all accounts linked to the customer
-    accounts = Account.query.filter_by(customerid=customer_id).all()
-
-    # Initialize balances
-    balances = {
-        'checking_balance': 0,
-        'savings_balance': 0
-    }
-
-    # Iterate over accounts to find checking and savings accounts
-    for account in accounts:
-        if account.acct_type == 'Checking' and hasattr(account, 'checking_account'):
-            balances['checking_balance'] += account.checking_account.balance
-        elif account.acct_type == 'Savings' and hasattr(account, 'savings_account'):
-            balances['savings_balance'] += account.savings_account.balance
+    if not can_access_customer(customer_id):
+        return jsonify({'error': 'Forbidden'}), 403
+    portfolio = customer_portfolio(customer_id)
+    balances = Balances(checking_balance=portfolio['checking_balance'], savings_balance=portfolio['savings_balance'])
 
     # Check if balances were updated from their initial state
-    if balances['checking_balance'] == 0 and balances['savings_balance'] == 0:
+    if balances.checking_balance == 0 and balances.savings_balance == 0:
         return jsonify({'error': 'No checking or savings accounts found for this customer'}), 404
 
     return jsonify(balances), 200
 
 @api_blueprint.route('/transfer_money', methods=['POST'])
+@idempotent
 def transfer_money():
     data = request.get_json()
     from_customer_id = data.get('from_customer_id')
     to_acct_no = data.get('to_acct_no')
     from_account_type = data.get('type')  # 'checking' or 'savings'
-    amount = Decimal(data.get('amount'))
+    amount = data.get('amount')
 
     if not all([from_customer_id, to_acct_no, amount, from_account_type]):
         return jsonify({'error': 'Missing required fields'}), 400
 
-    try:
-        # Start a transaction
-        db.session.begin()
-
-        # Locking accounts for update to ensure atomicity and prevent deadlocks
-        from_account, from_account_main = get_account(from_customer_id, from_account_type, lock=True)
-        to_account, to_account_main = get_account_by_number(to_acct_no, lock=True)
+    if not can_access_customer(from_customer_id):
+        return jsonify({'error': 'Forbidden'}), 403
 
-        if not from_account or not to_account:
-            db.session.rollback()
-            return jsonify({'error': 'One or more accounts not found'}), 404
+    try:
+        # transfer_funds validates the ids and the amount, so bad input is a 400 rather than an error page
+        run_transaction(transfer_funds, from_customer_id, from_account_type, to_acct_no, amount)
+        return jsonify({'message': 'Transfer successful'}), 200
 
-        # account = Account.query.filter_by(acct_no=account_number).one_or_none()
-        from_acct = Account.query.filter_by(customerid=from_customer_id).first()
-        to_acct = Account.query.filter_by(acct_no=to_acct_no).first()
+    except TransferError as e:
+        return jsonify({'error': e.message}), e.status_code
 
-        if from_acct.status == 'pending' or to_acct.status=='pending':
-            db.session.rollback()
-            return jsonify({'error': 'One or more accounts not approved'}), 404
+    except Exception as e:
+        logger.exception('Transfer failed')
+        return jsonify({'error': str(e)}), 500
 
-        print(from_acct.status, to_acct.status)
-        if from_account.balance < amount:
-            db.session.rollback()
-            return jsonify({'error': 'Insufficient funds'}), 403
-
-        # Adjust balances
-        from_account.balance -= amount
-        to_account.balance += amount
-
-        # Create and record the transaction
-        transaction = Transaction(
-            t_id=generate_unique_transaction_id(),
-            from_account=from_account_main.acct_no,
-            to_account=to_account_main.acct_no,
-            amount=amount
-        )
-        db.session.add(transaction)
-        db.session.commit()
-        return jsonify({'message': 'Transfer successful'}), 200
+@api_blueprint.route('/transfer_money/batch', methods=['POST'])
+def transfer_money_batch():
+    data = request.get_json()
+    items = data.get('transfers')
+
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': 'No transfers provided'}), 400
+    if len(items) > TRANSFER_BATCH_MAX_SIZE:
+        return jsonify({'error': f'At most {TRANSFER_BATCH_MAX_SIZE} transfers per batch'}), 400
+
+    # Validate every item up front; only the valid ones reach the database
+    results = []
+    transfers = []
+    for index, item in enumerate(items):
+        try:
+            from_customer_id = int(item.get('from_customer_id'))
+            to_acct_no = int(item.get('to_acct_no'))
+            amount = Decimal(str(item.get('amount')))
+            from_account_type = item.get('type')
+        except (AttributeError, TypeError, ValueError, ArithmeticError):
+            results.append({'index': index, 'error': 'Missing required fields'})
+            continue
+        if not from_account_type or not amount.is_finite() or amount <= 0:
+            results.append({'index': index, 'error': 'Missing required fields'})
+            continue
+        if not can_access_customer(from_customer_id):
+            results.append({'index': index, 'error': 'Forbidden'})
+            continue
+        account_type = 'Checking' if from_account_type.lower() == 'checking' else 'Savings'
+        results.append({'index': index, 'error': None})
+        transfers.append((from_customer_id, account_type, to_acct_no, amount))
 
+    try:
+        errors = run_transaction(apply_transfer_batch, transfers) if transfers else []
     except Exception as e:
-        db.session.rollback()
+        logger.exception('Transfer batch failed')
         return jsonify({'error': str(e)}), 500
 
-def get_account(customer_id, account_type, lock=False):
-    """Fetch account based on type and customer ID with optional locking."""
-    if account_type.lower() == 'checking':
-        account_class = CheckingAccount
-    else:
-        account_class = SavingsAccount
-    query = db.session.query(account_class).join(Account).filter(Account.customerid == customer_id)
-    if lock:
-        query = query.with_for_update()
-    account = query.first()
-    if account:
-        return account, account.account
-    return None, None
-
-def get_account_by_number(account_number, lock=False):
-    """Fetch account by account number with optional locking."""
-    account = Account.query.filter_by(acct_no=account_number).one_or_none()
-    if account:
-        sub_account = CheckingAccount.query.filter_by(acct_no=account_number).first() \
-                     if account.acct_type == 'Checking' else \
-                     SavingsAccount.query.filter_by(acct_no=account_number).first()
-        if lock and sub_account:
-            db.session.query(type(sub_account)).filter_by(acct_no=account_number).with_for_update().first()
-        return sub_account, account
-    return None, None
+    # Fill in the outcome of the items that were applied, in submission order
+    outcomes = iter(errors)
+    for result in results:
+        if result['error'] is None:
+            result['error'] = next(outcomes)
+        result['status'] = 'failed' if result['error'] else 'ok'
+        if not result['error']:
+            del result['error']
 
+    succeeded = sum(1 for result in results if result['status'] == 'ok')
+    return jsonify({'results': results, 'succeeded': succeeded, 'failed': len(results) - succeeded}), 200
 
 @api_blueprint.route('/update_profile', methods=['POST'])
 def update_profile():
@@ -421,6 +610,9 @@ def update_profile():
     if not all([customer_id, current_password]):
         return jsonify({'error': 'Missing required information'}), 400
 
+    if not can_access_customer(customer_id):
+        return jsonify({'error': 'Forbidden'}), 403
+
     # Fetch the user's authentication record
     auth_record = Auth.query.filter_by(customer_id=customer_id).first()
     if not auth_record:
@@ -446,182 +638,325 @@ def update_profile():
 
 
 @api_blueprint.route('/account_balance_over_time/<int:customer_id>', methods=['GET'])
+@cached_for_customer
 def get_account_balance_over_time(customer_id):
+    if not can_access_customer(customer_id):
+        return jsonify({'error': 'Forbidden'}), 403
     # Fetch the customer
     customer = Customer.query.get(customer_id)
     if not customer:
         return jsonify({'error': 'Customer not found'}), 404
 
+    # Date range and resolution of the curve, defaulting to the last 30 days by day
+    try:
+        end = datetime.strptime(request.args['end'], '%Y-%m-%d').date() if 'end' in request.args else datetime.utcnow().date()
+        start = datetime.strptime(request.args['start'], '%Y-%m-%d').date() if 'start' in request.args else end - timedelta(days=30)
+    except ValueError:
+        return jsonify({'error': 'Dates must be formatted as YYYY-MM-DD'}), 400
+    interval = request.args.get('interval', 'daily')
+    if interval not in ('daily', 'weekly', 'monthly'):
+        return jsonify({'error': 'Interval must be daily, weekly or monthly'}), 400
+    if start > end:
+        return jsonify({'error': 'Start date must not be after end date'}), 400
+    if count_balance_points(start, end, interval) > BALANCE_MAX_POINTS:
+        return jsonify({'error': f'At most {BALANCE_MAX_POINTS} points per request; narrow the range or widen the interval'}), 400
+
     # Prepare the response dictionary
     response = {}
 
     # Check for a Checking account
     checking_account = Account.query.filter_by(customerid=customer_id, acct_type='Checking').first()
     if checking_account:
-        checking_balances = calculate_balances(checking_account.acct_no)
+        checking_balances = calculate_balances(checking_account.acct_no, start, end, interval)
         response['checking'] = checking_balances
 
     # Check for a Savings account
     savings_account = Account.query.filter_by(customerid=customer_id, acct_type='Savings').first()
     if savings_account:
-        savings_balances = calculate_balances(savings_account.acct_no)
+        savings_balances = calculate_balances(savings_account.acct_no, start, end, interval)
         response['savings'] = savings_balances
 
     return jsonify(response)
 
 @api_blueprint.route('/loan_status_by_customer/<int:customer_id>', methods=['GET'])
+@cached_for_customer
 def get_loan_status_by_customer(customer_id):
-    # Retrieve all loans linked to any accounts owned by the customer
-    loans = Loan.query.join(Account).filter(Account.customerid == customer_id).all()
-
+    if not can_access_customer(customer_id):
+        return jsonify({'error': 'Forbidden'}), 403
     loans_data = []
 
-    for loan in loans:
-        remaining_loan = loan.loan_amount - loan.loan_payment
-        loans_data.append({
-            'account_number': loan.acct_no,
-            'loan_amount': loan.loan_amount,
-            'loan_paid': loan.loan_payment,
-            'remaining_loan': remaining_loan,
-        })
+    for loan in customer_portfolio(customer_id)['loans']:
+        remaining_loan = loan['loan_amount'] - loan['loan_paid']
+        loans_data.append(LoanStatus(
+            account_number=loan['account_number'],
+            loan_amount=loan['loan_amount'],
+            loan_paid=loan['loan_paid'],
+            remaining_loan=remaining_loan,
+        ))
 
     return jsonify(loans_data)
 
+@api_blueprint.route('/loan_schedule/<int:customer_id>', methods=['GET'])
+@read_only
+@cached_for_customer
+def get_loan_schedule(customer_id):
+    if not can_access_customer(customer_id):
+        return jsonify({'error': 'Forbidden'}), 403
+    try:
+        as_of = datetime.strptime(request.args['as_of'], '%Y-%m-%d').date() if 'as_of' in request.args else datetime.utcnow().date()
+    except ValueError:
+        return jsonify({'error': 'Dates must be formatted as YYYY-MM-DD'}), 400
+
+    book = load_loan_book(customer_id)
+    if not len(book):
+        return jsonify([])
+    summary = summarize(book, as_of)
+    periods = schedules(book)
+    columns = [periods['period'].tolist(), periods['due_date'].tolist(),
+               *(periods[name].round(2).tolist() for name in ('payment', 'interest', 'principal', 'balance'))]
+    payments = [ScheduledPayment(*row) for row in zip(*columns)]
+    loans = []
+    for i in range(len(book)):
+        schedule = payments[periods['offsets'][i]:periods['offsets'][i + 1]]
+        loans.append(LoanSchedule(
+            account_number=int(book.acct_no[i]),
+            loan_type=book.loan_type[i],
+            loan_amount=int(book.principal[i]),
+            annual_rate=float(book.annual_rate[i]),
+            months=int(book.months[i]),
+            monthly_payment=round(float(summary['monthly_payment'][i]), 2),
+            total_interest=round(float(summary['total_interest'][i]), 2),
+            periods_elapsed=int(summary['periods_elapsed'][i]),
+            interest_to_date=round(float(summary['interest_to_date'][i]), 2),
+            scheduled_balance=round(float(summary['scheduled_balance'][i]), 2),
+            loan_paid=int(book.paid[i]),
+            remaining_loan=int(summary['remaining_loan'][i]),
+            remaining_periods=int(summary['remaining_periods'][i]),
+            payoff_date=summary['payoff_date'][i].tolist(),
+            projected_payoff_date=summary['projected_payoff_date'][i].tolist(),
+            status=str(summary['status'][i]),
+            schedule=schedule,
+        ))
+    return jsonify(loans)
+
+@api_blueprint.route('/portfolio/<int:customer_id>', methods=['GET'])
+@read_only
+@cached_for_customer
+def get_portfolio(customer_id):
+    if not can_access_customer(customer_id):
+        return jsonify({'error': 'Forbidden'}), 403
+    portfolio = customer_portfolio(customer_id)
+    if not portfolio['status_counts']:
+        return jsonify({'error': 'No accounts found for this customer'}), 404
+
+    # Loans are rolled up by type here, the statement keeps them apart for /loan_status_by_customer
+    loans = {}
+    for loan in portfolio['loans']:
+        totals = loans.setdefault(loan['loan_type'], LoanTotals(count=0, principal=0, paid=0, outstanding=0))
+        totals.count += 1
+        totals.principal += loan['loan_amount']
+        totals.paid += loan['loan_paid']
+        totals.outstanding += loan['loan_amount'] - loan['loan_paid']
+
+    return jsonify(Portfolio(
+        customer_id=customer_id,
+        checking_balance=portfolio['checking_balance'],
+        savings_balance=portfolio['savings_balance'],
+        loans=loans,
+        accounts_by_status=portfolio['status_counts'],
+        account_count=sum(portfolio['status_counts'].values())
+    )), 200
+
+def format_transaction(transaction):
+    return TransactionRecord(
+        transaction_id=transaction.t_id,
+        from_account=transaction.from_account,
+        to_account=transaction.to_account,
+        amount=transaction.amount,
+        timestamp=transaction.timestamp.isoformat(' ', 'seconds')  # Same text as strftime('%Y-%m-%d %H:%M:%S'), much cheaper
+    )
+
 @api_blueprint.route('/transactions/<int:customer_id>', methods=['GET'])
+@read_only
 def get_customer_transactions(customer_id):
-    # First, find all account numbers associated with the customer
-    accounts = Account.query.filter_by(customerid=customer_id).all()
-    account_numbers = [account.acct_no for account in accounts]
-
-    # Then, retrieve all transactions that involve any of these account numbers
-    transactions = Transaction.query.filter(
-        (Transaction.from_account.in_(account_numbers)) | (Transaction.to_account.in_(account_numbers))
-    ).all()
-
-    # Format the transactions for the response
-    transactions_data = [{
-        'transaction_id': transaction.t_id,
-        'from_account': transaction.from_account,
-        'to_account': transaction.to_account,
-        'amount': str(transaction.amount),
-        'timestamp': transaction.timestamp.strftime('%Y-%m-%d %H:%M:%S')
-    } for transaction in transactions]
-
-    return jsonify(transactions_data), 200
+    if not can_access_customer(customer_id):
+        return jsonify({'error': 'Forbidden'}), 403
+    # Account numbers owned by the customer, kept as a subquery so it runs inside the main query
+    account_numbers = select(Account.acct_no).where(Account.customerid == customer_id)
+
+    # Streaming mode: one JSON object per line, read from a server-side cursor in small batches
+    if request.args.get('format') == 'ndjson':
+        query = account_transactions(account_numbers)
+        encoder = current_app.json.encoder
+        def generate():
+            for transaction in query.execution_options(stream_results=True).yield_per(TRANSACTION_STREAM_BATCH_SIZE):
+                yield encoder.encode(format_transaction(transaction)) + b'\n'
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+    try:
+        limit = min(int(request.args.get('limit', TRANSACTION_PAGE_SIZE)), TRANSACTION_MAX_PAGE_SIZE)
+    except ValueError:
+        return jsonify({'error': 'Invalid limit'}), 400
+    if limit < 1:
+        return jsonify({'error': 'Invalid limit'}), 400
+
+    after = None
+    cursor = request.args.get('cursor')
+    if cursor:
+        try:
+            after = decode_transaction_cursor(cursor)
+        except ValueError:
+            return jsonify({'error': 'Invalid cursor'}), 400
+
+    # Fetch one extra row to know whether another page exists
+    transactions = account_transactions(account_numbers, after=after, limit=limit + 1).all()
+    next_cursor = None
+    if len(transactions) > limit:
+        transactions = transactions[:limit]
+        next_cursor = encode_transaction_cursor(transactions[-1])
+
+    return jsonify(TransactionPage(
+        transactions=[format_transaction(transaction) for transaction in transactions],
+        next_cursor=next_cursor
+    )), 200
+
+@api_blueprint.route('/statements/<int:customer_id>', methods=['GET'])
+@read_only
+def get_statement(customer_id):
+    """Stream a statement of the customer's checking and savings accounts as CSV or Parquet.
+
+    Optional `start` and `end` (YYYY-MM-DD, inclusive) bound the dates; `account` (repeatable)
+    limits it to some of the customer's accounts.
+    """
+    if not can_access_customer(customer_id):
+        return jsonify({'error': 'Forbidden'}), 403
+    try:
+        start, end = parse_statement_range(request.args.get('start'), request.args.get('end'))
+        accounts = [int(acct_no) for acct_no in request.args.getlist('account')] or None
+    except ValueError:
+        return jsonify({'error': 'Invalid date range or account number'}), 400
+    export_format = request.args.get('format', 'csv')
+    if export_format not in STATEMENT_FORMATS:
+        return jsonify({'error': 'format must be csv or parquet'}), 400
+    if export_format == 'parquet' and not parquet_available():
+        return jsonify({'error': 'Parquet export is not available on this server'}), 501
+
+    account_numbers = list(deposit_account_numbers(customer_id, accounts))
+    if accounts and set(accounts) - set(account_numbers):
+        return jsonify({'error': 'Account not found'}), 404
+
+    encode, mimetype = STATEMENT_FORMATS[export_format]
+    filename = f"statement-{customer_id}-{request.args.get('start', 'all')}-{request.args.get('end', 'now')}.{export_format}"
+    return Response(stream_with_context(encode(statement_rows(account_numbers, start, end))), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+@api_blueprint.route('/pool_stats', methods=['GET'])
+def get_pool_stats():
+    if not g.is_admin:
+        return jsonify({'error': 'Forbidden'}), 403
+    return jsonify(pool_stats(db.engines)), 200
+
+@api_blueprint.route('/cache_stats', methods=['GET'])
+def get_cache_stats():
+    if not g.is_admin:
+        return jsonify({'error': 'Forbidden'}), 403
+    cache = get_response_cache()
+    return jsonify(cache.snapshot() if cache else {'backend': None}), 200
+
+@api_blueprint.route('/metrics', methods=['GET'])
+def get_metrics_text():
+    # Scrapers do not log in, so this is guarded by its own optional token instead of a session
+    token = current_app.config['METRICS_TOKEN']
+    if token and not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return jsonify({'error': 'Forbidden'}), 403
+    metrics = get_metrics()
+    if metrics is None:
+        return jsonify({'error': 'Metrics are disabled'}), 404
+    return Response(metrics.render(db.engines, get_response_cache()), 200,
+                    content_type='text/plain; version=0.0.4; charset=utf-8')
 
 @api_blueprint.route('/delete_account', methods=['POST'])
 def delete_account():
     pass
 @api_blueprint.route('/add_funds', methods=['POST'])
+@idempotent
 def add_funds():
     data = request.get_json()
     customer_id = data.get('customer_id')
     payment_method_id = data.get('paymentMethodId')
     amount = data.get('amount')
 
-    amount_in_cents = int(Decimal(amount) * 100)
-
-    try:
-        # Correctly configure the PaymentIntent to avoid redirect-based payment methods
-        intent = stripe.PaymentIntent.create(
-            amount=amount_in_cents,
-            currency='usd',
-            payment_method=payment_method_id,
-            confirm=True,  # Automatically confirm the payment
-            automatic_payment_methods={
-                'enabled': True,
-                'allow_redirects': 'never'  # Correct usage according to the Stripe documentation
-            }
-        )
-
-        if intent.status == 'succeeded':
-            # If payment is successful, update the user's checking account
-            account = CheckingAccount.query.join(Account).filter(
-                Account.customerid == customer_id,
-                Account.acct_type == 'Checking'
-            ).first()
-
-            if account:
-                account.balance += Decimal(amount)
-                db.session.commit()
-                transaction_id = generate_unique_transaction_id()
-
-                # Record the transaction as both from and to the same account
-                transaction = Transaction(
-                    t_id=transaction_id,
-                    from_account=account.acct_no,
-                    to_account=account.acct_no,
-                    amount=Decimal(amount)
-                )
-                db.session.add(transaction)
-                db.session.commit()
+    if not all([customer_id, payment_method_id, amount]):
+        return jsonify({'error': 'Missing required fields'}), 400
 
-                return jsonify({'message': 'Payment successful and funds added', 'new_balance': str(account.balance)}), 200
-            else:
-                return jsonify({'error': 'Checking account not found'}), 404
-        else:
-            return jsonify({'error': 'Payment failed', 'details': intent.status}), 400
+    if not can_access_customer(customer_id):
+        return jsonify({'error': 'Forbidden'}), 403
 
-    except stripe.error.StripeError as e:
-        return jsonify({'error': str(e)}), 400
+    try:
+        amount = Decimal(str(amount)).quantize(Decimal('0.01'))
+    except ArithmeticError:
+        return jsonify({'error': 'Invalid amount'}), 400
+    if not amount.is_finite() or amount <= 0:
+        return jsonify({'error': 'Invalid amount'}), 400
+
+    account = CheckingAccount.query.join(Account).filter(
+        Account.customerid == customer_id,
+        Account.acct_type == 'Checking'
+    ).first()
+    if not account:
+        return jsonify({'error': 'Checking account not found'}), 404
+
+    # Record the intent and answer right away; the payment is confirmed and credited by the settlement workers
+    intent = FundingIntent(
+        intent_id=uuid.uuid4().hex,
+        customer_id=customer_id,
+        acct_no=account.acct_no,
+        amount=amount,
+        payment_method_id=payment_method_id,
+        status='pending'
+    )
+    db.session.add(intent)
+    db.session.commit()
 
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    status = submit_settlement(intent.intent_id)
+    return jsonify({'message': 'Payment submitted', 'intent_id': intent.intent_id, 'status': status}), 202
 
+@api_blueprint.route('/add_funds/<intent_id>', methods=['GET'])
+def get_funding_status(intent_id):
+    intent = db.session.get(FundingIntent, intent_id)
+    if not intent or not can_access_customer(intent.customer_id):
+        return jsonify({'error': 'Funding request not found'}), 404
 
+    return jsonify({
+        'intent_id': intent.intent_id,
+        'status': intent.status,
+        'amount': str(intent.amount),
+        'error': intent.error,
+        'transaction_id': intent.t_id
+    }), 200
 
 
     # For now, just return a success message with the received amount
 @api_blueprint.route('/pay_loan', methods=['POST'])
+@idempotent
 def pay_loan():
     data = request.get_json()
     loan_account_number = data.get('loanAccountNumber')
     payment_account_type = data.get('paymentAccountType')
-    payment_amount = Decimal(data.get('paymentAmount'))
+    payment_amount = data.get('paymentAmount')
     customer_id = data.get('customerId')
 
     if not all([loan_account_number, payment_account_type, payment_amount, customer_id]):
         return jsonify({'error': 'Missing required fields'}), 400
 
-    # Fetch the loan account
-    loan_account = Loan.query.join(Account).filter(Account.acct_no == loan_account_number).first()
-    if not loan_account:
-        return jsonify({'error': 'Loan account not found'}), 404
+    if not can_access_customer(customer_id):
+        return jsonify({'error': 'Forbidden'}), 403
 
-    # Check if the loan is already fully paid
-    if loan_account.loan_amount <= loan_account.loan_payment:
-        return jsonify({'error': 'Loan already fully paid'}), 400
-
-    # Fetch the payment source account
-    if payment_account_type.lower() == 'checking':
-        payment_account = CheckingAccount.query.join(Account).filter(Account.customerid == customer_id).first()
-    elif payment_account_type.lower() == 'savings':
-        payment_account = SavingsAccount.query.join(Account).filter(Account.customerid == customer_id).first()
-    else:
-        return jsonify({'error': 'Invalid account type specified'}), 400
-
-    if not payment_account:
-        return jsonify({'error': 'Payment account not found'}), 404
-
-    # Check if there are sufficient funds in the payment account
-    if payment_account.balance < payment_amount:
-        return jsonify({'error': 'Insufficient funds'}), 403
-
-    # Process the payment
-    payment_account.balance -= payment_amount
-    loan_account.loan_payment += payment_amount
-    remaining_balance = loan_account.loan_amount - loan_account.loan_payment
-
-    # Create a transaction record
-    transaction = Transaction(
-        t_id=generate_unique_transaction_id(),
-        from_account=payment_account.acct_no,
-        to_account=loan_account.account.acct_no,
-        amount=payment_amount
-    )
-    db.session.add(transaction)
-
-    db.session.commit()
+    try:
+        remaining_balance = run_transaction(pay_loan_from_account, customer_id, payment_account_type,
+                                            loan_account_number, payment_amount)
+    except TransferError as e:
+        return jsonify({'error': e.message}), e.status_code
 
     return jsonify({
         'message': 'Payment successful',
@@ -0,0 +1,164 @@
+from datetime import date
+from decimal import Decimal
+from typing import Optional, Union
+import msgspec
+from msgspec import Struct, UnsetType, UNSET, field
+from flask.json.provider import DefaultJSONProvider
+
+
+class MsgspecJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider that encodes responses with msgspec.
+
+    Structs, Decimal, date and datetime are encoded natively (Decimal as a string, dates as
+    ISO 8601), so views can hand jsonify() typed rows without converting each field first.
+    Anything else falls back to Flask's default conversions. Request bodies are still parsed
+    by the standard library, which keeps Flask's handling of malformed JSON.
+    """
+
+    def __init__(self, app):
+        super().__init__(app)
+        self.encoder = msgspec.json.Encoder(enc_hook=self.default)
+
+    def dumps(self, obj, **kwargs):
+        return self.encoder.encode(obj).decode('utf-8')
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self.encoder.encode(obj), mimetype=self.mimetype)
+
+
+class AccountRecord(Struct):
+    """One row of the admin /accounts listing."""
+    account_number: int
+    account_name: str
+    account_street: str
+    account_city: str
+    account_state: str
+    account_zip: int
+    account_type: str
+    date_opened: date
+    customer_id: int
+
+
+class StudentInfo(Struct):
+    student_id: int
+    status: str
+    expected_date: date
+    university_name: str
+
+
+class HomeInfo(Struct):
+    builtyear: int
+    hianumber: int
+    icname: str
+    icstreet: str
+    iccity: str
+    icstate: str
+    iczip: int
+    premium: int
+
+
+class LoanInfo(Struct, omit_defaults=True):
+    loan_amount: int
+    loan_rate: float
+    loan_months: int
+    loan_type: str
+    student_info: Union[StudentInfo, UnsetType] = field(default=UNSET, name='StudentInfo')
+    home_info: Union[HomeInfo, UnsetType] = field(default=UNSET, name='HomeInfo')
+
+
+class CustomerAccount(Struct, omit_defaults=True):
+    """One account of a customer's /get_accounts portfolio; balance or LoanInfo depending on its type."""
+    account_number: int
+    account_name: str
+    account_type: str
+    date_opened: date
+    status: str
+    balance: Union[Decimal, UnsetType] = UNSET
+    loan_info: Union[LoanInfo, UnsetType] = field(default=UNSET, name='LoanInfo')
+
+
+class PendingAccount(Struct):
+    customer_name: str
+    customer_id: int
+    account_number: int
+    account_type: str
+    loan_type: Optional[str] = None
+    loan_amount: Union[int, str, None] = None
+
+
+class PendingPage(Struct):
+    accounts: list[PendingAccount]
+    next_cursor: Optional[str]
+
+
+class Balances(Struct):
+    checking_balance: Union[Decimal, int]
+    savings_balance: Union[Decimal, int]
+
+
+class LoanStatus(Struct):
+    account_number: int
+    loan_amount: int
+    loan_paid: Union[int, Decimal]
+    remaining_loan: Union[int, Decimal]
+
+
+class ScheduledPayment(Struct):
+    period: int
+    due_date: date
+    payment: float
+    interest: float
+    principal: float
+    balance: float
+
+
+class LoanSchedule(Struct):
+    """/loan_schedule entry: the loan's terms, where it stands as of `as_of`, and every scheduled payment."""
+    account_number: int
+    loan_type: str
+    loan_amount: int
+    annual_rate: float
+    months: int
+    monthly_payment: float
+    total_interest: float
+    periods_elapsed: int
+    interest_to_date: float
+    scheduled_balance: float
+    loan_paid: int
+    remaining_loan: int
+    remaining_periods: int
+    payoff_date: date
+    projected_payoff_date: Optional[date]
+    status: str
+    schedule: list[ScheduledPayment]
+
+
+class LoanTotals(Struct):
+    count: int
+    principal: int
+    paid: int
+    outstanding: int
+
+
+class Portfolio(Struct):
+    """/portfolio summary: deposit totals, loans rolled up by loan_type and account counts by status."""
+    customer_id: int
+    checking_balance: Union[Decimal, int]
+    savings_balance: Union[Decimal, int]
+    loans: dict[str, LoanTotals]
+    accounts_by_status: dict[str, int]
+    account_count: int
+
+
+class TransactionRecord(Struct):
+    transaction_id: str
+    from_account: int
+    to_account: int
+    amount: Decimal
+    timestamp: str  # 'YYYY-MM-DD HH:MM:SS', the format clients already parse
+
+
+class TransactionPage(Struct):
+    transactions: list[TransactionRecord]
+    next_cursor: Optional[str]
@@ -0,0 +1,345 @@
+import csv
+import json
+import os
+import time
+from datetime import datetime, date
+import click
+from sqlalchemy import select, text, func
+from flask import current_app
+from flask.cli import with_appcontext
+from app import db
+from app.database import REPLICA_BIND
+from app.models import (Account, Customer, University, Transaction, CheckingAccount, SavingsAccount, BalanceSnapshot,
+                        PostingRun, BalanceSlot, IdempotencyKey, FundingIntent)
+from app.utils.helpers import backfill_balance_snapshots
+from app.utils.settlement import settle_pending_intents
+from app.utils.onboarding import onboard_accounts, ONBOARDING_CHUNK_SIZE
+from app.utils.passwords import hash_password
+from app.utils import datagen
+from app.utils.statements import STATEMENT_FORMATS, parse_statement_range, deposit_account_numbers, statement_rows
+from app.utils.transfers import run_transaction, fold_hot_account, make_account_hot, TransferError
+from app.utils.posting import POSTING_KINDS, POSTING_CHUNK_SIZE, POSTING_DUTY_CYCLE, previous_month, run_posting
+from app.utils.idempotency import sweep_expired_keys
+from app.utils.amortization import LOAN_BATCH, LOAN_REPORT_COLUMNS, loan_book_batches, summarize, report_rows, totals_by_type
+
+
+@click.command('create-indexes')
+@with_appcontext
+def create_indexes():
+    """Create any indexes declared on the models that are missing from an existing database."""
+    for index in [*Transaction.__table__.indexes, *Account.__table__.indexes]:
+        index.create(db.engine, checkfirst=True)
+        click.echo(f'Ensured index {index.name}')
+
+
+@click.command('create-tables')
+@with_appcontext
+def create_tables():
+    """Create any tables declared on the models that are missing from an existing database; run it on every deploy."""
+    for table in db.metadata.sorted_tables:
+        table.create(db.engine, checkfirst=True)
+        click.echo(f'Ensured table {table.name}')
+
+
+@click.command('widen-transaction-ids')
+@with_appcontext
+def widen_transaction_ids():
+    """Widen pba_transactions.t_id on an existing database to fit allocator-generated IDs."""
+    if db.engine.dialect.name != 'mysql':
+        click.echo('Nothing to do for this database')
+        return
+    with db.engine.begin() as conn:
+        conn.execute(text('ALTER TABLE pba_transactions MODIFY t_id VARCHAR(20) NOT NULL'))
+    click.echo('Widened pba_transactions.t_id to VARCHAR(20)')
+
+
+@click.command('backfill-balance-snapshots')
+@click.option('--account', 'account_numbers', type=int, multiple=True, help='Only rebuild these accounts.')
+@click.option('--batch-size', default=100, show_default=True, help='Accounts per commit.')
+@with_appcontext
+def backfill_balance_snapshots_command(account_numbers, batch_size):
+    """Rebuild daily balance snapshots from the transaction history."""
+    BalanceSnapshot.__table__.create(db.engine, checkfirst=True)
+    if not account_numbers:
+        account_numbers = [acct_no for (acct_no,) in db.session.query(CheckingAccount.acct_no)
+                           .union(db.session.query(SavingsAccount.acct_no)).order_by(CheckingAccount.acct_no)]
+    written = 0
+    for position, acct_no in enumerate(account_numbers, start=1):
+        written += backfill_balance_snapshots(acct_no)
+        if position % batch_size == 0:
+            db.session.commit()
+    db.session.commit()
+    click.echo(f'Wrote {written} snapshots for {len(account_numbers)} accounts')
+
+
+@click.command('settle-funding-intents')
+@click.option('--limit', type=int, help='Settle at most this many intents.')
+@with_appcontext
+def settle_funding_intents(limit):
+    """Settle pending funding intents and retry ones abandoned by a crashed worker."""
+    FundingIntent.__table__.create(db.engine, checkfirst=True)
+    outcomes = settle_pending_intents(limit)
+    for status in ('succeeded', 'failed', 'pending'):
+        click.echo(f'{status}: {sum(1 for outcome in outcomes.values() if outcome == status)}')
+
+
+@click.command('sync-local-replica')
+@with_appcontext
+def sync_local_replica():
+    """Copy the SQLite primary over the SQLite replica stand-in (local profile only)."""
+    engines = db.engines
+    if REPLICA_BIND not in engines:
+        click.echo('No replica configured')
+        return
+    primary, replica = engines[None], engines[REPLICA_BIND]
+    if primary.dialect.name != 'sqlite' or replica.dialect.name != 'sqlite':
+        click.echo('Only SQLite stand-ins can be synced; real replicas follow the primary themselves')
+        return
+    replica.dispose()
+    with primary.connect() as source, replica.connect() as target:
+        source.connection.driver_connection.backup(target.connection.driver_connection)
+    click.echo('Replica now matches the primary')
+
+
+@click.command('import-accounts')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--chunk-size', default=ONBOARDING_CHUNK_SIZE, show_default=True, help='Accounts per commit.')
+@with_appcontext
+def import_accounts(path, chunk_size):
+    """Create accounts from a CSV, JSON array or JSON-lines file of /create_account rows."""
+    with open(path, newline='') as f:
+        if path.endswith('.csv'):
+            rows = list(csv.DictReader(f))
+        elif path.endswith('.json'):
+            rows = json.load(f)
+        else:
+            rows = [json.loads(line) for line in f if line.strip()]
+    results = onboard_accounts(rows, chunk_size)
+    failed = [result for result in results if result['status'] == 'failed']
+    for result in failed:
+        # Report file lines for CSV (header is line 1), zero-based positions otherwise
+        position = f"line {result['index'] + 2}" if path.endswith('.csv') else f"row {result['index']}"
+        click.echo(f"{position}: {result['error']}", err=True)
+    click.echo(f'Created {len(results) - len(failed)} accounts, {len(failed)} failed')
+
+
+@click.command('normalize-account-statuses')
+@with_appcontext
+def normalize_account_statuses():
+    """Rewrite account statuses in their canonical lower-case form (e.g. 'Pending' -> 'pending')."""
+    with db.engine.begin() as conn:
+        # No WHERE: a case-insensitive collation would treat 'Pending' and 'pending' as already equal
+        updated = conn.execute(Account.__table__.update().values(status=func.lower(func.trim(Account.status))))
+    click.echo(f'Normalized {updated.rowcount} account statuses')
+
+
+@click.command('generate-data')
+@click.option('--customers', default=10000, show_default=True, help='Customers to create (each with 1-3 accounts).')
+@click.option('--transactions', default=100000, show_default=True, help='Transactions to create.')
+@click.option('--days', default=365, show_default=True, help='Days of history the transactions are spread over.')
+@click.option('--end-date', type=click.DateTime(['%Y-%m-%d']), help='Last day of history (default today).')
+@click.option('--skew', default=3.0, show_default=True, help='Hot-account skew; 1 is uniform, higher concentrates traffic.')
+@click.option('--seed', default=42, show_default=True, help='Same seed and options give the same dataset.')
+@click.option('--chunk-size', default=20000, show_default=True, help='Rows generated and inserted per chunk.')
+@click.option('--processes', default=os.cpu_count() or 1, show_default=True, help='Worker processes.')
+@click.option('--password-pool', default=8, show_default=True,
+              help='Distinct passwords (password0..N-1), each hashed once and shared by many users.')
+@click.option('--output-dir', type=click.Path(file_okay=False), help='Write CSV files for a native bulk load instead of inserting.')
+@click.option('--reset', is_flag=True, help='Drop and recreate all tables first.')
+@with_appcontext
+def generate_data(customers, transactions, days, end_date, skew, seed, chunk_size, processes, password_pool,
+                  output_dir, reset):
+    """Fill the database with a deterministic synthetic dataset for load testing."""
+    if not output_dir:
+        if reset:
+            db.drop_all()
+            db.create_all()
+        elif db.session.query(Customer.customerid).first() or db.session.query(University.universityid).first():
+            raise click.ClickException('The database already has customers or universities; use --reset to replace them')
+    end = datetime.combine(end_date.date() if end_date else date.today(), datetime.min.time())
+    settings = {
+        'database_url': db.engine.url.render_as_string(hide_password=False),
+        'output_dir': output_dir,
+        'seed': seed,
+        'customers': customers,
+        'transactions': transactions,
+        'days': days,
+        'end': end,
+        'skew': skew,
+        'password_hashes': [hash_password(f'password{k}') for k in range(password_pool)],
+    }
+
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+        with open(os.path.join(output_dir, 'pba_university.csv'), 'w', newline='') as f:
+            csv.writer(f).writerows([university_id, f'State University {university_id}']
+                                    for university_id in range(1, datagen.UNIVERSITY_COUNT + 1))
+        # Loading this keeps the allocators clear of the generated account numbers and transaction ids
+        with open(os.path.join(output_dir, 'pba_id_sequence.csv'), 'w', newline='') as f:
+            csv.writer(f).writerows(datagen.id_sequence_ends(customers, transactions).items())
+    else:
+        with db.engine.begin() as conn:
+            datagen.seed_universities(conn)
+    db.session.remove()
+    db.engine.dispose()  # Connections must not be shared with the forked workers
+
+    started = time.perf_counter()
+    def progress(kind, written):
+        elapsed = time.perf_counter() - started
+        click.echo(f'\r{kind}: {written} rows in {elapsed:.0f}s ({written / max(elapsed, 1e-6):.0f} rows/s)', nl=False)
+    totals = datagen.run_generation(settings, chunk_size, processes, progress)
+    click.echo()
+
+    if output_dir:
+        click.echo(f'Wrote CSV files under {output_dir}. Load them into empty tables in this order:')
+        click.echo('  pba_university.csv, pba_id_sequence.csv, then the directories pba_customer, pba_auth, '
+                   'pba_account, pba_checking, pba_savings, pba_loan, pba_student, pba_personal, pba_home, '
+                   'pba_transactions')
+        click.echo("On MySQL: LOAD DATA LOCAL INFILE '<file>' INTO TABLE <table> "
+                   "FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"'")
+    else:
+        with db.engine.begin() as conn:
+            datagen.advance_id_sequences(conn, customers, transactions)
+    click.echo(f"Generated {totals['customers']} customer/account rows and {totals['transactions']} transactions "
+               f'in {time.perf_counter() - started:.1f}s')
+
+
+@click.command('export-statements')
+@click.argument('output', type=click.Path(dir_okay=False, writable=True))
+@click.option('--customer', 'customer_id', type=int, help='Only this customer\'s accounts.')
+@click.option('--account', 'account_numbers', type=int, multiple=True, help='Only these accounts.')
+@click.option('--start', help='First day, YYYY-MM-DD (default: the beginning).')
+@click.option('--end', help='Last day, YYYY-MM-DD, inclusive (default: today).')
+@click.option('--format', 'export_format', type=click.Choice(sorted(STATEMENT_FORMATS)), default='csv', show_default=True)
+@with_appcontext
+def export_statements(output, customer_id, account_numbers, start, end, export_format):
+    """Write statements with running balances to OUTPUT; every deposit account unless filtered."""
+    try:
+        start, end = parse_statement_range(start, end)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+    accounts = deposit_account_numbers(customer_id, list(account_numbers) or None)
+    encode, _ = STATEMENT_FORMATS[export_format]
+    rows = 0
+    def counted(statement):
+        nonlocal rows
+        for row in statement:
+            rows += 1
+            yield row
+    started = time.perf_counter()
+    with open(output, 'wb') as f:
+        for chunk in encode(counted(statement_rows(accounts, start, end))):
+            f.write(chunk)
+    click.echo(f'Wrote {rows} statement lines to {output} in {time.perf_counter() - started:.1f}s')
+
+
+@click.command('loan-report')
+@click.argument('output', type=click.Path(dir_okay=False, writable=True))
+@click.option('--as-of', type=click.DateTime(['%Y-%m-%d']), help='Report date (default today).')
+@click.option('--batch-size', default=LOAN_BATCH, show_default=True, help='Loans read and computed at a time.')
+@with_appcontext
+def loan_report(output, as_of, batch_size):
+    """Write the amortization position of every loan to OUTPUT as CSV, with totals by loan type."""
+    as_of = as_of.date() if as_of else date.today()
+    totals = {}
+    loans = 0
+    started = time.perf_counter()
+    with open(output, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(LOAN_REPORT_COLUMNS)
+        for book in loan_book_batches(batch_size):
+            summary = summarize(book, as_of)
+            writer.writerows(report_rows(book, summary))
+            for loan_type, batch_total in totals_by_type(book, summary).items():
+                total = totals.setdefault(loan_type, dict.fromkeys(batch_total, 0))
+                for name, value in batch_total.items():
+                    total[name] += value
+            loans += len(book)
+    for loan_type, total in sorted(totals.items()):
+        click.echo(f"{loan_type}: {total['loans']} loans, principal {total['principal']}, outstanding "
+                   f"{total['outstanding']}, interest to date {total['interest_to_date']:.2f}, {total['behind']} behind")
+    click.echo(f'Wrote {loans} loans as of {as_of} to {output} in {time.perf_counter() - started:.1f}s')
+
+
+@click.command('post-monthly-charges')
+@click.option('--month', help='Month to post, YYYY-MM (default: last month).')
+@click.option('--kind', 'kinds', type=click.Choice(sorted(POSTING_KINDS)), multiple=True,
+              help='Only these postings (default: all of them).')
+@click.option('--chunk-size', default=POSTING_CHUNK_SIZE, show_default=True, help='Accounts per transaction.')
+@click.option('--duty-cycle', type=click.FloatRange(0.01, 1.0), default=POSTING_DUTY_CYCLE, show_default=True,
+              help='Share of the time spent holding row locks; the job sleeps for the rest.')
+@with_appcontext
+def post_monthly_charges(month, kinds, chunk_size, duty_cycle):
+    """Post savings interest and checking service charges for a month; resumes an interrupted run."""
+    month = month or previous_month()
+    try:
+        datetime.strptime(month, '%Y-%m')
+    except ValueError:
+        raise click.BadParameter('Month must be formatted as YYYY-MM')
+    PostingRun.__table__.create(db.engine, checkfirst=True)
+    for kind in kinds or sorted(POSTING_KINDS):
+        previous = db.session.get(PostingRun, f'{kind}:{month}')
+        if previous is not None and previous.status == 'running':
+            click.echo(f'{previous.run_key}: resuming after account {previous.last_acct_no}')
+        db.session.rollback()
+        started = time.perf_counter()
+        run = run_posting(kind, month, chunk_size, duty_cycle)
+        click.echo(f'{run.run_key}: {run.accounts_posted} accounts posted, total {run.total}, '
+                   f'{time.perf_counter() - started:.1f}s')
+
+
+@click.command('hot-account')
+@click.argument('acct_no', type=int)
+@click.option('--slots', type=click.IntRange(0, 1024), default=16, show_default=True,
+              help='Balance slots credits are spread over; 0 folds them back and turns hot mode off.')
+@with_appcontext
+def hot_account(acct_no, slots):
+    """Turn hot-account mode on or off for a checking or savings account that receives many transfers."""
+    BalanceSlot.__table__.create(db.engine, checkfirst=True)
+    try:
+        run_transaction(make_account_hot, acct_no, slots)
+    except TransferError as e:
+        raise click.ClickException(e.message)
+    click.echo(f'Account {acct_no} now has {slots} balance slots' if slots else f'Account {acct_no} is no longer hot')
+
+
+@click.command('fold-balance-slots')
+@click.option('--account', 'account_numbers', type=int, multiple=True, help='Only these accounts.')
+@with_appcontext
+def fold_balance_slots(account_numbers):
+    """Move the credits held in hot accounts' balance slots into their balance rows; run it every few minutes."""
+    if not account_numbers:
+        account_numbers = db.session.execute(select(BalanceSlot.acct_no).distinct()
+                                             .order_by(BalanceSlot.acct_no)).scalars().all()
+    for acct_no in account_numbers:
+        # One short transaction per account, so credits to the others carry on meanwhile
+        folded = run_transaction(fold_hot_account, acct_no)
+        click.echo(f'Account {acct_no}: folded {folded}')
+
+
+@click.command('sweep-idempotency-keys')
+@click.option('--ttl', type=int, help='Seconds a key is kept (default: IDEMPOTENCY_TTL).')
+@with_appcontext
+def sweep_idempotency_keys(ttl):
+    """Create the idempotency key table if missing and delete expired keys; each worker also does this on its own."""
+    IdempotencyKey.__table__.create(db.engine, checkfirst=True)
+    deleted = sweep_expired_keys(ttl if ttl is not None else current_app.config['IDEMPOTENCY_TTL'])
+    click.echo(f'Deleted {deleted} expired idempotency keys')
+
+
+def register_commands(app):
+    app.cli.add_command(create_indexes)
+    app.cli.add_command(create_tables)
+    app.cli.add_command(widen_transaction_ids)
+    app.cli.add_command(backfill_balance_snapshots_command)
+    app.cli.add_command(settle_funding_intents)
+    app.cli.add_command(sync_local_replica)
+    app.cli.add_command(import_accounts)
+    app.cli.add_command(normalize_account_statuses)
+    app.cli.add_command(generate_data)
+    app.cli.add_command(export_statements)
+    app.cli.add_command(loan_report)
+    app.cli.add_command(post_monthly_charges)
+    app.cli.add_command(hot_account)
+    app.cli.add_command(fold_balance_slots)
+    app.cli.add_command(sweep_idempotency_keys)
@@ -0,0 +1,168 @@
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from flask import current_app, has_request_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.sql import Select
+
+REPLICA_BIND = 'replica'
+
+
+class RoutingSession(Session):
+    """Sends plain SELECTs from read-only endpoints to the replica; everything else stays on the primary.
+
+    A view opts in with @read_only. Writes, flushes and SELECT ... FOR UPDATE always use the
+    primary, so locking paths never read from a lagging copy.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and REPLICA_BIND in self._db.engines and not self._flushing
+                and isinstance(clause, Select) and clause._for_update_arg is None
+                and not _primary_reads.get() and _serving_read_only_view()):
+            return self._db.engines[REPLICA_BIND]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def read_only(view):
+    """Mark a view as read-only so its queries may be served by the replica."""
+    view.read_only = True
+    return view
+
+
+_primary_reads = ContextVar('primary_reads', default=False)
+
+
+@contextmanager
+def primary_reads():
+    """Serve every read inside this block from the primary, even in a read-only view."""
+    token = _primary_reads.set(True)
+    try:
+        yield
+    finally:
+        _primary_reads.reset(token)
+
+
+def _serving_read_only_view():
+    if not has_request_context() or request.endpoint is None:
+        return False
+    return getattr(current_app.view_functions.get(request.endpoint), 'read_only', False)
+
+
+class PoolWaitStats:
+    """Running totals of how long requests waited to check a connection out of a pool."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.checkouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def record(self, wait):
+        with self.lock:
+            self.checkouts += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'checkouts': self.checkouts,
+                'total_wait_ms': round(self.total_wait * 1000, 3),
+                'avg_wait_ms': round(self.total_wait * 1000 / self.checkouts, 3) if self.checkouts else 0.0,
+                'max_wait_ms': round(self.max_wait * 1000, 3),
+            }
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waited for a free connection."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.wait_stats = PoolWaitStats()
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            self.wait_stats.record(time.perf_counter() - started)
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.wait_stats = self.wait_stats
+        return pool
+
+
+def engine_options(uri, config):
+    """Pool settings for one database URI from the active config profile."""
+    if uri.startswith('sqlite') and (uri in ('sqlite://', 'sqlite:///:memory:') or 'mode=memory' in uri):
+        # In-memory SQLite lives inside a single connection, so leave its pool alone
+        return {}
+    return {
+        'poolclass': TimedQueuePool,
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': config['DB_POOL_PRE_PING'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+    }
+
+
+def pool_stats(engines):
+    """Pool occupancy and checkout wait times for each configured engine."""
+    stats = {}
+    for key, engine in engines.items():
+        pool = engine.pool
+        entry = {'status': pool.status()}
+        if isinstance(pool, TimedQueuePool):
+            entry.update(pool.wait_stats.snapshot())
+        stats[key or 'primary'] = entry
+    return stats
+
+
+_write_transaction = ContextVar('write_transaction', default=False)
+
+
+@contextmanager
+def write_transaction():
+    """Mark transactions begun inside this block as writers.
+
+    On SQLite stand-ins they start with BEGIN IMMEDIATE, taking the database write lock up
+    front; that is how local runs emulate the FOR UPDATE row locks MySQL takes, which SQLite
+    ignores. On MySQL this changes nothing.
+    """
+    token = _write_transaction.set(True)
+    try:
+        yield
+    finally:
+        _write_transaction.reset(token)
+
+
+@contextmanager
+def outside_write_transaction():
+    """Undo write_transaction() for a block that reads on a connection of its own, so it does not queue for the lock."""
+    token = _write_transaction.set(False)
+    try:
+        yield
+    finally:
+        _write_transaction.reset(token)
+
+
+@event.listens_for(Engine, 'connect')
+def _sqlite_connect(dbapi_connection, connection_record):
+    if not type(dbapi_connection).__module__.startswith('sqlite3'):
+        return
+    # In-memory databases share one connection between sessions, so they are left as they are
+    if dbapi_connection.execute('PRAGMA database_list').fetchone()[2]:
+        dbapi_connection.execute('PRAGMA journal_mode=WAL')  # Readers do not block the writer
+        connection_record.info['sqlite_file'] = True
+
+
+@event.listens_for(Engine, 'begin')
+def _sqlite_begin(conn):
+    if conn.info.get('sqlite_file') and _write_transaction.get():
+        conn.exec_driver_sql('BEGIN IMMEDIATE')
@@ -1,9 +1,10 @@
 from app import db
 import random
 import string
-import bcrypt
+from app.utils.passwords import hash_password, verify_password, password_needs_rehash
 from decimal import Decimal
 from datetime import datetime
+from sqlalchemy.orm import validates
 class Auth(db.Model):
     __tablename__ = 'pba_auth'
     customer_id = db.Column(db.Integer, db.ForeignKey('pba_customer.customerid'), primary_key=True)
@@ -12,13 +13,14 @@ class Auth(db.Model):
     is_admin = db.Column(db.Integer, default=0, nullable=False)
 
     def set_password(self, password):
-        password = password.encode('utf-8')  # Ensure password is bytes
-        self.password_hash = bcrypt.hashpw(password, bcrypt.gensalt())
+        self.password_hash = hash_password(password)
 
     def check_password(self, password):
-        password = password.encode('utf-8')  # Ensure password is bytes
         # Ensure password_hash is treated as bytes
-        return bcrypt.checkpw(password, self.password_hash)
+        return verify_password(password, bytes(self.password_hash))
+
+    def needs_rehash(self):
+        return password_needs_rehash(bytes(self.password_hash))
 
 class Customer(db.Model):
     __tablename__ = 'pba_customer'
@@ -36,6 +38,10 @@ class Customer(db.Model):
 
 class Account(db.Model):
     __tablename__ = 'pba_account'
+    # Canonical status values; always stored lower-case so matching never depends on collation
+    PENDING = 'pending'
+    APPROVED = 'approved'
+
     acct_no = db.Column(db.Integer, primary_key=True, comment='Account number')
     acct_name = db.Column(db.String(50), nullable=False, comment='Account Name')
     acct_street = db.Column(db.String(40), nullable=False, comment='Account Street')
@@ -45,11 +51,21 @@ class Account(db.Model):
     acct_type = db.Column(db.String(11), nullable=False, comment='Account Type')
     date_opened = db.Column(db.DateTime, nullable=False, comment='Date Opened')
     customerid = db.Column(db.Integer, db.ForeignKey('pba_customer.customerid'), nullable=False, comment='Customer ID foreign key')
-    status = db.Column(db.String(25), nullable=False, default='pending', comment='Account Status')
+    status = db.Column(db.String(25), nullable=False, default=PENDING, comment='Account Status')
 
     checking_account = db.relationship('CheckingAccount', back_populates='account', uselist=False)
     savings_account = db.relationship('SavingsAccount', back_populates='account', uselist=False)
     loans = db.relationship('Loan', back_populates='account')
+
+    # Serves the admin pending queue, which is read oldest first
+    __table_args__ = (
+        db.Index('ix_pba_account_status_date_opened', 'status', 'date_opened'),
+    )
+
+    @validates('status')
+    def normalize_status(self, key, status):
+        return status.strip().lower()
+
     def __repr__(self):
         return f'<Account {self.acct_name} {self.acct_type}>'
 
@@ -153,11 +169,111 @@ class University(db.Model):
 
 class Transaction(db.Model):
     __tablename__ = 'pba_transactions'
-    t_id = db.Column(db.String(7), primary_key=True, nullable=False)  # Removed default generation
+    t_id = db.Column(db.String(20), primary_key=True, nullable=False)  # Assigned by the transaction ID allocator
     from_account = db.Column(db.Integer, db.ForeignKey('pba_account.acct_no'), nullable=False)
     to_account = db.Column(db.Integer, db.ForeignKey('pba_account.acct_no'), nullable=False)
     amount = db.Column(db.Numeric(15, 2), nullable=False)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
 
+    # One index per side of a transfer so per-account history lookups never scan the table
+    __table_args__ = (
+        db.Index('ix_pba_transactions_from_account_timestamp', 'from_account', 'timestamp'),
+        db.Index('ix_pba_transactions_to_account_timestamp', 'to_account', 'timestamp'),
+    )
+
     def __repr__(self):
         return f'<Transaction {self.t_id} from {self.from_account} to {self.to_account} amount {self.amount}>'
+
+
+class BalanceSnapshot(db.Model):
+    __tablename__ = 'pba_balance_snapshot'
+    acct_no = db.Column(db.Integer, db.ForeignKey('pba_account.acct_no'), primary_key=True, comment='Account number')
+    snapshot_date = db.Column(db.Date, primary_key=True, comment='Snapshot Date')
+    balance = db.Column(db.Numeric(15, 2), nullable=False, comment='Closing Balance')
+
+    def __repr__(self):
+        return f'<BalanceSnapshot {self.acct_no} {self.snapshot_date} {self.balance}>'
+
+
+class IdSequence(db.Model):
+    __tablename__ = 'pba_id_sequence'
+    name = db.Column(db.String(50), primary_key=True, comment='Sequence Name')
+    next_value = db.Column(db.BigInteger, nullable=False, comment='First value of the next unreserved block')
+
+    def __repr__(self):
+        return f'<IdSequence {self.name} {self.next_value}>'
+
+
+class WorkerLease(db.Model):
+    __tablename__ = 'pba_worker_lease'
+    worker_id = db.Column(db.Integer, primary_key=True, autoincrement=False, comment='Snowflake Worker ID')
+    owner = db.Column(db.String(64), nullable=False, comment='Process holding the lease')
+    expires_at = db.Column(db.DateTime, nullable=False, comment='Free for another process after this time (UTC)')
+
+    def __repr__(self):
+        return f'<WorkerLease {self.worker_id} {self.owner} {self.expires_at}>'
+
+
+class FundingIntent(db.Model):
+    __tablename__ = 'pba_funding_intent'
+    intent_id = db.Column(db.String(32), primary_key=True, comment='Intent ID, also the payment idempotency key')
+    customer_id = db.Column(db.Integer, db.ForeignKey('pba_customer.customerid'), nullable=False, comment='Customer ID')
+    acct_no = db.Column(db.Integer, db.ForeignKey('pba_account.acct_no'), nullable=False, comment='Checking account to credit')
+    amount = db.Column(db.Numeric(15, 2), nullable=False, comment='Amount')
+    payment_method_id = db.Column(db.String(255), nullable=False, comment='Payment Method ID')
+    status = db.Column(db.String(10), nullable=False, default='pending', comment='pending, processing, succeeded or failed')
+    gateway_reference = db.Column(db.String(255), comment='Payment processor reference')
+    error = db.Column(db.String(255), comment='Failure reason')
+    t_id = db.Column(db.String(20), comment='Ledger transaction written on settlement')
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_pba_funding_intent_status_updated_at', 'status', 'updated_at'),
+    )
+
+    def __repr__(self):
+        return f'<FundingIntent {self.intent_id} {self.status} {self.amount}>'
+
+
+class PostingRun(db.Model):
+    __tablename__ = 'pba_posting_run'
+    run_key = db.Column(db.String(32), primary_key=True, comment='Posting kind and month, e.g. interest:2026-09')
+    last_acct_no = db.Column(db.Integer, nullable=False, default=0, comment='Checkpoint: last account processed')
+    accounts_posted = db.Column(db.Integer, nullable=False, default=0, comment='Accounts posted so far')
+    total = db.Column(db.Numeric(15, 2), nullable=False, default=Decimal('0.00'), comment='Sum of the postings so far')
+    status = db.Column(db.String(10), nullable=False, default='running', comment='running or done')
+    started_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<PostingRun {self.run_key} {self.status} after {self.last_acct_no}>'
+
+
+class BalanceSlot(db.Model):
+    __tablename__ = 'pba_balance_slot'
+    acct_no = db.Column(db.Integer, db.ForeignKey('pba_account.acct_no'), primary_key=True, comment='Account number')
+    slot = db.Column(db.SmallInteger, primary_key=True, comment='Slot number, from 0')
+    amount = db.Column(db.Numeric(15, 2), nullable=False, default=Decimal('0.00'), comment='Credits not yet folded into the balance')
+
+    def __repr__(self):
+        return f'<BalanceSlot {self.acct_no}/{self.slot} {self.amount}>'
+
+
+class IdempotencyKey(db.Model):
+    __tablename__ = 'pba_idempotency_key'
+    customer_id = db.Column(db.Integer, db.ForeignKey('pba_customer.customerid'), primary_key=True, comment='Caller the key belongs to')
+    idempotency_key = db.Column(db.String(255), primary_key=True, comment='Idempotency-Key header sent by the client')
+    fingerprint = db.Column(db.String(64), nullable=False, comment='SHA-256 of the endpoint and request body')
+    status = db.Column(db.String(10), nullable=False, default='running', comment='running, applied or done')
+    status_code = db.Column(db.SmallInteger, comment='HTTP status of the stored response')
+    response = db.Column(db.LargeBinary, comment='Stored response body')
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_pba_idempotency_key_created_at', 'created_at'),
+    )
+
+    def __repr__(self):
+        return f'<IdempotencyKey {self.customer_id}/{self.idempotency_key} {self.status}>'
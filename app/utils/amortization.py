@@ -0,0 +1,254 @@
+"""Loan amortization computed over arrays of loans at once.
+
+Every loan is a level-payment annuity. `loan_rate` is the yearly rate in percent, charged
+monthly on the outstanding principal, and the first of `loan_months` payments falls due one
+month after the account was opened. `loan_payment` is the principal repaid so far, as
+pay_loan_from_account records it, so the outstanding principal stays `loan_amount - loan_payment`
+as /loan_status_by_customer reports it.
+
+The balance after k payments has a closed form, so a summary of the whole loan book is a few
+array operations with no loop over payment periods, and full schedules are one
+(loans x periods) array per batch of loans.
+"""
+import numpy as np
+from sqlalchemy import select
+from app import db
+from app.models import Account, Loan
+
+LOAN_REPORT_COLUMNS = ['account_number', 'customer_id', 'loan_type', 'loan_amount', 'annual_rate', 'months',
+                       'opened', 'monthly_payment', 'total_interest', 'periods_elapsed', 'interest_to_date',
+                       'scheduled_balance', 'loan_paid', 'remaining_loan', 'remaining_periods', 'payoff_date',
+                       'projected_payoff_date', 'status']
+# Loans read and summarized per round trip by the batch report
+LOAN_BATCH = 100000
+
+
+class LoanBook:
+    """Loan terms as parallel arrays, one element per loan."""
+
+    def __init__(self, acct_no, customer_id, loan_type, principal, annual_rate, months, paid, opened):
+        self.acct_no = np.asarray(acct_no, dtype=np.int64)
+        self.customer_id = np.asarray(customer_id, dtype=np.int64)
+        self.loan_type = np.asarray(loan_type, dtype=object)
+        self.principal = np.asarray(principal, dtype=np.float64)
+        self.annual_rate = np.asarray(annual_rate, dtype=np.float64)
+        self.months = np.asarray(months, dtype=np.int64)
+        self.paid = np.asarray(paid, dtype=np.float64)
+        self.opened = np.asarray(opened, dtype='datetime64[D]')
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Build from (acct_no, customer_id, loan_type, amount, rate, months, paid, date_opened) rows."""
+        columns = list(zip(*rows)) or [()] * 8
+        return cls(*columns)
+
+    def __len__(self):
+        return len(self.acct_no)
+
+    @property
+    def monthly_rate(self):
+        return self.annual_rate / 1200
+
+
+def load_loan_book(customer_id=None, after=None, limit=None):
+    """Loans in account order, optionally one customer's or the `limit` after account `after`."""
+    query = (select(Loan.acct_no, Account.customerid, Loan.loan_type, Loan.loan_amount, Loan.loan_rate,
+                    Loan.loan_months, Loan.loan_payment, Account.date_opened)
+             .join(Account, Account.acct_no == Loan.acct_no)
+             .order_by(Loan.acct_no))
+    if customer_id is not None:
+        query = query.where(Account.customerid == customer_id)
+    if after is not None:
+        query = query.where(Loan.acct_no > after)
+    if limit is not None:
+        query = query.limit(limit)
+    return LoanBook.from_rows(db.session.execute(query).all())
+
+
+def loan_book_batches(batch_size=LOAN_BATCH):
+    """Every loan in the bank, as LoanBooks of up to `batch_size` loans read in keyset order."""
+    last = None
+    while True:
+        book = load_loan_book(after=last, limit=batch_size)
+        if not len(book):
+            return
+        yield book
+        last = int(book.acct_no[-1])
+
+
+def level_payments(principal, monthly_rate, months):
+    """Monthly payment, in cents, that repays `principal` over `months`; the last payment absorbs the rounding."""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        payment = np.where(monthly_rate > 0,
+                           principal * monthly_rate / -np.expm1(-months * np.log1p(monthly_rate)),
+                           principal / months)
+    return np.round(payment, 2)
+
+
+def balances_after(principal, monthly_rate, payment, periods):
+    """Scheduled balance after `periods` payments; arguments broadcast against each other.
+
+    B_k = P(1+r)^k - M((1+r)^k - 1)/r, which is P - kM when r is 0.
+    """
+    periods = np.asarray(periods, dtype=np.float64)
+    growth = np.power(1 + monthly_rate, periods)
+    # (growth - 1)/r tends to k as r goes to 0, which is what the interest-free case needs
+    factor = np.divide(growth - 1, monthly_rate, out=np.broadcast_to(periods, growth.shape).copy(),
+                       where=monthly_rate > 0)
+    return principal * growth - payment * factor
+
+
+def _opening_month_and_day(opened):
+    """Months since 1970 and zero-based day of the month of each opening date, as integers."""
+    month = opened.astype('datetime64[M]')
+    return month.astype(np.int64), (opened - month.astype('datetime64[D]')).astype(np.int64)
+
+
+def _due_dates(month, day, periods):
+    # Calendar conversions are slow per element, so look the first and last day of each month up in a small table
+    target = month + periods
+    first = int(target.min(initial=0))
+    starts = np.arange(first, int(target.max(initial=0)) + 2).astype('datetime64[M]').astype('datetime64[D]')
+    starts = starts.astype(np.int64)
+    target -= first
+    due = starts[target]
+    due += day
+    np.minimum(due, starts[1:][target] - 1, out=due)
+    return due.view('datetime64[D]')
+
+
+def due_dates(opened, periods):
+    """Date the `periods`-th payment falls due: the opening day of the month, or the month's last day."""
+    month, day = _opening_month_and_day(np.asarray(opened, dtype='datetime64[D]'))
+    return _due_dates(month, day, np.asarray(periods, dtype=np.int64))
+
+
+def periods_elapsed(opened, months, as_of):
+    """Payments that have fallen due on or before `as_of`, capped at the loan term."""
+    as_of = np.datetime64(as_of, 'D')
+    periods = (as_of.astype('datetime64[M]') - opened.astype('datetime64[M]')).astype(np.int64)
+    periods = periods - (due_dates(opened, periods) > as_of)
+    return np.clip(periods, 0, months)
+
+
+def summarize(book, as_of):
+    """Per-loan payment, interest, balance and payoff figures as of `as_of`, as a dict of arrays.
+
+    interest_to_date and scheduled_balance follow the schedule through the payments due so far;
+    remaining_periods and projected_payoff_date assume the outstanding principal is paid off at
+    the scheduled monthly payment starting with the next due date.
+    """
+    rate = book.monthly_rate
+    payment = level_payments(book.principal, rate, book.months)
+    elapsed = periods_elapsed(book.opened, book.months, as_of)
+    scheduled = balances_after(book.principal, rate, payment, elapsed)
+    # n payments sum to nM plus the final payment's correction, which is the balance left after n level payments
+    total_interest = book.months * payment + balances_after(book.principal, rate, payment, book.months) - book.principal
+    interest_to_date = elapsed * payment + scheduled - book.principal
+    scheduled = np.where(elapsed == book.months, 0.0, scheduled)
+
+    outstanding = np.maximum(book.principal - book.paid, 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        remaining = np.where(rate > 0, -np.log1p(-rate * outstanding / payment) / np.log1p(rate), outstanding / payment)
+    # Float noise must not turn an exact number of payments into one more
+    remaining = np.ceil(np.nan_to_num(remaining, nan=0.0) - 1e-9).astype(np.int64)
+    remaining = np.where(outstanding > 0, np.maximum(remaining, 1), 0)
+    projected = np.where(outstanding > 0, due_dates(book.opened, elapsed + remaining), np.datetime64('NaT'))
+
+    # loan_payment is whole dollars, so only count a loan off schedule by a dollar or more
+    repaid = book.principal - scheduled
+    status = np.where(outstanding == 0, 'paid_off',
+                      np.where(book.paid < np.floor(repaid), 'behind',
+                               np.where(book.paid > np.ceil(repaid), 'ahead', 'current')))
+    return {
+        'monthly_payment': payment,
+        'total_interest': total_interest,
+        'periods_elapsed': elapsed,
+        'interest_to_date': interest_to_date,
+        'scheduled_balance': scheduled,
+        'remaining_loan': outstanding,
+        'remaining_periods': remaining,
+        'payoff_date': due_dates(book.opened, book.months),
+        'projected_payoff_date': projected.astype('datetime64[D]'),
+        'status': status,
+    }
+
+
+def schedules(book):
+    """Every scheduled payment of every loan, as flat arrays with one element per payment.
+
+    Loan i's payments are the slice offsets[i]:offsets[i + 1]; 'loan' holds the loan's
+    position in `book` for each payment. Keeping the schedules ragged instead of padding them
+    to the longest term means the work is proportional to the number of payments. Memory is
+    several arrays of that length, so callers with many loans should pass them in batches.
+    """
+    months = book.months
+    month, day = _opening_month_and_day(book.opened)
+    offsets = np.concatenate([[0], np.cumsum(months)])
+    loan = np.repeat(np.arange(len(book)), months)
+    # Count up from 1 within each loan: a running sum of ones that drops back at every loan's first payment
+    steps = np.ones(offsets[-1], dtype=np.int64)
+    steps[offsets[1:-1]] = 1 - months[:-1]
+    period = np.cumsum(steps)
+
+    rate = book.monthly_rate
+    level = level_payments(book.principal, rate, months)
+    # balances_after() rearranged as B_k = (P - M/r)(1+r)^k + M/r, so each payment costs one exp and a
+    # multiply-add on per-loan constants; exp(k log(1+r)) is also much cheaper than np.power
+    interest_free = rate == 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        annuity = np.where(interest_free, 0.0, level / rate)
+    balance = np.exp(period * np.log1p(rate)[loan])
+    balance *= (book.principal - annuity)[loan]
+    balance += annuity[loan]
+    if interest_free.any():
+        free = interest_free[loan]
+        balance[free] = book.principal[loan[free]] - level[loan[free]] * period[free]
+    # The balance before each payment is the one after the previous payment, or the principal for the first
+    previous = np.empty_like(balance)
+    previous[1:] = balance[:-1]
+    previous[offsets[:-1]] = book.principal
+    interest = previous * rate[loan]
+    last = offsets[1:] - 1
+    # The final payment clears whatever the rounded level payments left over
+    payment = level[loan]
+    payment[last] = previous[last] + interest[last]
+    balance[last] = 0.0
+    return {
+        'offsets': offsets,
+        'loan': loan,
+        'period': period,
+        'due_date': _due_dates(np.repeat(month, months), np.repeat(day, months), period),
+        'payment': payment,
+        'interest': interest,
+        'principal': payment - interest,
+        'balance': balance,
+    }
+
+
+def report_rows(book, summary):
+    """LOAN_REPORT_COLUMNS rows for every loan in `book` from its summarize() arrays, with money rounded to cents."""
+    money = {name: np.round(summary[name], 2).tolist()
+             for name in ('monthly_payment', 'total_interest', 'interest_to_date', 'scheduled_balance')}
+    return zip(book.acct_no.tolist(), book.customer_id.tolist(), book.loan_type.tolist(),
+               book.principal.astype(np.int64).tolist(), book.annual_rate.tolist(), book.months.tolist(),
+               book.opened.tolist(), money['monthly_payment'], money['total_interest'],
+               summary['periods_elapsed'].tolist(), money['interest_to_date'], money['scheduled_balance'],
+               book.paid.astype(np.int64).tolist(), summary['remaining_loan'].astype(np.int64).tolist(),
+               summary['remaining_periods'].tolist(), summary['payoff_date'].tolist(),
+               summary['projected_payoff_date'].tolist(), summary['status'].tolist())
+
+
+def totals_by_type(book, summary):
+    """{loan_type: {'loans', 'principal', 'outstanding', 'interest_to_date', 'behind'}} over `book`."""
+    totals = {}
+    for loan_type in np.unique(book.loan_type.astype(str)):
+        selected = book.loan_type == loan_type
+        totals[loan_type] = {
+            'loans': int(selected.sum()),
+            'principal': int(book.principal[selected].sum()),
+            'outstanding': int(summary['remaining_loan'][selected].sum()),
+            'interest_to_date': float(summary['interest_to_date'][selected].sum()),
+            'behind': int((summary['status'][selected] == 'behind').sum()),
+        }
+    return totals
@@ -0,0 +1,208 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app, has_app_context
+from sqlalchemy import event
+from app import db
+from app.database import RoutingSession, primary_reads
+
+
+class CacheStats:
+    """Hit/miss counters of one process's response cache."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = {'hits': 0, 'misses': 0, 'stores': 0, 'invalidations': 0}
+
+    def add(self, name, count=1):
+        with self.lock:
+            self.counts[name] += count
+
+    def snapshot(self):
+        with self.lock:
+            counts = dict(self.counts)
+        lookups = counts['hits'] + counts['misses']
+        counts['hit_ratio'] = round(counts['hits'] / lookups, 4) if lookups else 0.0
+        return counts
+
+
+class MemoryBackend:
+    """Entries in this process only, with TTL expiry and LRU eviction beyond `max_entries`.
+
+    Invalidations are not seen by other processes, so only use it with a single worker.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        # Generations are never evicted: forgetting one would bring its old entries back to life
+        self.generations = {}
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def generation(self, namespace):
+        with self.lock:
+            return self.generations.get(namespace, 0)
+
+    def bump_generation(self, namespace):
+        with self.lock:
+            self.generations[namespace] = self.generations.get(namespace, 0) + 1
+
+    def size(self):
+        with self.lock:
+            return {'entries': len(self.entries), 'evictions': self.evictions}
+
+
+class SharedBackend:
+    """Entries in a SQLite file shared by every worker on the host; stands in for a shared cache server.
+
+    Same TTL and LRU behaviour as MemoryBackend, but an invalidation made by one process is
+    seen by all of them, including CLI commands.
+    """
+
+    def __init__(self, path, max_entries):
+        self.path = path
+        self.max_entries = max_entries
+        self.local = threading.local()
+        with self.connection() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS cache_entries '
+                         '(key TEXT PRIMARY KEY, value BLOB, expires_at REAL, used_at REAL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_cache_entries_used_at ON cache_entries (used_at)')
+            conn.execute('CREATE TABLE IF NOT EXISTS cache_generations (namespace TEXT PRIMARY KEY, generation INTEGER)')
+
+    def connection(self):
+        # sqlite3 connections are neither thread- nor fork-safe, so keep one per thread and process
+        conn = getattr(self.local, 'conn', None)
+        if conn is None or self.local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self.local.conn, self.local.pid = conn, os.getpid()
+        return conn
+
+    def get(self, key):
+        now = time.time()
+        with self.connection() as conn:
+            row = conn.execute('SELECT value FROM cache_entries WHERE key = ? AND expires_at > ?', (key, now)).fetchone()
+            if row is not None:
+                conn.execute('UPDATE cache_entries SET used_at = ? WHERE key = ?', (now, key))
+        return row[0] if row else None
+
+    def set(self, key, value, ttl):
+        now = time.time()
+        with self.connection() as conn:
+            conn.execute('INSERT OR REPLACE INTO cache_entries VALUES (?, ?, ?, ?)', (key, value, now + ttl, now))
+            conn.execute('DELETE FROM cache_entries WHERE key IN (SELECT key FROM cache_entries '
+                         'ORDER BY used_at DESC LIMIT -1 OFFSET ?)', (self.max_entries,))
+
+    def generation(self, namespace):
+        row = self.connection().execute('SELECT generation FROM cache_generations WHERE namespace = ?',
+                                        (namespace,)).fetchone()
+        return row[0] if row else 0
+
+    def bump_generation(self, namespace):
+        with self.connection() as conn:
+            conn.execute('INSERT INTO cache_generations VALUES (?, 1) '
+                         'ON CONFLICT (namespace) DO UPDATE SET generation = generation + 1', (namespace,))
+
+    def size(self):
+        return {'entries': self.connection().execute('SELECT COUNT(*) FROM cache_entries').fetchone()[0]}
+
+
+class ResponseCache:
+    """Read-through cache of per-customer responses.
+
+    Every customer has a generation number that is part of each cache key. Invalidating the
+    customer bumps it, so entries built before a write are never looked up again, even one
+    stored by a request that read the database just before the write committed.
+    """
+
+    def __init__(self, backend, ttl):
+        self.backend = backend
+        self.ttl = ttl
+        self.stats = CacheStats()
+
+    def fetch(self, customer_id, key, build):
+        """Return the cached value for `key`, or call `build()` and cache its result unless it is None."""
+        namespace = f'customer:{customer_id}'
+        full_key = f'{namespace}:{self.backend.generation(namespace)}:{key}'
+        value = self.backend.get(full_key)
+        if value is not None:
+            self.stats.add('hits')
+            return value, True
+        self.stats.add('misses')
+        # Build from the primary: a lagging replica could hand back the state from before the write
+        with primary_reads():
+            value = build()
+        if value is not None:
+            self.backend.set(full_key, value, self.ttl)
+            self.stats.add('stores')
+        return value, False
+
+    def invalidate(self, customer_ids):
+        for customer_id in customer_ids:
+            self.backend.bump_generation(f'customer:{customer_id}')
+        self.stats.add('invalidations', len(customer_ids))
+
+    def snapshot(self):
+        return {'backend': type(self.backend).__name__, 'ttl': self.ttl, **self.backend.size(), **self.stats.snapshot()}
+
+
+def get_response_cache():
+    """The cache selected by app.config['CACHE_BACKEND'] ('shared', 'memory' or 'none'), built once per app."""
+    if 'response_cache' not in current_app.extensions:
+        config = current_app.config
+        if config['CACHE_BACKEND'] == 'none':
+            cache = None
+        elif config['CACHE_BACKEND'] == 'shared':
+            os.makedirs(current_app.instance_path, exist_ok=True)
+            path = config['CACHE_SHARED_PATH'] or os.path.join(current_app.instance_path, 'response_cache.db')
+            cache = ResponseCache(SharedBackend(path, config['CACHE_MAX_ENTRIES']), config['CACHE_TTL'])
+        else:
+            cache = ResponseCache(MemoryBackend(config['CACHE_MAX_ENTRIES']), config['CACHE_TTL'])
+        current_app.extensions['response_cache'] = cache
+    return current_app.extensions['response_cache']
+
+
+def invalidate_after_commit(*customer_ids):
+    """Drop the cached responses of these customers once the current transaction commits.
+
+    Called from inside write transactions; nothing is invalidated if the transaction rolls back.
+    """
+    db.session.info.setdefault('invalidate_customers', set()).update(
+        int(customer_id) for customer_id in customer_ids if customer_id is not None)
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _invalidate_committed(session):
+    customer_ids = session.info.pop('invalidate_customers', None)
+    if customer_ids and has_app_context():
+        cache = get_response_cache()
+        if cache is not None:
+            cache.invalidate(customer_ids)
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _discard_rolled_back(session):
+    session.info.pop('invalidate_customers', None)
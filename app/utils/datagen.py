@@ -0,0 +1,220 @@
+"""Deterministic synthetic data for local load testing.
+
+Rows are generated in chunks, and every chunk draws from its own random stream seeded by
+(seed, table, chunk number), so a dataset is identical whatever the number of processes. Each
+customer owns fixed account-number slots (checking, savings, loan), which lets any process
+work out account numbers without coordinating; a customer simply leaves unused slots empty.
+"""
+import csv
+import os
+import random
+from datetime import datetime, timedelta
+from decimal import Decimal
+from multiprocessing import get_context
+from sqlalchemy import create_engine, event, func, select, update, insert
+from app.models import (Auth, Customer, Account, CheckingAccount, SavingsAccount, Loan, University, StudentLoan,
+                        PersonalLoan, HomeLoan, Transaction, IdSequence)
+
+FIRST_ACCOUNT_NUMBER = 10000000
+ACCOUNT_SLOTS = 3  # checking, savings, loan
+UNIVERSITY_COUNT = 200
+FIRST_NAMES = ['James', 'Mary', 'Robert', 'Patricia', 'John', 'Jennifer', 'Michael', 'Linda', 'David', 'Elizabeth',
+               'William', 'Barbara', 'Richard', 'Susan', 'Joseph', 'Jessica', 'Thomas', 'Sarah', 'Priya', 'Wei']
+LAST_NAMES = ['Smith', 'Johnson', 'Williams', 'Brown', 'Jones', 'Garcia', 'Miller', 'Davis', 'Rodriguez', 'Martinez',
+              'Hernandez', 'Lopez', 'Gonzalez', 'Wilson', 'Anderson', 'Patel', 'Nguyen', 'Kim', 'Chen', 'Shah']
+CITIES = [('Newark', 'NJ', 7102), ('Jersey City', 'NJ', 7302), ('New York', 'NY', 10001), ('Brooklyn', 'NY', 11201),
+          ('Philadelphia', 'PA', 19103), ('Boston', 'MA', 2108), ('Hoboken', 'NJ', 7030), ('Stamford', 'CT', 6901)]
+STREETS = ['Main St', 'Broad St', 'Market St', 'Park Ave', 'Elm St', 'Oak Ave', 'Maple Dr', 'High St']
+
+
+def checking_account_number(customer_id):
+    return FIRST_ACCOUNT_NUMBER + (customer_id - 1) * ACCOUNT_SLOTS
+
+
+def _rng(seed, table, chunk):
+    return random.Random(f'{seed}:{table}:{chunk}')
+
+
+def generate_customer_chunk(settings, chunk, first_id, last_id):
+    """Customers first_id..last_id with their logins, accounts and loan details, as {table: [rows]}."""
+    rng = _rng(settings['seed'], 'customers', chunk)
+    opened_from = settings['end'] - timedelta(days=3 * 365)
+    rows = {table: [] for table in ('customer', 'auth', 'account', 'checking', 'savings', 'loan', 'student',
+                                    'personal', 'home')}
+    for customer_id in range(first_id, last_id + 1):
+        first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        city, state, zip_code = rng.choice(CITIES)
+        street = f'{rng.randint(1, 999)} {rng.choice(STREETS)}'
+        rows['customer'].append({'customerid': customer_id, 'cfname': first, 'clname': last, 'cstreet': street,
+                                 'ccity': city, 'cstate': state, 'czip': zip_code})
+        rows['auth'].append({'customer_id': customer_id, 'username': f'user{customer_id}',
+                             'password_hash': settings['password_hashes'][customer_id % len(settings['password_hashes'])],
+                             'is_admin': 0})
+
+        checking_no = checking_account_number(customer_id)
+        kinds = ['Checking']
+        if rng.random() < 0.7:
+            kinds.append('Savings')
+        if rng.random() < 0.3:
+            kinds.append('Loan')
+        for kind in kinds:
+            acct_no = checking_no + ('Checking', 'Savings', 'Loan').index(kind)
+            opened = opened_from + timedelta(seconds=rng.randint(0, 3 * 365 * 86400))
+            rows['account'].append({'acct_no': acct_no, 'acct_name': f'{first} {last} {kind}', 'acct_street': street,
+                                    'acct_city': city, 'acct_state': state, 'acct_zip': zip_code, 'acct_type': kind,
+                                    'date_opened': opened, 'customerid': customer_id,
+                                    'status': Account.PENDING if rng.random() < 0.02 else Account.APPROVED})
+            if kind == 'Checking':
+                rows['checking'].append({'acct_no': acct_no, 'service_charge': rng.choice([0.0, 5.0, 10.0, 12.0]),
+                                         'balance': Decimal(rng.randint(0, 2_000_000)) / 100})
+            elif kind == 'Savings':
+                rows['savings'].append({'acct_no': acct_no, 'interest_rate': rng.choice([0.5, 1.0, 2.5, 4.0]),
+                                        'balance': Decimal(rng.randint(0, 10_000_000)) / 100})
+            else:
+                loan_type = rng.choices(['Student', 'Personal', 'Home'], weights=[3, 4, 3])[0]
+                amount = {'Student': rng.randint(5, 120), 'Personal': rng.randint(1, 50),
+                          'Home': rng.randint(100, 900)}[loan_type] * 1000
+                rows['loan'].append({'acct_no': acct_no, 'loan_rate': round(rng.uniform(2.5, 12.0), 2),
+                                     'loan_amount': amount, 'loan_payment': rng.randint(0, amount // 2),
+                                     'loan_months': rng.choice([36, 60, 120, 180, 360]), 'loan_type': loan_type})
+                if loan_type == 'Student':
+                    rows['student'].append({'acct_no': acct_no, 'studentid': rng.randint(10000000, 99999999),
+                                            'status': rng.choice(['Enrolled', 'Graduated']),
+                                            'expecteddate': datetime(rng.randint(2024, 2030), rng.choice([5, 12]), 15),
+                                            'universityid': rng.randint(1, UNIVERSITY_COUNT)})
+                elif loan_type == 'Personal':
+                    rows['personal'].append({'acct_no': acct_no})
+                else:
+                    rows['home'].append({'acct_no': acct_no, 'builtyear': rng.randint(1920, 2023),
+                                         'hianumber': rng.randint(10 ** 9, 10 ** 10), 'icname': 'Acme Insurance',
+                                         'icstreet': '1 Policy Plaza', 'iccity': city, 'icstate': state,
+                                         'iczip': zip_code, 'premium': rng.randint(500, 4000)})
+    return rows
+
+
+def generate_transaction_chunk(settings, chunk, first_id, last_id):
+    """Transactions first_id..last_id between checking accounts, with a power-law skew towards hot accounts."""
+    rng = _rng(settings['seed'], 'transactions', chunk)
+    customers, skew = settings['customers'], settings['skew']
+    span = settings['days'] * 86400
+    start = settings['end'] - timedelta(seconds=span)
+    # A fixed odd multiplier scatters hot accounts over the whole customer range
+    scatter = 2654435761
+    rows = []
+    for t_id in range(first_id, last_id + 1):
+        # random() ** skew piles up near 0, so low ranks (the hot accounts) are picked most often
+        from_rank = int(customers * rng.random() ** skew)
+        to_rank = int(customers * rng.random() ** skew)
+        rows.append({
+            't_id': f'{t_id:020d}',
+            'from_account': checking_account_number(from_rank * scatter % customers + 1),
+            'to_account': checking_account_number(to_rank * scatter % customers + 1),
+            'amount': Decimal(int(rng.lognormvariate(8, 1.2)) + 1) / 100,
+            'timestamp': start + timedelta(seconds=rng.random() * span),
+        })
+    return {'transaction': rows}
+
+
+TABLES = {
+    'customer': Customer.__table__, 'auth': Auth.__table__, 'account': Account.__table__,
+    'checking': CheckingAccount.__table__, 'savings': SavingsAccount.__table__, 'loan': Loan.__table__,
+    'student': StudentLoan.__table__, 'personal': PersonalLoan.__table__, 'home': HomeLoan.__table__,
+    'transaction': Transaction.__table__,
+}
+GENERATORS = {'customers': generate_customer_chunk, 'transactions': generate_transaction_chunk}
+
+_engine = None
+_engine_pid = None
+
+def _worker_engine(database_url):
+    # Engines cannot cross a fork, so each worker process opens its own
+    global _engine, _engine_pid
+    if _engine is None or _engine_pid != os.getpid():
+        _engine = create_engine(database_url, connect_args={'timeout': 60} if database_url.startswith('sqlite') else {})
+        if _engine.dialect.name == 'mysql':
+            @event.listens_for(_engine, 'connect')
+            def _relax_checks(dbapi_connection, connection_record):
+                # Parents are always loaded before children, so skip the per-row checks while loading
+                with dbapi_connection.cursor() as cursor:
+                    cursor.execute('SET SESSION foreign_key_checks = 0, unique_checks = 0')
+        _engine_pid = os.getpid()
+    return _engine
+
+
+def load_chunk(task):
+    """Generate one chunk and insert it (or write it as CSV files); runs in a worker process."""
+    kind, chunk, first_id, last_id, settings = task
+    rows = GENERATORS[kind](settings, chunk, first_id, last_id)
+    if settings['output_dir']:
+        for table, table_rows in rows.items():
+            if not table_rows:
+                continue
+            directory = os.path.join(settings['output_dir'], TABLES[table].name)
+            os.makedirs(directory, exist_ok=True)
+            with open(os.path.join(directory, f'{kind}-{chunk:06d}.csv'), 'w', newline='') as f:
+                writer = csv.writer(f)
+                columns = [column.name for column in TABLES[table].columns]
+                for row in table_rows:
+                    writer.writerow([_csv_value(row.get(column)) for column in columns])
+    else:
+        with _worker_engine(settings['database_url']).begin() as conn:
+            # Dict order is parents first, so foreign keys hold within the chunk
+            for table, table_rows in rows.items():
+                if table_rows:
+                    conn.execute(insert(TABLES[table]), table_rows)
+    return kind, sum(len(table_rows) for table_rows in rows.values())
+
+
+def _csv_value(value):
+    if value is None:
+        return r'\N'  # NULL for LOAD DATA INFILE
+    if isinstance(value, bytes):
+        return value.decode('ascii')
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    return value
+
+
+def plan_chunks(kind, total, chunk_size, settings):
+    return [(kind, chunk, first, min(first + chunk_size - 1, total), settings)
+            for chunk, first in enumerate(range(1, total + 1, chunk_size))]
+
+
+def seed_universities(conn):
+    conn.execute(insert(University.__table__), [
+        {'universityid': university_id, 'universityname': f'State University {university_id}'}
+        for university_id in range(1, UNIVERSITY_COUNT + 1)])
+
+
+def id_sequence_ends(customers, transactions):
+    """First free value of the account and transaction ID sequences after a generated dataset."""
+    return {'account': checking_account_number(customers) + ACCOUNT_SLOTS, 'transaction': transactions + 1}
+
+
+def advance_id_sequences(conn, customers, transactions):
+    """Move the account and transaction allocators past the generated ranges so new IDs never collide."""
+    for name, next_value in id_sequence_ends(customers, transactions).items():
+        if conn.execute(select(IdSequence.next_value).where(IdSequence.name == name)).first() is None:
+            conn.execute(insert(IdSequence).values(name=name, next_value=next_value))
+        else:
+            conn.execute(update(IdSequence).where(IdSequence.name == name)
+                         .values(next_value=func.max(IdSequence.next_value, next_value)
+                                 if conn.dialect.name == 'sqlite' else func.greatest(IdSequence.next_value, next_value)))
+
+
+def run_generation(settings, chunk_size, processes, progress=None):
+    """Generate every chunk, customers before transactions, across `processes` worker processes.
+
+    `progress(kind, rows_written)` is called as chunks finish. Returns {kind: rows_written}.
+    """
+    totals = {'customers': 0, 'transactions': 0}
+    phases = [plan_chunks('customers', settings['customers'], chunk_size, settings),
+              plan_chunks('transactions', settings['transactions'], chunk_size, settings)]
+    with get_context('fork' if os.name == 'posix' else 'spawn').Pool(processes) as pool:
+        # Transactions reference accounts, so the customer phase has to finish first
+        for tasks in phases:
+            for kind, written in pool.imap_unordered(load_chunk, tasks):
+                totals[kind] += written
+                if progress:
+                    progress(kind, totals[kind])
+    return totals
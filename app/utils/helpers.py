@@ -1,56 +1,247 @@
-import random
-import string
-from app.models import Account, Transaction, Customer
+import base64
+from app.models import Account, Transaction, Customer, CheckingAccount, SavingsAccount, Loan, BalanceSnapshot
 from datetime import datetime, timedelta
 from decimal import Decimal
 from app import db
+from sqlalchemy import select, union_all, func
 from sqlalchemy.orm import aliased
+from app.utils.ids import get_allocator
+from app.utils.cache import invalidate_after_commit
+from app.utils.hot_accounts import slot_sums, slot_totals
 
 
+def _accounts_numbered_between(first, end):
+    return select(Account.acct_no).where(Account.acct_no >= first, Account.acct_no < end)
+
+def _account_allocator():
+    # 8-digit account numbers from the bottom of the range up. Numbers issued at random before the
+    # sequence existed are spread over the whole range, so each block skips the ones it contains
+    return get_allocator('account', start=10000000, block_size=20, used_query=_accounts_numbered_between)
+
 def generate_unique_account_number():
-    while True:
-        number = random.randint(10000000, 99999999)  # Generates a random 8-digit number
-        existing_account = Account.query.filter_by(acct_no=number).first()
-        if not existing_account:
-            return number
+    return generate_unique_account_numbers(1)[0]
+
+def generate_unique_account_numbers(count):
+    numbers = _account_allocator().next_ids(count)
+    if numbers and numbers[-1] > 99999999:
+        raise RuntimeError('Account number space exhausted')
+    return numbers
 
 def generate_unique_transaction_id():
-    while True:
-        # Generate a random 7-character alphanumeric string
-        transaction_id = ''.join(random.choices(string.ascii_letters + string.digits, k=7))
-        # Check if this ID already exists in the database
-        existing_transaction = Transaction.query.filter_by(t_id=transaction_id).first()
-        if not existing_transaction:
-            return transaction_id
-
-
-def calculate_balances(account_id):
-    # Fetch the last 30 transactions for the given account
-    transactions = (
-        Transaction.query
-        .filter(
-            (Transaction.from_account == account_id) | (Transaction.to_account == account_id)
-        )
-        .order_by(Transaction.timestamp.desc())  # Order by descending to get the latest first
-        .limit(30)  # Only fetch the latest 30 transactions
-        .all()
-    )
-
-    transactions.reverse()  # Reverse to process them from oldest to newest
-
-    balance = Decimal(500)  # Starting balance
-    balances = []
+    # Zero-padded so that string order matches allocation order in the primary key index
+    return f"{get_allocator('transaction').next_id():020d}"
 
-    # Calculate the effect of each transaction on the balance
-    for transaction in transactions:
-        if transaction.to_account == account_id:
-            balance += transaction.amount
-        elif transaction.from_account == account_id:
+def encode_cursor(timestamp, key):
+    """Build an opaque keyset pagination token from a (timestamp, key) position."""
+    raw = f"{timestamp.isoformat()}|{key}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor):
+    """Turn a pagination token back into (timestamp, key string); raises ValueError if malformed."""
+    raw = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+    timestamp, sep, key = raw.partition('|')
+    if not sep or not key:
+        raise ValueError('Invalid cursor')
+    return datetime.fromisoformat(timestamp), key
+
+def encode_transaction_cursor(transaction):
+    """Build an opaque pagination token from the last transaction of a page."""
+    return encode_cursor(transaction.timestamp, transaction.t_id)
+
+def decode_transaction_cursor(cursor):
+    """Turn a pagination token back into (timestamp, t_id); raises ValueError if malformed."""
+    return decode_cursor(cursor)
+
+def account_transactions(account_numbers, after=None, limit=None):
+    """Query transactions touching any of the given accounts, newest first.
+
+    Built as a UNION ALL of the outgoing and incoming sides instead of an OR so that each
+    side can be served by its (account, timestamp) index. `after` is a (timestamp, t_id)
+    keyset position and `limit` is pushed down into both sides.
+    """
+    sides = [
+        Transaction.from_account.in_(account_numbers),
+        # Transfers between the accounts themselves are already covered by the outgoing side
+        Transaction.to_account.in_(account_numbers) & Transaction.from_account.not_in(account_numbers),
+    ]
+    branches = []
+    for condition in sides:
+        branch = select(Transaction).where(condition)
+        if after:
+            last_timestamp, last_t_id = after
+            branch = branch.where(
+                (Transaction.timestamp < last_timestamp) |
+                ((Transaction.timestamp == last_timestamp) & (Transaction.t_id < last_t_id))
+            )
+        if limit is not None:
+            branch = select(branch.order_by(Transaction.timestamp.desc(), Transaction.t_id.desc()).limit(limit).subquery())
+        branches.append(branch)
+
+    combined = aliased(Transaction, union_all(*branches).subquery())
+    query = db.session.query(combined).order_by(combined.timestamp.desc(), combined.t_id.desc())
+    if limit is not None:
+        query = query.limit(limit)
+    return query
+
+
+def customer_portfolio(customer_id):
+    """Balances, loans and account counts of one customer, from a single GROUP BY over all account tables.
+
+    Deposit accounts collapse into one group per type and status; loans are grouped by their own
+    account number, so each loan keeps its row while still coming from the same statement.
+    Returns {'checking_balance', 'savings_balance', 'loans': [...], 'status_counts': {status: count}}.
+    """
+    slots = slot_sums()
+    # Credits a hot account holds in its balance slots
+    unfolded = func.coalesce(slots.c.amount, 0) if slots is not None else 0
+    query = (db.session.query(Account.acct_type, Account.status, Loan.acct_no, Loan.loan_type,
+                              func.count(Account.acct_no),
+                              func.sum(CheckingAccount.balance + unfolded), func.sum(SavingsAccount.balance + unfolded),
+                              func.max(Loan.loan_amount), func.max(Loan.loan_payment))
+             .outerjoin(CheckingAccount, CheckingAccount.acct_no == Account.acct_no)
+             .outerjoin(SavingsAccount, SavingsAccount.acct_no == Account.acct_no)
+             .outerjoin(Loan, Loan.acct_no == Account.acct_no))
+    if slots is not None:
+        query = query.outerjoin(slots, slots.c.acct_no == Account.acct_no)
+    rows = (query.filter(Account.customerid == customer_id)
+            .group_by(Account.acct_type, Account.status, Loan.acct_no, Loan.loan_type)
+            .order_by(Loan.acct_no)
+            .all())
+
+    portfolio = {'checking_balance': 0, 'savings_balance': 0, 'loans': [], 'status_counts': {}}
+    for acct_type, status, loan_acct_no, loan_type, count, checking, savings, loan_amount, loan_payment in rows:
+        portfolio['status_counts'][status] = portfolio['status_counts'].get(status, 0) + count
+        if acct_type == 'Checking' and checking is not None:
+            portfolio['checking_balance'] += checking
+        elif acct_type == 'Savings' and savings is not None:
+            portfolio['savings_balance'] += savings
+        if loan_acct_no is not None:
+            portfolio['loans'].append({
+                'account_number': loan_acct_no,
+                'loan_type': loan_type,
+                'loan_amount': int(loan_amount),
+                'loan_paid': int(loan_payment),
+            })
+    return portfolio
+
+
+def record_balance_snapshot(acct_no, balance, day=None):
+    """Store `balance` as the closing balance of `acct_no` for `day` (today by default).
+
+    Called after every balance change in the same transaction, while the balance row is held.
+    """
+    record_balance_snapshots({acct_no: balance}, day)
+
+
+def record_balance_snapshots(balances, day=None):
+    """Same as record_balance_snapshot for several accounts at once, given as {acct_no: balance}."""
+    day = day or datetime.utcnow().date()
+    existing = {snapshot.acct_no: snapshot for snapshot in BalanceSnapshot.query.filter(
+        BalanceSnapshot.acct_no.in_(list(balances)), BalanceSnapshot.snapshot_date == day)}
+    for acct_no, balance in balances.items():
+        if acct_no in existing:
+            existing[acct_no].balance = balance
+        else:
+            db.session.add(BalanceSnapshot(acct_no=acct_no, snapshot_date=day, balance=balance))
+
+
+def backfill_balance_snapshots(acct_no):
+    """Rebuild the daily snapshots of one account by walking its history backwards from the current balance."""
+    account = db.session.get(Account, acct_no)
+    sub_account = account.checking_account or account.savings_account
+    if not sub_account:
+        return 0
+
+    balance = sub_account.balance + slot_totals([acct_no]).get(acct_no, 0)
+    snapshots = {}
+    for transaction in account_transactions([acct_no]).yield_per(1000):
+        day = transaction.timestamp.date()
+        # Newest first, so the first transaction seen for a day leaves that day's closing balance
+        if day not in snapshots:
+            snapshots[day] = balance
+        if transaction.to_account == acct_no:
             balance -= transaction.amount
-        balances.append({
-            "date": transaction.timestamp.strftime('%Y-%m-%d'),
-            "balance": format(balance, '.2f')  # Formatting balance to 2 decimal places
-        })
+        else:
+            balance += transaction.amount
+    # Whatever is left is the balance the account was opened with
+    snapshots.setdefault(account.date_opened.date(), balance)
+
+    BalanceSnapshot.query.filter_by(acct_no=acct_no).delete()
+    invalidate_after_commit(account.customerid)
+    db.session.bulk_insert_mappings(BalanceSnapshot, [
+        {'acct_no': acct_no, 'snapshot_date': day, 'balance': day_balance}
+        for day, day_balance in snapshots.items()
+    ])
+    return len(snapshots)
+
+
+def _bucket_end(day, interval):
+    if interval == 'weekly':
+        return day + timedelta(days=6 - day.weekday())
+    if interval == 'monthly':
+        next_month = (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+        return next_month - timedelta(days=1)
+    return day
 
-    return balances
 
+def count_balance_points(start, end, interval):
+    """How many points calculate_balances() returns at most for this range, without walking it."""
+    if interval == 'weekly':
+        return (end - (start - timedelta(days=start.weekday()))).days // 7 + 1
+    if interval == 'monthly':
+        return (end.year - start.year) * 12 + end.month - start.month + 1
+    return (end - start).days + 1
+
+
+def _bucket_end_column(interval):
+    """SQL for the last day of the week or month a snapshot falls in, as _bucket_end() computes it."""
+    snapshot_date = BalanceSnapshot.snapshot_date
+    if db.engine.dialect.name == 'sqlite':
+        if interval == 'weekly':
+            return func.date(snapshot_date, 'weekday 0')
+        return func.date(snapshot_date, 'start of month', '+1 month', '-1 day')
+    if interval == 'weekly':
+        return func.adddate(snapshot_date, 6 - func.weekday(snapshot_date))
+    return func.last_day(snapshot_date)
+
+
+def calculate_balances(account_id, start, end, interval='daily'):
+    """Closing balance of an account at the end of each day/week/month between `start` and `end`.
+
+    Only the last snapshot of each week or month is read, so the work follows the number of
+    points rather than the number of days in the range.
+    """
+    # The last snapshot before the range seeds the balance carried into it
+    opening = (BalanceSnapshot.query
+               .filter(BalanceSnapshot.acct_no == account_id, BalanceSnapshot.snapshot_date < start)
+               .order_by(BalanceSnapshot.snapshot_date.desc())
+               .first())
+    in_range = (BalanceSnapshot.acct_no == account_id,
+                BalanceSnapshot.snapshot_date >= start,
+                BalanceSnapshot.snapshot_date <= end)
+    snapshots = db.session.query(BalanceSnapshot.snapshot_date, BalanceSnapshot.balance).filter(*in_range)
+    if interval != 'daily':
+        last_of_bucket = (select(func.max(BalanceSnapshot.snapshot_date).label('snapshot_date'))
+                          .where(*in_range)
+                          .group_by(_bucket_end_column(interval))
+                          .subquery())
+        snapshots = snapshots.join(last_of_bucket, BalanceSnapshot.snapshot_date == last_of_bucket.c.snapshot_date)
+    snapshots = snapshots.order_by(BalanceSnapshot.snapshot_date).all()
+
+    balance = opening.balance if opening else None
+    balances = []
+    position = 0
+    day = start
+    while day <= end:
+        point = min(_bucket_end(day, interval), end)
+        while position < len(snapshots) and snapshots[position].snapshot_date <= point:
+            balance = snapshots[position].balance
+            position += 1
+        if balance is not None:
+            balances.append({
+                "date": point.strftime('%Y-%m-%d'),
+                "balance": format(balance, '.2f')  # Formatting balance to 2 decimal places
+            })
+        day = point + timedelta(days=1)
+
+    return balances
@@ -0,0 +1,155 @@
+"""Hot accounts: balances that take credits in several slot rows instead of their one balance row.
+
+An account receiving a flood of transfers (a merchant, a payroll account) would otherwise
+serialize every sender on the FOR UPDATE of its balance row. Once an account is made hot,
+credits to it are added to one of its pba_balance_slot rows chosen at random, so concurrent
+senders mostly lock different rows. Its balance is the balance row plus the sum of the slots:
+
+- reads add the slots in, through slot_sums() in SQL or slot_totals() for a list of accounts
+- a debit locks the balance row and folds every slot into it first, so it is checked
+  against the whole balance
+- transfers.fold_hot_account(), run periodically by `flask fold-balance-slots`, moves the
+  slots into the balance row, which is also when the account's daily balance snapshot catches up
+
+Only checking and savings accounts can be hot. Which accounts are hot is read by each
+process every HOT_ACCOUNT_REFRESH_SECONDS; a process that has not noticed a change yet still
+posts correctly, just to the balance row.
+"""
+import logging
+import random
+import threading
+import time
+from decimal import Decimal
+from flask import current_app
+from sqlalchemy import inspect, select, update, func
+from sqlalchemy.exc import DBAPIError
+from app import db
+from app.database import outside_write_transaction
+from app.models import BalanceSlot
+
+logger = logging.getLogger(__name__)
+
+
+class HotAccountRegistry:
+    """Process-wide {acct_no: slot count} of hot accounts, re-read when older than `refresh_seconds`.
+
+    Reads go through their own connection, never the session, so a refresh in the middle of a
+    write transaction neither joins it nor waits on its locks.
+    """
+
+    def __init__(self, engine, refresh_seconds):
+        self.engine = engine
+        self.refresh_seconds = refresh_seconds
+        self.slot_counts = {}
+        self.has_slot_table = False
+        self.loaded_at = None
+        self.lock = threading.Lock()
+
+    def refresh(self):
+        if self.loaded_at is None or time.monotonic() - self.loaded_at > self.refresh_seconds:
+            self.reload()
+
+    def slots(self, acct_no):
+        self.refresh()
+        return self.slot_counts.get(acct_no, 0)
+
+    def reload(self):
+        with self.lock:
+            if self.loaded_at is not None and time.monotonic() - self.loaded_at <= self.refresh_seconds:
+                return
+            try:
+                with outside_write_transaction(), self.engine.connect() as conn:
+                    # A database that never had an account made hot has no pba_balance_slot table yet
+                    has_slot_table = inspect(conn).has_table(BalanceSlot.__tablename__)
+                    slot_counts = {}
+                    if has_slot_table:
+                        slot_counts = dict(conn.execute(
+                            select(BalanceSlot.acct_no, func.count()).group_by(BalanceSlot.acct_no)).all())
+                self.slot_counts, self.has_slot_table = slot_counts, has_slot_table
+            except DBAPIError:
+                # Keep the last known set
+                logger.warning('Could not read hot accounts', exc_info=True)
+            self.loaded_at = time.monotonic()
+
+
+def get_hot_accounts():
+    if 'hot_accounts' not in current_app.extensions:
+        current_app.extensions['hot_accounts'] = HotAccountRegistry(
+            db.engine, current_app.config['HOT_ACCOUNT_REFRESH_SECONDS'])
+    return current_app.extensions['hot_accounts']
+
+
+def is_hot(acct_no):
+    return get_hot_accounts().slots(acct_no) > 0
+
+
+def credit_slot(acct_no, amount):
+    """Add `amount` to one of the account's slots, chosen at random; False if it has no slots (any more).
+
+    Only that slot row is locked, so the account's balance row stays free for other senders.
+    """
+    slots = get_hot_accounts().slots(acct_no)
+    if not slots:
+        return False
+    credited = db.session.execute(update(BalanceSlot)
+                                  .where(BalanceSlot.acct_no == acct_no, BalanceSlot.slot == random.randrange(slots))
+                                  .values(amount=BalanceSlot.amount + amount)
+                                  .execution_options(synchronize_session=False))
+    return credited.rowcount == 1
+
+
+def fold_slots(acct_no, balance_row):
+    """Move every slot of an account into `balance_row`, which the caller has locked. Returns the amount moved.
+
+    The slots are locked in slot order, so a fold waits for credits in flight and blocks new
+    ones until the caller commits.
+    """
+    amounts = db.session.execute(select(BalanceSlot.amount)
+                                 .where(BalanceSlot.acct_no == acct_no)
+                                 .order_by(BalanceSlot.slot)
+                                 .with_for_update()).scalars().all()
+    total = sum(amounts, Decimal('0.00'))
+    if total:
+        db.session.execute(update(BalanceSlot)
+                           .where(BalanceSlot.acct_no == acct_no)
+                           .values(amount=0)
+                           .execution_options(synchronize_session=False))
+        balance_row.balance += total
+    return total
+
+
+def set_slot_count(acct_no, slots, balance_row):
+    """Give a locked account `slots` slots (0 makes it an ordinary account again), folding the old ones in first."""
+    fold_slots(acct_no, balance_row)
+    db.session.execute(BalanceSlot.__table__.delete()
+                       .where(BalanceSlot.acct_no == acct_no, BalanceSlot.slot >= slots))
+    existing = db.session.execute(select(func.count()).select_from(BalanceSlot)
+                                  .where(BalanceSlot.acct_no == acct_no)).scalar()
+    if slots > existing:
+        db.session.bulk_insert_mappings(BalanceSlot, [{'acct_no': acct_no, 'slot': slot, 'amount': Decimal('0.00')}
+                                                      for slot in range(existing, slots)])
+
+
+def has_slot_table():
+    """Whether pba_balance_slot exists; slot reads are skipped until it does, since no slot can hold money before."""
+    registry = get_hot_accounts()
+    registry.refresh()
+    return registry.has_slot_table
+
+
+def slot_sums():
+    """Subquery of (acct_no, amount) with the slot total of every hot account, for outer joins; None without the table."""
+    if not has_slot_table():
+        return None
+    return (select(BalanceSlot.acct_no, func.sum(BalanceSlot.amount).label('amount'))
+            .group_by(BalanceSlot.acct_no)
+            .subquery())
+
+
+def slot_totals(account_numbers):
+    """{acct_no: slot total} for those of `account_numbers` that are hot."""
+    if not account_numbers or not has_slot_table():
+        return {}
+    return dict(db.session.execute(select(BalanceSlot.acct_no, func.sum(BalanceSlot.amount))
+                                   .where(BalanceSlot.acct_no.in_(list(account_numbers)))
+                                   .group_by(BalanceSlot.acct_no)).all())
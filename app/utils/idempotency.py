@@ -0,0 +1,285 @@
+"""Idempotency keys for the endpoints that move money.
+
+Clients that time out retry /transfer_money, /pay_loan and /add_funds, and every retry would
+move the money again. A client that sends the same Idempotency-Key header with each attempt
+gets the work done once:
+
+- The first request with a key claims it in pba_idempotency_key, runs, and stores its
+  response there. Later requests with the key get that response back without the view
+  running, so no balance row is locked or changed.
+- A duplicate that arrives while the first request is still running waits for it instead of
+  racing it for the same rows: on an event when the first request is in the same process,
+  by polling the table when it is in another one.
+- The view's own write transaction marks the key applied as it commits, so work that
+  committed is never run again, even if its process died before storing the response.
+- A 5xx response is not stored while nothing was committed; the key is released for the retry.
+
+Keys belong to the caller, and one sent again with a different body or to another endpoint
+is refused. Finished keys are also kept in a per-process LRU in front of the table, and a
+thread in each process deletes keys older than IDEMPOTENCY_TTL.
+"""
+import hashlib
+import logging
+import os
+import random
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import delete, event, select, tuple_, update
+from sqlalchemy.exc import IntegrityError
+from app import db
+from app.database import RoutingSession
+from app.models import IdempotencyKey
+from app.utils.transfers import run_transaction
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+# Keys deleted per transaction by the expiry sweep
+SWEEP_BATCH = 1000
+# Bounds of the backoff while polling for a request in flight in another process
+POLL_SECONDS = (0.01, 0.25)
+
+StoredResponse = namedtuple('StoredResponse', 'fingerprint status_code body')
+
+
+class IdempotencyError(Exception):
+    """A keyed request was refused before running; carries the message, HTTP status and headers to report."""
+
+    def __init__(self, message, status_code, headers=None):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+class IdempotencyStore:
+    """One process's finished keys, LRU beyond `max_entries`, and the keys its own requests hold."""
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.responses = OrderedDict()
+        self.in_flight = {}
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+
+    def cached(self, scope):
+        with self.lock:
+            entry = self.responses.get(scope)
+            if entry is None:
+                return None
+            expires_at, stored = entry
+            if expires_at <= time.monotonic():
+                del self.responses[scope]
+                return None
+            self.responses.move_to_end(scope)
+            return stored
+
+    def remember(self, scope, stored):
+        with self.lock:
+            self.responses[scope] = (time.monotonic() + self.ttl, stored)
+            self.responses.move_to_end(scope)
+            while len(self.responses) > self.max_entries:
+                self.responses.popitem(last=False)
+
+    def hold(self, scope):
+        with self.lock:
+            self.in_flight[scope] = threading.Event()
+
+    def release(self, scope):
+        with self.lock:
+            self.in_flight.pop(scope).set()
+
+    def wait(self, scope, timeout):
+        """Wait for the request of this process holding `scope` to finish; False if none holds it."""
+        with self.lock:
+            finished = self.in_flight.get(scope)
+        if finished is None:
+            return False
+        finished.wait(timeout)
+        return True
+
+
+_store_lock = threading.Lock()
+
+def get_idempotency_store():
+    """This process's IdempotencyStore; building it starts the process's expiry sweep."""
+    with _store_lock:
+        store = current_app.extensions.get('idempotency')
+        # A forked worker shares neither its parent's requests in flight nor its sweep thread
+        if store is None or store.pid != os.getpid():
+            config = current_app.config
+            store = IdempotencyStore(config['IDEMPOTENCY_CACHE_SIZE'], config['IDEMPOTENCY_TTL'])
+            current_app.extensions['idempotency'] = store
+            if config['IDEMPOTENCY_SWEEP_SECONDS'] > 0:
+                threading.Thread(target=_sweep_forever, name='idempotency-sweep', daemon=True,
+                                 args=(current_app._get_current_object(), config['IDEMPOTENCY_SWEEP_SECONDS'])).start()
+        return store
+
+
+def request_fingerprint(endpoint, body):
+    return hashlib.sha256(endpoint.encode() + b'\0' + body).hexdigest()
+
+
+def _key_row(customer_id, key):
+    return IdempotencyKey.customer_id == customer_id, IdempotencyKey.idempotency_key == key
+
+
+def _insert_key(customer_id, key, fingerprint):
+    db.session.add(IdempotencyKey(customer_id=customer_id, idempotency_key=key, fingerprint=fingerprint))
+
+
+def _take_over_or_read(customer_id, key, fingerprint, claim_timeout):
+    # A key still running after claim_timeout was claimed by a request that died before committing anything
+    now = datetime.utcnow()
+    taken_over = db.session.execute(update(IdempotencyKey)
+                                    .where(*_key_row(customer_id, key), IdempotencyKey.status == 'running',
+                                           IdempotencyKey.fingerprint == fingerprint,
+                                           IdempotencyKey.updated_at < now - timedelta(seconds=claim_timeout))
+                                    .values(updated_at=now)
+                                    .execution_options(synchronize_session=False)).rowcount
+    if taken_over:
+        return True, None
+    return False, db.session.execute(select(IdempotencyKey.fingerprint, IdempotencyKey.status, IdempotencyKey.status_code,
+                                            IdempotencyKey.response, IdempotencyKey.updated_at)
+                                     .where(*_key_row(customer_id, key))).one_or_none()
+
+
+def claim_key(customer_id, key, fingerprint, claim_timeout):
+    """Claim a key: (True, None) once claimed, otherwise (False, the holder's row), or no row if the key just expired.
+
+    Each attempt is its own transaction, so polling never reads the row from a stale snapshot.
+    """
+    try:
+        run_transaction(_insert_key, customer_id, key, fingerprint)
+        return True, None
+    except IntegrityError:
+        return run_transaction(_take_over_or_read, customer_id, key, fingerprint, claim_timeout)
+
+
+def begin_request(customer_id, key, fingerprint):
+    """Claim `key` for the current request, or wait for the request holding it.
+
+    Returns None once the key is held, and the caller runs the view and then calls
+    finish_request(); the commit of the view's write transaction marks the key applied.
+    Otherwise returns the StoredResponse to replay. Raises IdempotencyError for a malformed
+    key, a key used for another request, or one still held after IDEMPOTENCY_WAIT_SECONDS.
+    """
+    if not key or len(key) > MAX_KEY_LENGTH:
+        raise IdempotencyError(f'{IDEMPOTENCY_HEADER} must be 1 to {MAX_KEY_LENGTH} characters', 400)
+    config = current_app.config
+    store = get_idempotency_store()
+    scope = (customer_id, key)
+    deadline = time.monotonic() + config['IDEMPOTENCY_WAIT_SECONDS']
+    poll = POLL_SECONDS[0]
+    while True:
+        stored = store.cached(scope)
+        if stored is None:
+            claimed, row = claim_key(customer_id, key, fingerprint, config['IDEMPOTENCY_CLAIM_TIMEOUT'])
+            if claimed:
+                store.hold(scope)
+                db.session.info['idempotency_key'] = scope
+                return None
+            if row is None:
+                continue  # Expired and swept since the claim failed
+            if row.status == 'done':
+                stored = StoredResponse(row.fingerprint, row.status_code, bytes(row.response))
+                store.remember(scope, stored)
+        if (stored or row).fingerprint != fingerprint:
+            raise IdempotencyError(f'This {IDEMPOTENCY_HEADER} was already used for a different request', 422)
+        if stored is not None:
+            return stored
+        if row.status == 'applied' and row.updated_at < datetime.utcnow() - timedelta(
+                seconds=config['IDEMPOTENCY_CLAIM_TIMEOUT']):
+            raise IdempotencyError('This request was already applied, but its response was lost', 409)
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise IdempotencyError(f'A request with this {IDEMPOTENCY_HEADER} is still in progress', 409,
+                                   {'Retry-After': '1'})
+        if not store.wait(scope, remaining):
+            time.sleep(min(poll, remaining))
+            poll = min(poll * 2, POLL_SECONDS[1])
+
+
+def _release_key(customer_id, key):
+    return db.session.execute(delete(IdempotencyKey)
+                              .where(*_key_row(customer_id, key), IdempotencyKey.status == 'running')
+                              .execution_options(synchronize_session=False)).rowcount == 1
+
+
+def _store_response(customer_id, key, status_code, body):
+    db.session.execute(update(IdempotencyKey)
+                       .where(*_key_row(customer_id, key))
+                       .values(status='done', status_code=status_code, response=body)
+                       .execution_options(synchronize_session=False))
+
+
+def finish_request(customer_id, key, fingerprint, status_code=None, body=None):
+    """Store the response of the request holding `key`; no status means the view raised.
+
+    A failure that committed nothing releases the key instead, so the client's retry runs.
+    One that did commit leaves the key applied, and it is never run again.
+    """
+    store = get_idempotency_store()
+    scope = (customer_id, key)
+    db.session.info.pop('idempotency_key', None)
+    try:
+        if status_code is None or status_code >= 500:
+            if run_transaction(_release_key, customer_id, key) or status_code is None:
+                return
+        run_transaction(_store_response, customer_id, key, status_code, body)
+        store.remember(scope, StoredResponse(fingerprint, status_code, body))
+    finally:
+        store.release(scope)
+
+
+@event.listens_for(RoutingSession, 'before_commit')
+def _mark_applied(session):
+    # Runs in the transaction being committed, so the key is applied exactly when the work is
+    scope = session.info.get('idempotency_key')
+    if scope is not None:
+        session.execute(update(IdempotencyKey)
+                        .where(*_key_row(*scope), IdempotencyKey.status == 'running')
+                        .values(status='applied')
+                        .execution_options(synchronize_session=False))
+
+
+def _delete_expired(cutoff, batch_size):
+    keys = [tuple(row) for row in db.session.execute(
+        select(IdempotencyKey.customer_id, IdempotencyKey.idempotency_key)
+        .where(IdempotencyKey.created_at < cutoff)
+        .limit(batch_size))]
+    if keys:
+        db.session.execute(delete(IdempotencyKey)
+                           .where(tuple_(IdempotencyKey.customer_id, IdempotencyKey.idempotency_key).in_(keys))
+                           .execution_options(synchronize_session=False))
+    return len(keys)
+
+
+def sweep_expired_keys(ttl, batch_size=SWEEP_BATCH):
+    """Delete keys created more than `ttl` seconds ago, a batch per short transaction; returns how many."""
+    cutoff = datetime.utcnow() - timedelta(seconds=ttl)
+    deleted = 0
+    while True:
+        count = run_transaction(_delete_expired, cutoff, batch_size)
+        deleted += count
+        if count < batch_size:
+            return deleted
+
+
+def _sweep_forever(app, interval):
+    while True:
+        # Jitter keeps the workers of one host from all sweeping at once
+        time.sleep(interval * random.uniform(0.5, 1.5))
+        with app.app_context():
+            try:
+                deleted = sweep_expired_keys(app.config['IDEMPOTENCY_TTL'])
+                if deleted:
+                    logger.info('Deleted %d expired idempotency keys', deleted)
+            except Exception:
+                logger.exception('Sweeping expired idempotency keys failed')
@@ -0,0 +1,247 @@
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import select, insert, update
+from sqlalchemy.exc import IntegrityError
+from app import db
+from app.database import outside_write_transaction
+from app.models import IdSequence, WorkerLease
+
+logger = logging.getLogger(__name__)
+
+
+class BlockAllocator:
+    """Hands out increasing integers from blocks reserved in pba_id_sequence.
+
+    Only reserving a block touches the database (one short transaction of its own), so
+    allocating an ID costs nothing in the common case. Blocks never overlap, which keeps
+    IDs unique across processes; within a process they are strictly increasing.
+
+    `used_query(first, end)`, when given, selects the values in [first, end) that were taken
+    outside the sequence; it runs once per reserved block and those values are skipped.
+    """
+
+    def __init__(self, name, block_size=1000, start=1, start_query=None, used_query=None):
+        self.name = name
+        self.block_size = block_size
+        self.start = start
+        self.start_query = start_query
+        self.used_query = used_query
+        self.next_value = 0
+        self.block_end = 0
+        self.used = frozenset()
+        self.lock = threading.Lock()
+
+    def next_id(self):
+        with self.lock:
+            while True:
+                if self.next_value >= self.block_end:
+                    self.start_block(self.block_size)
+                value = self.next_value
+                self.next_value += 1
+                if value not in self.used:
+                    return value
+
+    def next_ids(self, count):
+        """Allocate `count` IDs at once, reserving a single block large enough for whatever is missing."""
+        with self.lock:
+            ids = []
+            while len(ids) < count:
+                if self.next_value >= self.block_end:
+                    self.start_block(max(self.block_size, count - len(ids)))
+                taken = min(count - len(ids), self.block_end - self.next_value)
+                ids.extend(value for value in range(self.next_value, self.next_value + taken) if value not in self.used)
+                self.next_value += taken
+            return ids
+
+    def start_block(self, size):
+        self.next_value = self.reserve_block(size)
+        self.block_end = self.next_value + size
+        self.used = frozenset()
+        if self.used_query is not None:
+            with outside_write_transaction(), db.engine.connect() as conn:
+                self.used = frozenset(conn.execute(self.used_query(self.next_value, self.block_end)).scalars())
+
+    def reserve_block(self, size=None):
+        size = size or self.block_size
+        while True:
+            try:
+                with db.engine.begin() as conn:
+                    # Bump first so the row stays write-locked until we have read our block back
+                    bumped = conn.execute(update(IdSequence).where(IdSequence.name == self.name)
+                                          .values(next_value=IdSequence.next_value + size))
+                    if bumped.rowcount:
+                        reserved_end = conn.execute(
+                            select(IdSequence.next_value).where(IdSequence.name == self.name)
+                        ).scalar()
+                        return reserved_end - size
+
+                    # First reservation ever: continue after any IDs that already exist
+                    current = self.start
+                    if self.start_query is not None:
+                        existing = conn.execute(self.start_query).scalar()
+                        if existing is not None:
+                            current = max(current, existing + 1)
+                    conn.execute(insert(IdSequence).values(name=self.name, next_value=current + size))
+                    return current
+            except IntegrityError:
+                # Another process created the sequence row first; reserve from it instead
+                continue
+
+
+class WorkerIdsExhausted(RuntimeError):
+    """Every snowflake worker id is leased by a live process."""
+
+
+def lease_worker_id(owner, lease_seconds, worker_ids):
+    """Lease the lowest free worker id below `worker_ids`, or one whose lease expired, for `owner`.
+
+    Raises WorkerIdsExhausted rather than share an id when all of them are held.
+    """
+    while True:
+        now = datetime.utcnow()
+        expires_at = now + timedelta(seconds=lease_seconds)
+        try:
+            with db.engine.begin() as conn:
+                taken = dict(conn.execute(select(WorkerLease.worker_id, WorkerLease.expires_at)).all())
+                free = next((worker_id for worker_id in range(worker_ids) if worker_id not in taken), None)
+                if free is not None:
+                    conn.execute(insert(WorkerLease).values(worker_id=free, owner=owner, expires_at=expires_at))
+                    return free
+                expired = sorted((expiry, worker_id) for worker_id, expiry in taken.items() if expiry < now)
+                if not expired:
+                    raise WorkerIdsExhausted(f'All {worker_ids} snowflake worker ids are leased; '
+                                             'set ID_WORKER_ID or run fewer processes')
+                # The expiry check makes taking over atomic: of two processes racing for it, one updates nothing
+                worker_id = expired[0][1]
+                if conn.execute(update(WorkerLease)
+                                .where(WorkerLease.worker_id == worker_id, WorkerLease.expires_at < now)
+                                .values(owner=owner, expires_at=expires_at)).rowcount:
+                    return worker_id
+        except IntegrityError:
+            pass  # Another process inserted the same free id first; look again
+
+
+def renew_worker_lease(worker_id, owner, lease_seconds):
+    """Extend `owner`'s lease on `worker_id`; False if it expired and another process took it."""
+    with db.engine.begin() as conn:
+        return conn.execute(update(WorkerLease)
+                            .where(WorkerLease.worker_id == worker_id, WorkerLease.owner == owner)
+                            .values(expires_at=datetime.utcnow() + timedelta(seconds=lease_seconds))).rowcount == 1
+
+
+class SnowflakeAllocator:
+    """Time-ordered 63-bit IDs: milliseconds since EPOCH_MS, a 10-bit worker id and a 12-bit counter.
+
+    Unless one is configured, the worker id is leased from pba_worker_lease when the allocator
+    starts, so every process (e.g. each gunicorn worker) gets a different one without
+    configuration. A thread renews the lease every third of `lease_seconds`; the ids of
+    processes that exited are reused once their leases expire. An allocator whose lease has
+    run down to its last third stops and leases again before handing out another ID, which
+    leaves that third as margin for clock skew between hosts.
+    """
+
+    EPOCH_MS = 1704067200000  # 2024-01-01T00:00:00Z
+    WORKER_BITS = 10
+    SEQUENCE_BITS = 12
+
+    def __init__(self, worker_id=None, lease_seconds=60):
+        if worker_id is not None and not 0 <= worker_id < 1 << self.WORKER_BITS:
+            raise ValueError(f'Snowflake worker id must be between 0 and {(1 << self.WORKER_BITS) - 1}')
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+        self.lease_owner = None
+        self.lease_valid_until = None  # time.monotonic() after which the lease is no longer trusted
+        self.last_ms = -1
+        self.sequence = 0
+        self.lock = threading.Lock()
+        if worker_id is None:
+            self.lease_owner = f'{socket.gethostname()[:40]}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+            self.acquire_lease()
+            threading.Thread(target=self._renew_forever, name='snowflake-lease', daemon=True,
+                             args=(current_app._get_current_object(),)).start()
+
+    def acquire_lease(self):
+        started = time.monotonic()
+        self.worker_id = lease_worker_id(self.lease_owner, self.lease_seconds, 1 << self.WORKER_BITS)
+        self.lease_valid_until = started + self.lease_seconds * 2 / 3
+
+    def renew_lease(self):
+        started = time.monotonic()
+        worker_id = self.worker_id
+        renewed = renew_worker_lease(worker_id, self.lease_owner, self.lease_seconds)
+        with self.lock:
+            if self.worker_id == worker_id:
+                # A lost lease makes the next ID wait for a new one
+                self.lease_valid_until = started + self.lease_seconds * 2 / 3 if renewed else 0
+
+    def _renew_forever(self, app):
+        while True:
+            time.sleep(self.lease_seconds / 3)
+            with app.app_context():
+                try:
+                    self.renew_lease()
+                except Exception:
+                    logger.exception('Renewing the lease on snowflake worker id %s failed', self.worker_id)
+
+    def next_id(self):
+        with self.lock:
+            if self.lease_valid_until is not None and time.monotonic() >= self.lease_valid_until:
+                self.acquire_lease()
+            now = max(self.current_ms(), self.last_ms)  # Never step backwards if the clock does
+            if now == self.last_ms:
+                self.sequence = (self.sequence + 1) & ((1 << self.SEQUENCE_BITS) - 1)
+                if self.sequence == 0:
+                    # Counter exhausted for this millisecond, wait for the next one
+                    while now <= self.last_ms:
+                        now = self.current_ms()
+            else:
+                self.sequence = 0
+            self.last_ms = now
+            return ((now - self.EPOCH_MS) << (self.WORKER_BITS + self.SEQUENCE_BITS)) \
+                | (self.worker_id << self.SEQUENCE_BITS) | self.sequence
+
+    def next_ids(self, count):
+        return [self.next_id() for _ in range(count)]
+
+    @staticmethod
+    def current_ms():
+        return time.time_ns() // 1_000_000
+
+
+def build_allocator(kind, sequence_name, **options):
+    if kind == 'snowflake':
+        if options.get('worker_id') is None:
+            WorkerLease.__table__.create(db.engine, checkfirst=True)
+        return SnowflakeAllocator(worker_id=options.get('worker_id'), lease_seconds=options.get('lease_seconds', 60))
+    if kind == 'block':
+        IdSequence.__table__.create(db.engine, checkfirst=True)
+        return BlockAllocator(sequence_name, block_size=options.get('block_size', 1000), start=options.get('start', 1),
+                              start_query=options.get('start_query'), used_query=options.get('used_query'))
+    raise ValueError(f'Unknown ID allocator: {kind}')
+
+
+_allocators = {}
+_allocators_pid = None
+_allocators_lock = threading.Lock()
+
+def get_allocator(name, **options):
+    """Return this process's allocator for `name`, configured by app.config['<NAME>_ID_ALLOCATOR']."""
+    global _allocators_pid
+    with _allocators_lock:
+        # Allocator state must not be shared with a forked parent, or two workers would hand out the same IDs
+        if _allocators_pid != os.getpid():
+            _allocators.clear()
+            _allocators_pid = os.getpid()
+        if name not in _allocators:
+            kind = current_app.config.get(f'{name.upper()}_ID_ALLOCATOR', 'block')
+            options.setdefault('worker_id', current_app.config.get('ID_WORKER_ID'))
+            options.setdefault('block_size', current_app.config.get('ID_BLOCK_SIZE', 1000))
+            options.setdefault('lease_seconds', current_app.config.get('ID_WORKER_LEASE_SECONDS', 60))
+            _allocators[name] = build_allocator(kind, name, **options)
+        return _allocators[name]
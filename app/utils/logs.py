@@ -0,0 +1,222 @@
+import atexit
+import logging
+import os
+import queue
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+from contextvars import ContextVar
+from datetime import datetime, timezone
+import msgspec
+from flask import request
+
+access_logger = logging.getLogger('app.access')
+
+# Attributes every LogRecord has; anything else on a record came from `extra=` and is logged as a field
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+# Client-supplied request ids are echoed into logs and headers, so only accept plain tokens
+_REQUEST_ID = re.compile(r'^[A-Za-z0-9._-]{1,64}$')
+
+
+class RequestLogContext:
+    __slots__ = ('request_id', 'endpoint', 'started', 'sampled', 'status')
+
+    def __init__(self, request_id, endpoint, sampled):
+        self.request_id = request_id
+        self.endpoint = endpoint
+        self.started = time.perf_counter()
+        self.sampled = sampled
+        self.status = None
+
+
+_request_context = ContextVar('request_log_context', default=None)
+
+
+class RequestContextFilter(logging.Filter):
+    """Stamps records with the request id, endpoint and time since the request started.
+
+    Runs in the thread that logs, before the record is queued, since the request context
+    is not available to the listener thread. Records below WARNING from a request that was
+    not sampled are dropped here.
+    """
+
+    def filter(self, record):
+        context = _request_context.get()
+        if context is None:
+            return True
+        if not context.sampled and record.levelno < logging.WARNING:
+            return False
+        record.request_id = context.request_id
+        record.endpoint = context.endpoint
+        record.duration_ms = round((time.perf_counter() - context.started) * 1000, 3)
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger and message, then request and `extra=` fields."""
+
+    def __init__(self):
+        super().__init__()
+        self.encoder = msgspec.json.Encoder(enc_hook=str)
+
+    def format(self, record):
+        line = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for name, value in vars(record).items():
+            if name not in _RECORD_ATTRIBUTES:
+                line[name] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            line['exception'] = record.exc_text
+        return self.encoder.encode(line).decode('utf-8')
+
+
+class NonBlockingQueueHandler(logging.Handler):
+    """Hands records to a background thread that formats and writes them in batches.
+
+    The request thread only appends to a bounded queue and never waits: when the queue is
+    full the record is dropped and counted, so a slow log sink cannot stall requests. The
+    writer wakes every `flush_interval` seconds rather than once per record, which keeps it
+    from taking the GIL away from request threads on every line. It is restarted after a
+    fork, because threads do not survive one.
+    """
+
+    def __init__(self, stream, max_queued, flush_interval=0.05):
+        super().__init__()
+        self.stream = stream
+        self.max_queued = max_queued
+        self.flush_interval = flush_interval
+        self.records = deque()
+        self.dropped = 0
+        self.writer = None
+        self.writer_pid = None
+        self.stopping = threading.Event()
+        self.writer_lock = threading.Lock()
+
+    def prepare(self, record):
+        # Resolve the message now, while its arguments still hold their current values; leave the JSON to the writer
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def emit(self, record):
+        if self.writer_pid != os.getpid():
+            self.start_writer()
+        if len(self.records) >= self.max_queued:
+            self.dropped += 1
+            return
+        self.records.append(self.prepare(record))
+
+    def start_writer(self):
+        with self.writer_lock:
+            if self.writer_pid != os.getpid():
+                self.records.clear()  # Records queued before a fork belong to the parent
+                self.stopping.clear()
+                self.writer = threading.Thread(target=self.run_writer, name='log-writer', daemon=True)
+                self.writer.start()
+                self.writer_pid = os.getpid()
+
+    def run_writer(self):
+        while not self.stopping.wait(self.flush_interval):
+            self.write_queued()
+        self.write_queued()
+
+    def write_queued(self):
+        lines = []
+        while self.records:
+            record = self.records.popleft()
+            try:
+                lines.append(self.format(record))
+            except Exception:
+                self.handleError(record)
+        if lines:
+            try:
+                self.stream.write('\n'.join(lines) + '\n')
+                self.stream.flush()
+            except Exception:
+                self.dropped += len(lines)
+
+    def close(self):
+        with self.writer_lock:
+            if self.writer is not None and self.writer_pid == os.getpid():
+                self.stopping.set()
+                self.writer.join()  # Writes out whatever is still queued
+                self.writer_pid = None
+        super().close()
+
+
+def parse_mapping(value, convert):
+    """'a=1,b=2' -> {'a': convert('1'), 'b': convert('2')}; the format of LOG_LEVELS and LOG_SAMPLING."""
+    pairs = (item.split('=', 1) for item in value.split(',') if item.strip())
+    return {key.strip(): convert(setting.strip()) for key, setting in pairs}
+
+
+def configure_logging(app):
+    """Send every log record through one non-blocking JSON handler on the root logger.
+
+    LOG_LEVEL sets the root level and LOG_LEVELS overrides it per logger. Calling this again
+    (a second create_app() in one process) replaces the previous handler.
+    """
+    config = app.config
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        if isinstance(handler, NonBlockingQueueHandler):
+            root.removeHandler(handler)
+            handler.close()
+
+    handler = NonBlockingQueueHandler(sys.stdout, config['LOG_QUEUE_SIZE'])
+    handler.setFormatter(JsonFormatter())
+    handler.addFilter(RequestContextFilter())
+    root.addHandler(handler)
+    root.setLevel(config['LOG_LEVEL'])
+    for name, level in parse_mapping(config['LOG_LEVELS'], str.upper).items():
+        logging.getLogger(name).setLevel(level)
+    atexit.register(handler.close)
+
+    # Flask would otherwise add its own stderr handler to app.logger
+    from flask.logging import default_handler
+    app.logger.removeHandler(default_handler)
+
+    app.extensions['log_handler'] = handler
+    sampling = parse_mapping(config['LOG_SAMPLING'], float)
+
+    @app.before_request
+    def start_request_log():
+        request_id = request.headers.get('X-Request-ID', '')
+        if not _REQUEST_ID.match(request_id):
+            request_id = uuid.uuid4().hex
+        rate = sampling.get(request.endpoint, 1.0)
+        _request_context.set(RequestLogContext(request_id, request.endpoint or 'unmatched',
+                                               rate >= 1.0 or random.random() < rate))
+
+    @app.after_request
+    def tag_response(response):
+        context = _request_context.get()
+        if context is not None:
+            context.status = response.status_code
+            response.headers['X-Request-ID'] = context.request_id
+        return response
+
+    @app.teardown_request
+    def log_request(error):
+        # After a streamed body has been sent, so the duration covers all of it
+        context = _request_context.get()
+        if context is None:
+            return
+        if config['ACCESS_LOG']:
+            status = context.status or 500
+            access_logger.info('%s %s %s', request.method, request.path, status,
+                               extra={'method': request.method, 'path': request.path, 'status': status})
+        _request_context.set(None)
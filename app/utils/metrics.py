@@ -0,0 +1,206 @@
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from flask import request, current_app
+from sqlalchemy import event
+from app import db
+from app.database import TimedQueuePool
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+SLOW_QUERY_MAX_CHARS = 2000
+
+
+class Histogram:
+    """Prometheus-style histogram: per-bucket counts plus the sum and count of observations."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last slot is +Inf
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def samples(self):
+        """(le, cumulative count) pairs, ending with +Inf."""
+        total = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            total += count
+            yield bound, total
+
+
+class RequestStats:
+    """SQL activity of the request being served; filled in by the engine hooks."""
+
+    __slots__ = ('started', 'queries', 'db_time', 'lock_wait', 'status')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.lock_wait = 0.0
+        self.status = None
+
+
+_request_stats = ContextVar('request_stats', default=None)
+
+
+class Metrics:
+    """Per-endpoint request and SQL metrics for one app, rendered in the Prometheus text format.
+
+    Statements are timed by engine hooks and charged to the request that ran them. Each
+    request takes the lock once, when it finishes, so concurrent requests do not contend
+    on every statement.
+    """
+
+    def __init__(self, slow_query_seconds):
+        self.slow_query_seconds = slow_query_seconds
+        self.lock = threading.Lock()
+        self.requests = {}        # (endpoint, method, status) -> count
+        self.latency = {}         # endpoint -> Histogram of request seconds
+        self.query_counts = {}    # endpoint -> Histogram of statements per request
+        self.db_time = {}         # endpoint -> Histogram of SQL seconds per request
+        self.lock_wait = {}       # endpoint -> Histogram of locking-statement seconds per request
+        self.slow_queries = {}    # endpoint -> count
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        context._metrics_started = time.perf_counter()
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - context._metrics_started
+        stats = _request_stats.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.db_time += elapsed
+            # Statements that wait on row locks (or SQLite's write lock); their run time counts as lock wait
+            if ' FOR UPDATE' in statement or statement.startswith('BEGIN IMMEDIATE'):
+                stats.lock_wait += elapsed
+        if self.slow_query_seconds and elapsed >= self.slow_query_seconds:
+            self.record_slow_query(statement, elapsed)
+
+    def record_slow_query(self, statement, elapsed):
+        endpoint = _endpoint() if _request_stats.get() is not None else None
+        with self.lock:
+            self.slow_queries[endpoint or 'none'] = self.slow_queries.get(endpoint or 'none', 0) + 1
+        logger.warning('Slow query took %.1f ms on %s: %s', elapsed * 1000, endpoint or 'no endpoint',
+                       ' '.join(statement.split())[:SLOW_QUERY_MAX_CHARS])
+
+    def start_request(self):
+        _request_stats.set(RequestStats())
+
+    def finish_request(self, response):
+        stats = _request_stats.get()
+        if stats is not None:
+            stats.status = response.status_code
+            response.headers.add('Server-Timing', f'db;dur={stats.db_time * 1000:.3f}')
+        return response
+
+    def teardown_request(self, error):
+        # Runs after a streamed body has been sent, so its statements and time are included
+        stats = _request_stats.get()
+        if stats is None:
+            return
+        _request_stats.set(None)
+        elapsed = time.perf_counter() - stats.started
+        endpoint = _endpoint()
+        status = stats.status or 500
+        with self.lock:
+            key = (endpoint, request.method, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            for histograms, buckets, value in ((self.latency, LATENCY_BUCKETS, elapsed),
+                                               (self.query_counts, QUERY_COUNT_BUCKETS, stats.queries),
+                                               (self.db_time, LATENCY_BUCKETS, stats.db_time),
+                                               (self.lock_wait, LATENCY_BUCKETS, stats.lock_wait)):
+                histogram = histograms.get(endpoint)
+                if histogram is None:
+                    histogram = histograms[endpoint] = Histogram(buckets)
+                histogram.observe(value)
+
+    def render(self, engines, cache=None):
+        """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+        lines = []
+        with self.lock:
+            _samples(lines, 'safe_http_requests_total', 'Requests served.', 'counter',
+                     (((('endpoint', endpoint), ('method', method), ('status', status)), count)
+                      for (endpoint, method, status), count in sorted(self.requests.items())))
+            _histograms(lines, 'safe_http_request_duration_seconds', 'Request latency.', self.latency)
+            _histograms(lines, 'safe_db_queries_per_request', 'SQL statements run per request.', self.query_counts)
+            _histograms(lines, 'safe_db_time_seconds', 'Time spent in SQL statements per request.', self.db_time)
+            _histograms(lines, 'safe_db_lock_wait_seconds',
+                        'Time spent in locking statements (SELECT ... FOR UPDATE, BEGIN IMMEDIATE) per request.',
+                        self.lock_wait)
+            _samples(lines, 'safe_db_slow_queries_total', 'Statements slower than SLOW_QUERY_MS.', 'counter',
+                     (((('endpoint', endpoint),), count) for endpoint, count in sorted(self.slow_queries.items())))
+
+        pools = [((('pool', key or 'primary'),), engine.pool) for key, engine in engines.items()
+                 if isinstance(engine.pool, TimedQueuePool)]
+        _samples(lines, 'safe_db_pool_checked_out', 'Connections currently checked out.', 'gauge',
+                 ((labels, pool.checkedout()) for labels, pool in pools))
+        _samples(lines, 'safe_db_pool_checkouts_total', 'Connection checkouts.', 'counter',
+                 ((labels, pool.wait_stats.checkouts) for labels, pool in pools))
+        _samples(lines, 'safe_db_pool_wait_seconds_total', 'Time spent waiting for a free connection.', 'counter',
+                 ((labels, pool.wait_stats.total_wait) for labels, pool in pools))
+        if cache is not None:
+            stats = cache.stats.snapshot()
+            _samples(lines, 'safe_response_cache_total', 'Response cache lookups, stores and invalidations.', 'counter',
+                     (((('result', name),), stats[name]) for name in ('hits', 'misses', 'stores', 'invalidations')))
+        return '\n'.join(lines) + '\n'
+
+
+def _endpoint():
+    # Unmatched URLs share one label so scanners cannot blow up the number of series
+    return request.endpoint or 'unmatched'
+
+
+def _labels(pairs):
+    escaped = (name + '="' + str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+               for name, value in pairs)
+    return '{' + ','.join(escaped) + '}' if pairs else ''
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _header(lines, name, help_text, kind):
+    lines.append(f'# HELP {name} {help_text}')
+    lines.append(f'# TYPE {name} {kind}')
+
+
+def _samples(lines, name, help_text, kind, samples):
+    _header(lines, name, help_text, kind)
+    for labels, value in samples:
+        lines.append(f'{name}{_labels(labels)} {_number(value)}')
+
+
+def _histograms(lines, name, help_text, histograms):
+    _header(lines, name, help_text, 'histogram')
+    for endpoint, histogram in sorted(histograms.items()):
+        for bound, count in histogram.samples():
+            lines.append(f'{name}_bucket{_labels((("endpoint", endpoint), ("le", bound)))} {count}')
+        lines.append(f'{name}_sum{_labels((("endpoint", endpoint),))} {_number(histogram.sum)}')
+        lines.append(f'{name}_count{_labels((("endpoint", endpoint),))} {sum(histogram.counts)}')
+
+
+def init_metrics(app):
+    """Install the request and engine hooks when app.config['METRICS_ENABLED'] is set."""
+    if not app.config['METRICS_ENABLED']:
+        return
+    metrics = app.extensions['metrics'] = Metrics(app.config['SLOW_QUERY_MS'] / 1000)
+    with app.app_context():
+        for engine in db.engines.values():
+            event.listen(engine, 'before_cursor_execute', metrics.before_cursor_execute)
+            event.listen(engine, 'after_cursor_execute', metrics.after_cursor_execute)
+    app.before_request(metrics.start_request)
+    app.after_request(metrics.finish_request)
+    app.teardown_request(metrics.teardown_request)
+
+
+def get_metrics():
+    return current_app.extensions.get('metrics')
@@ -0,0 +1,221 @@
+import threading
+from datetime import datetime
+from decimal import Decimal
+from sqlalchemy import select, func, insert, update
+from app import db
+from app.models import (Account, Customer, CheckingAccount, SavingsAccount, Loan, University, StudentLoan,
+                        PersonalLoan, HomeLoan, BalanceSnapshot)
+from app.utils.cache import invalidate_after_commit
+from app.utils.helpers import generate_unique_account_numbers
+from app.utils.transfers import run_transaction
+
+ONBOARDING_CHUNK_SIZE = 1000
+# Account numbers per approval UPDATE, below every driver's bound-parameter limit
+APPROVAL_CHUNK_SIZE = 5000
+
+# Opening balance the checking and savings models give new accounts
+OPENING_BALANCE = {
+    'Checking': CheckingAccount.__table__.c.balance.default.arg,
+    'Savings': SavingsAccount.__table__.c.balance.default.arg,
+}
+
+ADDRESS_FIELDS = ['acctType', 'acctStreet', 'acctCity', 'acctState', 'acctZip', 'customerId']
+TYPE_FIELDS = {
+    'Checking': ['serviceCharge'],
+    'Savings': ['interestRate'],
+    'Loan': ['loanRate', 'loanAmount', 'loanMonths', 'loanType'],
+}
+LOAN_TYPE_FIELDS = {
+    'Student': ['universityname', 'studentid', 'studentStatus', 'expecteddate'],
+    'Personal': [],
+    'Home': ['builtyear', 'hianumber', 'icname', 'icstreet', 'iccity', 'icstate', 'iczip', 'premium'],
+}
+INTEGER_FIELDS = {'acctZip', 'customerId', 'loanAmount', 'loanMonths', 'studentid', 'builtyear', 'hianumber',
+                  'iczip', 'premium'}
+FLOAT_FIELDS = {'serviceCharge', 'interestRate', 'loanRate'}
+
+
+class UniversityCache:
+    """Process-wide university name -> id map, so batches resolve each name against the database once."""
+
+    def __init__(self):
+        self.ids = {}
+        self.lock = threading.Lock()
+
+    def resolve(self, names):
+        """Return {name: universityid}, creating universities that do not exist yet.
+
+        New universities are committed in a transaction of their own, so an id in the cache
+        always refers to a row that exists even if the batch that needed it rolls back.
+        """
+        with self.lock:
+            missing = set(names) - self.ids.keys()
+            if missing:
+                with db.engine.begin() as conn:
+                    # Names are not unique in the table; the oldest row wins, as with filter_by().first()
+                    found = dict(conn.execute(
+                        select(University.universityname, func.min(University.universityid))
+                        .where(University.universityname.in_(missing))
+                        .group_by(University.universityname)).all())
+                    for name in missing - found.keys():
+                        found[name] = conn.execute(insert(University).values(universityname=name)).inserted_primary_key[0]
+                self.ids.update(found)
+            return {name: self.ids[name] for name in names}
+
+
+university_cache = UniversityCache()
+
+
+def validate_account_row(row):
+    """Check one account row (the same fields /create_account takes) and convert its values.
+
+    Returns the cleaned row, or raises ValueError with the message to report for it.
+    """
+    if not isinstance(row, dict):
+        raise ValueError('Row must be an object')
+    if row.get('acctType') not in TYPE_FIELDS:
+        raise ValueError('acctType must be Checking, Savings or Loan')
+    required = ADDRESS_FIELDS + TYPE_FIELDS[row['acctType']]
+    if row['acctType'] == 'Loan':
+        if row.get('loanType') not in LOAN_TYPE_FIELDS:
+            raise ValueError('loanType must be Student, Personal or Home')
+        required += LOAN_TYPE_FIELDS[row['loanType']]
+    missing = [name for name in required if row.get(name) in (None, '')]
+    if missing:
+        raise ValueError(f"Missing required fields: {', '.join(missing)}")
+
+    cleaned = {}
+    for name in required:
+        value = row[name]
+        try:
+            if name in INTEGER_FIELDS:
+                number = Decimal(str(value))
+                if number != number.to_integral_value():
+                    raise ValueError()
+                value = int(number)
+            elif name in FLOAT_FIELDS:
+                value = float(value)
+            elif name == 'expecteddate':
+                value = datetime.strptime(str(value), '%Y-%m-%d')
+            else:
+                value = str(value)
+        except (ValueError, ArithmeticError):
+            raise ValueError(f'Invalid value for {name}')
+        cleaned[name] = value
+    return cleaned
+
+
+def insert_account_chunk(rows, numbers, customer_names, university_ids):
+    """Bulk-insert a chunk of validated rows under the given account numbers, in the caller's transaction."""
+    now = datetime.utcnow()
+    tables = {model: [] for model in (Account, CheckingAccount, SavingsAccount, BalanceSnapshot, Loan,
+                                      StudentLoan, PersonalLoan, HomeLoan)}
+    for row, acct_no in zip(rows, numbers):
+        acct_type = row['acctType']
+        tables[Account].append({
+            'acct_no': acct_no,
+            'acct_name': f"{customer_names[row['customerId']]} {acct_type}",
+            'acct_street': row['acctStreet'],
+            'acct_city': row['acctCity'],
+            'acct_state': row['acctState'],
+            'acct_zip': row['acctZip'],
+            'acct_type': acct_type,
+            'date_opened': now,
+            'customerid': row['customerId'],
+            'status': Account.PENDING
+        })
+        if acct_type == 'Checking':
+            tables[CheckingAccount].append({'acct_no': acct_no, 'service_charge': row['serviceCharge'],
+                                            'balance': OPENING_BALANCE['Checking']})
+        elif acct_type == 'Savings':
+            tables[SavingsAccount].append({'acct_no': acct_no, 'interest_rate': row['interestRate'],
+                                           'balance': OPENING_BALANCE['Savings']})
+        else:
+            tables[Loan].append({'acct_no': acct_no, 'loan_rate': row['loanRate'], 'loan_amount': row['loanAmount'],
+                                 'loan_payment': 0, 'loan_months': row['loanMonths'], 'loan_type': row['loanType']})
+            if row['loanType'] == 'Student':
+                tables[StudentLoan].append({'acct_no': acct_no, 'studentid': row['studentid'],
+                                            'status': row['studentStatus'], 'expecteddate': row['expecteddate'],
+                                            'universityid': university_ids[row['universityname']]})
+            elif row['loanType'] == 'Personal':
+                tables[PersonalLoan].append({'acct_no': acct_no})
+            else:
+                tables[HomeLoan].append({'acct_no': acct_no, **{name: row[name] for name in LOAN_TYPE_FIELDS['Home']}})
+        if acct_type in OPENING_BALANCE:
+            tables[BalanceSnapshot].append({'acct_no': acct_no, 'snapshot_date': now.date(),
+                                            'balance': OPENING_BALANCE[acct_type]})
+
+    # Parents before children so foreign keys are satisfied
+    for model, mappings in tables.items():
+        if mappings:
+            db.session.bulk_insert_mappings(model, mappings)
+    invalidate_after_commit(*{row['customerId'] for row in rows})
+
+
+def onboard_accounts(rows, chunk_size=ONBOARDING_CHUNK_SIZE):
+    """Create many accounts from /create_account-style rows, committing every `chunk_size` accounts.
+
+    Every row is validated before anything is written. Returns one result per row, in order:
+    {'index', 'status': 'ok', 'account_number'} or {'index', 'status': 'failed', 'error'}.
+    A chunk that fails to insert reports its error on each of its rows; other chunks are kept.
+    """
+    results = []
+    valid = []
+    for index, row in enumerate(rows):
+        try:
+            valid.append((index, validate_account_row(row)))
+            results.append({'index': index, 'status': 'ok'})
+        except ValueError as e:
+            results.append({'index': index, 'status': 'failed', 'error': str(e)})
+
+    customer_ids = {row['customerId'] for _, row in valid}
+    customer_names = {customer_id: f'{cfname} {clname}' for customer_id, cfname, clname in db.session.query(
+        Customer.customerid, Customer.cfname, Customer.clname).filter(Customer.customerid.in_(customer_ids))}
+    db.session.rollback()  # Release the read transaction before the chunked writes
+    for index, row in valid:
+        if row['customerId'] not in customer_names:
+            results[index] = {'index': index, 'status': 'failed', 'error': 'Customer not found'}
+    valid = [(index, row) for index, row in valid if results[index]['status'] == 'ok']
+
+    university_ids = university_cache.resolve({row['universityname'] for _, row in valid if 'universityname' in row})
+    numbers = generate_unique_account_numbers(len(valid))
+    for start in range(0, len(valid), chunk_size):
+        chunk = valid[start:start + chunk_size]
+        chunk_numbers = numbers[start:start + chunk_size]
+        try:
+            run_transaction(insert_account_chunk, [row for _, row in chunk], chunk_numbers,
+                            customer_names, university_ids)
+        except Exception as e:
+            for index, _ in chunk:
+                results[index] = {'index': index, 'status': 'failed', 'error': str(e)}
+            continue
+        for (index, _), acct_no in zip(chunk, chunk_numbers):
+            results[index]['account_number'] = acct_no
+    return results
+
+
+def approve_pending_accounts(account_numbers):
+    """Approve whichever of the given accounts are still pending, with set-based UPDATEs.
+
+    Runs in the caller's transaction and returns the approved account numbers. Accounts that
+    are unknown or already approved are skipped.
+    """
+    approved = []
+    numbers = sorted(set(account_numbers))
+    for start in range(0, len(numbers), APPROVAL_CHUNK_SIZE):
+        chunk = numbers[start:start + APPROVAL_CHUNK_SIZE]
+        pending = (Account.acct_no.in_(chunk)) & (Account.status == Account.PENDING)
+        statement = (update(Account).where(pending).values(status=Account.APPROVED)
+                     .execution_options(synchronize_session=False))
+        if db.engine.dialect.update_returning:
+            rows = db.session.execute(statement.returning(Account.acct_no, Account.customerid)).all()
+        else:
+            # No UPDATE ... RETURNING (MySQL): lock the matching rows, then update exactly those
+            rows = db.session.execute(select(Account.acct_no, Account.customerid).where(pending)
+                                      .order_by(Account.acct_no).with_for_update()).all()
+            if rows:
+                db.session.execute(update(Account).where(Account.acct_no.in_([acct_no for acct_no, _ in rows]))
+                                   .values(status=Account.APPROVED).execution_options(synchronize_session=False))
+        approved.extend(acct_no for acct_no, _ in rows)
+        invalidate_after_commit(*{customer_id for _, customer_id in rows})
+    return approved
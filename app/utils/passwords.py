@@ -0,0 +1,57 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import bcrypt
+from flask import current_app
+
+
+class PasswordHashingBusy(Exception):
+    """Raised when too many password hashes are already running or queued."""
+
+
+class HashingPool:
+    """Runs bcrypt on a fixed set of threads and rejects work beyond `max_pending` instead of queueing it.
+
+    This bounds the CPU a process spends on hashing; it does not free the request thread, which
+    waits for its hash. Both limits are per process: a sync gunicorn worker serves one request
+    at a time and never reaches them, so there the worker count is what bounds hashing.
+    """
+
+    def __init__(self, workers, max_pending):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='bcrypt')
+        self.slots = threading.BoundedSemaphore(max_pending)
+
+    def run(self, fn, *args):
+        if not self.slots.acquire(blocking=False):
+            raise PasswordHashingBusy()
+        try:
+            return self.executor.submit(fn, *args).result()
+        finally:
+            self.slots.release()
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+def get_hashing_pool():
+    global _pool, _pool_pid
+    with _pool_lock:
+        # Executor threads do not survive a fork, so each worker process builds its own pool
+        if _pool is None or _pool_pid != os.getpid():
+            workers = current_app.config['BCRYPT_POOL_SIZE']
+            _pool = HashingPool(workers, current_app.config.get('BCRYPT_MAX_PENDING') or workers)
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def hash_password(password):
+    salt = bcrypt.gensalt(rounds=current_app.config['BCRYPT_ROUNDS'])
+    return get_hashing_pool().run(bcrypt.hashpw, password.encode('utf-8'), salt)
+
+def verify_password(password, password_hash):
+    return get_hashing_pool().run(bcrypt.checkpw, password.encode('utf-8'), password_hash)
+
+def password_needs_rehash(password_hash):
+    """True when the hash was made with a different cost than BCRYPT_ROUNDS ($2b$<cost>$...)."""
+    return int(password_hash.split(b'$')[2]) != current_app.config['BCRYPT_ROUNDS']
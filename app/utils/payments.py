@@ -0,0 +1,68 @@
+import random
+import time
+from collections import namedtuple
+import stripe
+from flask import current_app
+
+# status is 'succeeded' or 'failed'; reference is the processor's id for the payment
+PaymentResult = namedtuple('PaymentResult', ['status', 'reference', 'error'])
+
+
+class StripeGateway:
+    """Confirms card payments through Stripe PaymentIntents."""
+
+    def confirm_payment(self, amount_in_cents, payment_method_id, idempotency_key):
+        try:
+            # Correctly configure the PaymentIntent to avoid redirect-based payment methods
+            intent = stripe.PaymentIntent.create(
+                amount=amount_in_cents,
+                currency='usd',
+                payment_method=payment_method_id,
+                confirm=True,  # Automatically confirm the payment
+                automatic_payment_methods={
+                    'enabled': True,
+                    'allow_redirects': 'never'  # Correct usage according to the Stripe documentation
+                },
+                idempotency_key=idempotency_key
+            )
+        except (stripe.error.CardError, stripe.error.InvalidRequestError) as e:
+            return PaymentResult('failed', None, str(e))
+        if intent.status == 'succeeded':
+            return PaymentResult('succeeded', intent.id, None)
+        return PaymentResult('failed', intent.id, f'Payment failed: {intent.status}')
+
+
+class FakeGateway:
+    """Offline stand-in for load tests: waits `latency_ms` and declines a `failure_rate` share of payments.
+
+    Repeating an idempotency key returns the first result, as Stripe does.
+    """
+
+    def __init__(self, latency_ms=0, failure_rate=0.0):
+        self.latency_ms = latency_ms
+        self.failure_rate = failure_rate
+        self.results = {}
+
+    def confirm_payment(self, amount_in_cents, payment_method_id, idempotency_key):
+        if idempotency_key in self.results:
+            return self.results[idempotency_key]
+        time.sleep(self.latency_ms / 1000)
+        if random.random() < self.failure_rate:
+            result = PaymentResult('failed', f'fake_{idempotency_key}', 'Simulated decline')
+        else:
+            result = PaymentResult('succeeded', f'fake_{idempotency_key}', None)
+        self.results[idempotency_key] = result
+        return result
+
+
+def get_payment_gateway():
+    """The gateway selected by app.config['PAYMENT_GATEWAY'] ('stripe' or 'fake'), built once per app."""
+    gateway = current_app.extensions.get('payment_gateway')
+    if gateway is None:
+        if current_app.config['PAYMENT_GATEWAY'] == 'fake':
+            gateway = FakeGateway(current_app.config['FAKE_GATEWAY_LATENCY_MS'],
+                                  current_app.config['FAKE_GATEWAY_FAILURE_RATE'])
+        else:
+            gateway = StripeGateway()
+        current_app.extensions['payment_gateway'] = gateway
+    return gateway
@@ -0,0 +1,142 @@
+"""Monthly ledger postings: interest on savings accounts and service charges on checking accounts.
+
+Meant to be run nightly by a scheduler (`flask post-monthly-charges`). Each kind of posting
+is done once per month: a run walks the approved accounts in acct_no order, a chunk per
+transaction, and records its position in pba_posting_run in the same transaction as the
+chunk's postings. A run that is interrupted resumes after the last committed chunk, and
+running it again once it is done changes nothing.
+
+Postings are written like deposits, as a transaction from the account to itself; service
+charges are negative amounts, so every reader that sums an account's history adds them up
+correctly.
+"""
+import time
+from collections import namedtuple
+from datetime import date, datetime
+from decimal import Decimal
+import numpy as np
+from sqlalchemy import case, delete, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from app import db
+from app.models import Account, CheckingAccount, SavingsAccount, Transaction, BalanceSnapshot, PostingRun
+from app.utils.cache import invalidate_after_commit
+from app.utils.helpers import generate_unique_transaction_id
+from app.utils.hot_accounts import slot_totals
+from app.utils.transfers import run_transaction
+
+POSTING_CHUNK_SIZE = 500
+# Fraction of wall time the job may spend holding row locks; it sleeps for the rest
+POSTING_DUTY_CYCLE = 0.5
+
+
+def monthly_interest_cents(balance_cents, interest_rate):
+    """A month of interest at `interest_rate` percent a year, rounded half-even to the cent."""
+    return np.rint(np.maximum(balance_cents, 0) * interest_rate / 1200).astype(np.int64)
+
+
+def service_charge_cents(balance_cents, service_charge):
+    """The monthly charge in dollars as a negative amount, capped at the balance so no account is overdrawn."""
+    return -np.minimum(np.rint(service_charge * 100).astype(np.int64), np.maximum(balance_cents, 0))
+
+
+PostingKind = namedtuple('PostingKind', 'model rate compute')
+POSTING_KINDS = {
+    'interest': PostingKind(SavingsAccount, SavingsAccount.interest_rate, monthly_interest_cents),
+    'service_charge': PostingKind(CheckingAccount, CheckingAccount.service_charge, service_charge_cents),
+}
+
+
+def previous_month(day=None):
+    """'YYYY-MM' of the month before `day` (today by default), the month a nightly run closes."""
+    day = day or date.today()
+    return f'{day.year - (day.month == 1)}-{(day.month - 2) % 12 + 1:02d}'
+
+
+def post_chunk(run_key, kind, transaction_ids):
+    """Post one chunk of run `run_key` and advance its checkpoint; the caller commits.
+
+    The run row is locked first, so two copies of the job take turns instead of posting the
+    same accounts twice. Account rows are then locked in acct_no order, the order transfers
+    lock them in. Returns (accounts looked at, transaction ids used); nothing is looked at once
+    the run is done.
+    """
+    run = db.session.get(PostingRun, run_key, with_for_update=True)
+    if run.status == 'done':
+        return 0, 0
+    model = kind.model
+    rows = db.session.execute(
+        select(model.acct_no, model.balance, kind.rate, Account.customerid)
+        .join(Account, Account.acct_no == model.acct_no)
+        .where(model.acct_no > run.last_acct_no, Account.status == Account.APPROVED)
+        .order_by(model.acct_no)
+        .limit(len(transaction_ids))
+        .with_for_update()).all()
+    if not rows:
+        run.status = 'done'
+        return 0, 0
+
+    account_numbers, balances, rates, customer_ids = zip(*rows)
+    # Interest and charges are on the whole balance, including what hot accounts hold in their slots
+    unfolded = slot_totals(account_numbers)
+    balance_cents = np.array([int((balance + unfolded.get(acct_no, 0)) * 100)
+                              for acct_no, balance in zip(account_numbers, balances)], dtype=np.int64)
+    deltas = kind.compute(balance_cents, np.array(rates, dtype=np.float64))
+    posted = np.flatnonzero(deltas)
+    if len(posted):
+        amounts = {account_numbers[i]: Decimal(int(deltas[i])).scaleb(-2) for i in posted}
+        db.session.execute(update(model)
+                           .where(model.acct_no.in_(list(amounts)))
+                           .values(balance=model.balance + case(amounts, value=model.acct_no))
+                           .execution_options(synchronize_session=False))
+        now = datetime.utcnow()
+        db.session.bulk_insert_mappings(Transaction, [
+            {'t_id': t_id, 'from_account': acct_no, 'to_account': acct_no, 'amount': amount, 'timestamp': now}
+            for t_id, (acct_no, amount) in zip(transaction_ids, amounts.items())
+        ])
+        # Today's closing balances, replaced set-based rather than row by row through the ORM
+        today = now.date()
+        db.session.execute(delete(BalanceSnapshot)
+                           .where(BalanceSnapshot.acct_no.in_(list(amounts)), BalanceSnapshot.snapshot_date == today)
+                           .execution_options(synchronize_session=False))
+        db.session.bulk_insert_mappings(BalanceSnapshot, [
+            {'acct_no': account_numbers[i], 'snapshot_date': today,
+             'balance': Decimal(int(balance_cents[i] + deltas[i])).scaleb(-2)}
+            for i in posted
+        ])
+        invalidate_after_commit(*{customer_ids[i] for i in posted})
+        run.accounts_posted += len(posted)
+        run.total += Decimal(int(deltas[posted].sum())).scaleb(-2)
+    run.last_acct_no = account_numbers[-1]
+    return len(rows), len(posted)
+
+
+def start_run(run_key):
+    if db.session.get(PostingRun, run_key) is None:
+        db.session.execute(insert(PostingRun).values(run_key=run_key))
+
+
+def run_posting(kind_name, month, chunk_size=POSTING_CHUNK_SIZE, duty_cycle=POSTING_DUTY_CYCLE):
+    """Post one kind of charge for `month` ('YYYY-MM') to every approved account, resuming a previous run.
+
+    After each chunk the job sleeps in proportion to how long the chunk held its locks, so it
+    holds them at most `duty_cycle` of the time and live transfers get to run in between.
+    Returns the PostingRun row.
+    """
+    kind = POSTING_KINDS[kind_name]
+    run_key = f'{kind_name}:{month}'
+    try:
+        run_transaction(start_run, run_key)
+    except IntegrityError:
+        pass  # A concurrent run of the same posting created the row first; chunks lock it, so both just resume it
+    transaction_ids = []
+    while True:
+        # IDs are allocated before any row is locked, so refilling an allocator block never waits on our own locks;
+        # ones a chunk did not need are kept for the next
+        transaction_ids += [generate_unique_transaction_id() for _ in range(chunk_size - len(transaction_ids))]
+        started = time.perf_counter()
+        looked_at, used = run_transaction(post_chunk, run_key, kind, transaction_ids)
+        del transaction_ids[:used]
+        if not looked_at:
+            break
+        time.sleep((time.perf_counter() - started) * (1 - duty_cycle) / duty_cycle)
+    return db.session.get(PostingRun, run_key)
@@ -0,0 +1,127 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from flask import current_app
+from app import db
+from app.models import FundingIntent, Transaction
+from app.utils.cache import invalidate_after_commit
+from app.utils.helpers import generate_unique_transaction_id, record_balance_snapshot
+from app.utils.payments import get_payment_gateway
+from app.utils.hot_accounts import is_hot
+from app.utils.transfers import lock_accounts, credit_hot, run_transaction
+
+# A 'processing' intent older than this is assumed to belong to a worker that died
+STALE_PROCESSING_AFTER = timedelta(minutes=10)
+
+
+def claim_funding_intent(intent_id, stale_before=None):
+    """Atomically move an intent to 'processing' so only one worker settles it."""
+    claimable = FundingIntent.status == 'pending'
+    if stale_before is not None:
+        claimable = claimable | ((FundingIntent.status == 'processing') & (FundingIntent.updated_at < stale_before))
+    claimed = (FundingIntent.query
+               .filter(FundingIntent.intent_id == intent_id, claimable)
+               .update({'status': 'processing', 'updated_at': datetime.utcnow()}, synchronize_session=False))
+    db.session.commit()
+    return claimed == 1
+
+
+def credit_funding_intent(intent_id, gateway_reference):
+    """Credit the checking account, write the ledger row and close the intent, all in the caller's transaction.
+
+    The intent row is locked first: a worker whose claim went stale may still be crediting while
+    the sweep settles the same intent, and whichever commits second finds it no longer processing.
+    """
+    t_id = generate_unique_transaction_id()
+    intent = db.session.get(FundingIntent, intent_id, with_for_update=True, populate_existing=True)
+    if intent.status != 'processing':
+        return
+    if is_hot(intent.acct_no):
+        account = credit_hot(intent.acct_no, intent.amount)
+    else:
+        _, account, _ = lock_accounts([intent.acct_no])[intent.acct_no]
+        account.balance += intent.amount
+    if account is not None:
+        record_balance_snapshot(account.acct_no, account.balance)
+    # Record the transaction as both from and to the same account
+    db.session.add(Transaction(t_id=t_id, from_account=intent.acct_no, to_account=intent.acct_no, amount=intent.amount))
+    intent.status = 'succeeded'
+    intent.gateway_reference = gateway_reference
+    intent.t_id = t_id
+    invalidate_after_commit(intent.customer_id)
+
+
+def finish_funding_intent(intent_id, values):
+    """Move a 'processing' intent to `values`; does nothing once another settler has finished it."""
+    (FundingIntent.query
+     .filter(FundingIntent.intent_id == intent_id, FundingIntent.status == 'processing')
+     .update({**values, 'updated_at': datetime.utcnow()}, synchronize_session=False))
+
+
+def settle_funding_intent(intent_id, stale_before=None):
+    """Confirm one funding intent with the payment gateway and settle it. Returns the final status."""
+    if not claim_funding_intent(intent_id, stale_before):
+        return None
+    intent = db.session.get(FundingIntent, intent_id)
+    amount_in_cents, payment_method_id = int(intent.amount * 100), intent.payment_method_id
+    db.session.rollback()  # Do not hold a transaction open across the payment call
+    try:
+        # The intent id doubles as idempotency key, so re-confirming after a crash never charges twice
+        result = get_payment_gateway().confirm_payment(amount_in_cents, payment_method_id, intent_id)
+    except Exception as e:
+        # Transient processor trouble: hand the intent back for the next sweep, unless the call ran so
+        # long that the sweep took the intent over and settled it meanwhile
+        run_transaction(finish_funding_intent, intent_id, {'status': 'pending', 'error': str(e)[:255]})
+        return intent.status
+
+    if result.status == 'succeeded':
+        run_transaction(credit_funding_intent, intent_id, result.reference)
+    else:
+        run_transaction(finish_funding_intent, intent_id, {'status': 'failed', 'gateway_reference': result.reference,
+                                                           'error': (result.error or 'Payment failed')[:255]})
+    return intent.status
+
+
+def settle_pending_intents(limit=None):
+    """Settle waiting and abandoned intents in creation order; used by the sweep command."""
+    stale_before = datetime.utcnow() - STALE_PROCESSING_AFTER
+    query = (db.session.query(FundingIntent.intent_id)
+             .filter((FundingIntent.status == 'pending') |
+                     ((FundingIntent.status == 'processing') & (FundingIntent.updated_at < stale_before)))
+             .order_by(FundingIntent.created_at))
+    if limit:
+        query = query.limit(limit)
+    intent_ids = [intent_id for (intent_id,) in query]
+    return {intent_id: settle_funding_intent(intent_id, stale_before) for intent_id in intent_ids}
+
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+def _get_executor():
+    global _executor, _executor_pid
+    with _executor_lock:
+        # Executor threads do not survive a fork, so each worker process builds its own pool
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(max_workers=current_app.config['SETTLEMENT_WORKERS'],
+                                           thread_name_prefix='settlement')
+            _executor_pid = os.getpid()
+        return _executor
+
+
+def _settle_in_background(app, intent_id):
+    with app.app_context():
+        try:
+            settle_funding_intent(intent_id)
+        except Exception:
+            app.logger.exception('Settlement of funding intent %s failed', intent_id)
+
+
+def submit_settlement(intent_id):
+    """Queue a committed intent for settlement; with SETTLEMENT_WORKERS = 0 it is settled inline instead."""
+    if current_app.config['SETTLEMENT_WORKERS'] == 0:
+        return settle_funding_intent(intent_id)
+    _get_executor().submit(_settle_in_background, current_app._get_current_object(), intent_id)
+    return 'pending'
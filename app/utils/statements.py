@@ -0,0 +1,224 @@
+"""Account statements: every transaction of an account in a date range, with the running balance.
+
+Everything here is a generator. Rows come off a streaming cursor and leave as encoded chunks,
+so memory use depends on the chunk sizes and not on the length of the history. Parquet
+output is optional and needs pyarrow installed.
+"""
+import csv
+import io
+from datetime import datetime, timedelta
+from sqlalchemy import select, union_all, func
+from app import db
+from app.models import Account, CheckingAccount, SavingsAccount, Transaction
+from app.utils.hot_accounts import slot_totals
+
+STATEMENT_COLUMNS = ['account_number', 'transaction_id', 'timestamp', 'direction', 'counterparty', 'amount', 'balance']
+# Accounts whose balances are looked up together, and rows fetched per round trip from the cursor
+STATEMENT_ACCOUNT_BATCH = 500
+STATEMENT_FETCH_ROWS = 2000
+# Rows per CSV chunk or Parquet row group handed to the response
+STATEMENT_CHUNK_ROWS = 5000
+
+
+def parse_statement_range(start, end):
+    """Turn optional 'YYYY-MM-DD' bounds into datetimes; `end` is inclusive. Raises ValueError."""
+    start = datetime.strptime(start, '%Y-%m-%d') if start else None
+    end = datetime.strptime(end, '%Y-%m-%d') + timedelta(days=1) if end else None
+    if start and end and start >= end:
+        raise ValueError('start must not be after end')
+    return start, end
+
+
+def _deposit_balance():
+    return func.coalesce(CheckingAccount.balance, SavingsAccount.balance)
+
+
+def _deposit_accounts():
+    return (select(Account.acct_no, _deposit_balance())
+            .outerjoin(CheckingAccount, CheckingAccount.acct_no == Account.acct_no)
+            .outerjoin(SavingsAccount, SavingsAccount.acct_no == Account.acct_no)
+            .where(_deposit_balance().is_not(None)))
+
+
+def deposit_account_numbers(customer_id=None, account_numbers=None):
+    """Checking and savings accounts to report on, in account order, read in keyset batches.
+
+    Without a customer or account list this walks every deposit account in the bank.
+    """
+    last = None
+    while True:
+        query = _deposit_accounts().with_only_columns(Account.acct_no).order_by(Account.acct_no)
+        if customer_id is not None:
+            query = query.where(Account.customerid == customer_id)
+        if account_numbers is not None:
+            query = query.where(Account.acct_no.in_(account_numbers))
+        if last is not None:
+            query = query.where(Account.acct_no > last)
+        batch = db.session.execute(query.limit(STATEMENT_ACCOUNT_BATCH)).scalars().all()
+        if not batch:
+            return
+        yield from batch
+        last = batch[-1]
+
+
+def opening_balances(account_numbers, start):
+    """Balance of each account just before `start`, worked back from its current balance.
+
+    Incoming transfers, and deposits recorded as an account paying itself, are credits;
+    everything else leaving the account is a debit. Service charges are self-postings with a
+    negative amount, so they are counted with the deposits. Three grouped queries per batch,
+    each served by an (account, timestamp) index.
+    """
+    balances = dict(db.session.execute(_deposit_accounts().where(Account.acct_no.in_(account_numbers))).all())
+    for acct_no, unfolded in slot_totals(account_numbers).items():
+        balances[acct_no] += unfolded
+    credits = (select(Transaction.to_account, func.sum(Transaction.amount))
+               .where(Transaction.to_account.in_(account_numbers))
+               .group_by(Transaction.to_account))
+    debits = (select(Transaction.from_account, func.sum(Transaction.amount))
+              .where(Transaction.from_account.in_(account_numbers), Transaction.to_account != Transaction.from_account)
+              .group_by(Transaction.from_account))
+    if start is not None:
+        credits = credits.where(Transaction.timestamp >= start)
+        debits = debits.where(Transaction.timestamp >= start)
+    for acct_no, total in db.session.execute(credits):
+        balances[acct_no] -= total
+    for acct_no, total in db.session.execute(debits):
+        balances[acct_no] += total
+    return balances
+
+
+def account_history(acct_no, start, end):
+    """Transactions of one account between `start` and `end`, oldest first, from a streaming cursor."""
+    columns = (Transaction.t_id, Transaction.from_account, Transaction.to_account, Transaction.amount,
+               Transaction.timestamp)
+    sides = [
+        select(*columns).where(Transaction.from_account == acct_no),
+        # Deposits are recorded from the account to itself and are already on the outgoing side
+        select(*columns).where(Transaction.to_account == acct_no, Transaction.from_account != acct_no),
+    ]
+    if start is not None:
+        sides = [side.where(Transaction.timestamp >= start) for side in sides]
+    if end is not None:
+        sides = [side.where(Transaction.timestamp < end) for side in sides]
+    history = union_all(*sides).subquery()
+    query = select(history).order_by(history.c.timestamp, history.c.t_id)
+    return db.session.execute(query.execution_options(stream_results=True, yield_per=STATEMENT_FETCH_ROWS))
+
+
+def statement_rows(account_numbers, start=None, end=None):
+    """(account_number, transaction_id, timestamp, direction, counterparty, amount, balance) per transaction.
+
+    Accounts are handled one at a time, and each one's cursor is drained before the next
+    account's balances are read, so drivers with unbuffered cursors never see two open
+    result sets on one connection.
+    """
+    batch = []
+    for acct_no in account_numbers:
+        batch.append(acct_no)
+        if len(batch) == STATEMENT_ACCOUNT_BATCH:
+            yield from _batch_rows(batch, start, end)
+            batch = []
+    if batch:
+        yield from _batch_rows(batch, start, end)
+
+
+def _batch_rows(batch, start, end):
+    balances = opening_balances(batch, start)
+    for acct_no in batch:
+        balance = balances[acct_no]
+        for t_id, from_account, to_account, amount, timestamp in account_history(acct_no, start, end):
+            if to_account == acct_no:
+                balance += amount
+                if amount < 0:
+                    # A service charge, posted as a negative amount from the account to itself
+                    yield acct_no, t_id, timestamp, 'debit', to_account, -amount, balance
+                else:
+                    yield acct_no, t_id, timestamp, 'credit', from_account, amount, balance
+            else:
+                balance -= amount
+                yield acct_no, t_id, timestamp, 'debit', to_account, amount, balance
+
+
+def csv_chunks(rows, chunk_rows=STATEMENT_CHUNK_ROWS):
+    """Encode statement rows as CSV with a header, yielding bytes every `chunk_rows` rows."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(STATEMENT_COLUMNS)
+    pending = 0
+    for acct_no, t_id, timestamp, direction, counterparty, amount, balance in rows:
+        writer.writerow((acct_no, t_id, timestamp.isoformat(' ', 'seconds'), direction, counterparty, amount, balance))
+        pending += 1
+        if pending == chunk_rows:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+    yield buffer.getvalue().encode('utf-8')
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file that keeps what was written until it is taken, so Parquet output can be streamed."""
+
+    def __init__(self):
+        super().__init__()
+        self.parts = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def take(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        return data
+
+
+def parquet_available():
+    try:
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def parquet_chunks(rows, chunk_rows=STATEMENT_CHUNK_ROWS):
+    """Encode statement rows as Parquet, one row group per `chunk_rows` rows, yielding bytes as each is written.
+
+    Needs pyarrow, which is only imported here since nothing else uses it.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    money = pa.decimal128(15, 2)
+    schema = pa.schema([('account_number', pa.int64()), ('transaction_id', pa.string()),
+                        ('timestamp', pa.timestamp('s')), ('direction', pa.string()),
+                        ('counterparty', pa.int64()), ('amount', money), ('balance', money)])
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(pa.PythonFile(sink, mode='w'), schema)
+    columns = [[] for _ in STATEMENT_COLUMNS]
+    for row in rows:
+        for column, value in zip(columns, row):
+            column.append(value)
+        if len(columns[0]) == chunk_rows:
+            writer.write_table(pa.Table.from_pydict(dict(zip(STATEMENT_COLUMNS, columns)), schema=schema))
+            columns = [[] for _ in STATEMENT_COLUMNS]
+            yield sink.take()
+    if columns[0]:
+        writer.write_table(pa.Table.from_pydict(dict(zip(STATEMENT_COLUMNS, columns)), schema=schema))
+    writer.close()  # Writes the footer
+    yield sink.take()
+
+
+STATEMENT_FORMATS = {
+    'csv': (csv_chunks, 'text/csv'),
+    'parquet': (parquet_chunks, 'application/vnd.apache.parquet'),
+}
@@ -0,0 +1,18 @@
+from flask import current_app
+from itsdangerous import URLSafeTimedSerializer, BadSignature
+
+
+def _serializer():
+    return URLSafeTimedSerializer(current_app.secret_key, salt='auth-token')
+
+def issue_token(customer_id, is_admin):
+    """Sign a compact token carrying the customer id and admin flag; the signing time gives its expiry."""
+    return _serializer().dumps([customer_id, int(bool(is_admin))])
+
+def verify_token(token):
+    """Return (customer_id, is_admin) from a token, raising BadSignature if it is forged, malformed or expired."""
+    payload = _serializer().loads(token, max_age=current_app.config['AUTH_TOKEN_MAX_AGE'])
+    if not isinstance(payload, list) or len(payload) != 2:
+        raise BadSignature('Malformed token')
+    customer_id, is_admin = payload
+    return customer_id, bool(is_admin)
@@ -0,0 +1,321 @@
+import random
+import time
+from datetime import datetime
+from decimal import Decimal
+from sqlalchemy import func
+from sqlalchemy.exc import OperationalError
+from app import db
+from app.database import write_transaction
+from app.utils.cache import invalidate_after_commit
+from app.models import Account, CheckingAccount, SavingsAccount, Loan, Transaction
+from app.utils.helpers import generate_unique_transaction_id, record_balance_snapshots
+from app.utils.hot_accounts import is_hot, credit_slot, fold_slots, set_slot_count
+
+
+# MySQL error codes worth retrying the whole transaction for
+DEADLOCK = 1213
+LOCK_WAIT_TIMEOUT = 1205
+MAX_ATTEMPTS = 5
+BACKOFF_BASE_SECONDS = 0.02
+
+
+class TransferError(Exception):
+    """A transfer was refused; carries the message and HTTP status to report."""
+
+    def __init__(self, message, status_code):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+def parse_id(value, name):
+    """A customer or account number from a request as an int; raises TransferError for anything else."""
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.strip().isdigit():
+        return int(value)
+    raise TransferError(f'Invalid {name}', 400)
+
+
+def parse_amount(value):
+    """A positive amount in whole cents as a Decimal; raises TransferError for anything else."""
+    try:
+        amount = Decimal(str(value))
+        if amount.is_finite() and amount > 0 and amount == amount.quantize(Decimal('0.01')):
+            return amount
+    except (TypeError, ValueError, ArithmeticError):
+        pass
+    raise TransferError('Invalid amount', 400)
+
+
+def parse_account_type(value, message='Invalid account type specified'):
+    """'Checking' or 'Savings' from a request's 'checking' or 'savings', in any case."""
+    if not isinstance(value, str) or value.lower() not in ('checking', 'savings'):
+        raise TransferError(message, 400)
+    return value.capitalize()
+
+
+def is_retryable(error):
+    code = error.orig.args[0] if error.orig is not None and error.orig.args else None
+    # SQLite, used for local runs, reports lock conflicts as 'database is locked'
+    return code in (DEADLOCK, LOCK_WAIT_TIMEOUT) or 'database is locked' in str(error.orig)
+
+
+def run_transaction(work, *args):
+    """Run `work(*args)` and commit, retrying the whole transaction on deadlock or lock timeout.
+
+    Retries back off exponentially with full jitter so colliding requests spread out
+    instead of meeting again. Any other error rolls back and is re-raised.
+    """
+    for attempt in range(MAX_ATTEMPTS):
+        try:
+            with write_transaction():
+                result = work(*args)
+                db.session.commit()
+            return result
+        except OperationalError as e:
+            db.session.rollback()
+            if attempt == MAX_ATTEMPTS - 1 or not is_retryable(e):
+                raise
+            time.sleep(random.uniform(0, BACKOFF_BASE_SECONDS * 2 ** attempt))
+        except Exception:
+            db.session.rollback()
+            raise
+
+
+def lock_accounts(account_numbers):
+    """Lock the given accounts and their checking/savings/loan rows with a single SELECT ... FOR UPDATE.
+
+    Rows are locked in ascending acct_no order, so any two callers that lock overlapping
+    sets of accounts always take the locks in the same order and cannot deadlock.
+    Returns {acct_no: (Account, CheckingAccount or SavingsAccount or None, Loan or None)}.
+    """
+    return load_accounts(account_numbers, lock=True)
+
+
+def load_accounts(account_numbers, lock=False):
+    """lock_accounts without the locks unless `lock`; used for hot accounts that are only credited.
+
+    Rows already in the session are refreshed, so a locked read never returns balances that
+    an earlier unlocked read left behind.
+    """
+    query = (db.session.query(Account, CheckingAccount, SavingsAccount, Loan)
+             .outerjoin(CheckingAccount, CheckingAccount.acct_no == Account.acct_no)
+             .outerjoin(SavingsAccount, SavingsAccount.acct_no == Account.acct_no)
+             .outerjoin(Loan, Loan.acct_no == Account.acct_no)
+             .filter(Account.acct_no.in_(sorted(set(account_numbers))))
+             .order_by(Account.acct_no)
+             .populate_existing())
+    rows = query.with_for_update().all() if lock else query.all()
+    return {account.acct_no: (account, checking or savings, loan) for account, checking, savings, loan in rows}
+
+
+def lock_for_transfer(debited, credited):
+    """Lock the accounts a transfer touches, except hot accounts that are only credited.
+
+    Those are loaded without locks, since their credits go to a balance slot. Accounts that
+    are debited have their slots folded in, so their balance row holds their whole balance.
+    Returns (lock_accounts-style map, set of hot accounts to credit through credit_hot()).
+    """
+    debited = {acct_no for acct_no in debited if acct_no}
+    hot = {acct_no for acct_no in credited if acct_no and acct_no not in debited and is_hot(acct_no)}
+    locked = lock_accounts(debited | ({acct_no for acct_no in credited if acct_no} - hot))
+    if hot:
+        locked.update(load_accounts(hot))
+    for acct_no in debited:
+        _, balance_row, _ = locked.get(acct_no, (None, None, None))
+        if balance_row is not None and is_hot(acct_no):
+            fold_slots(acct_no, balance_row)
+    return locked, hot
+
+
+def credit_hot(acct_no, amount):
+    """Credit a hot account through one of its slots. Returns the balance row if the account had
+    stopped being hot and the credit went to the (now locked) balance row instead, else None.
+    """
+    if credit_slot(acct_no, amount):
+        return None
+    _, balance_row, _ = lock_accounts([acct_no])[acct_no]
+    balance_row.balance += amount
+    return balance_row
+
+
+def fold_hot_account(acct_no):
+    """Move a hot account's slots into its balance row and record today's snapshot; the caller commits.
+
+    Returns the amount folded.
+    """
+    account, balance_row, _ = lock_accounts([acct_no]).get(acct_no, (None, None, None))
+    if balance_row is None:
+        return Decimal('0.00')
+    folded = fold_slots(acct_no, balance_row)
+    if folded:
+        record_balance_snapshots({acct_no: balance_row.balance})
+        invalidate_after_commit(account.customerid)
+    return folded
+
+
+def make_account_hot(acct_no, slots):
+    """Give a checking or savings account `slots` balance slots; 0 folds them back and ends hot mode."""
+    account, balance_row, _ = lock_accounts([acct_no]).get(acct_no, (None, None, None))
+    if balance_row is None:
+        raise TransferError('Only checking and savings accounts can be hot', 400)
+    set_slot_count(acct_no, slots, balance_row)
+    record_balance_snapshots({acct_no: balance_row.balance})
+    invalidate_after_commit(account.customerid)
+
+
+def source_account_numbers(customer_ids):
+    """Map (customer_id, 'Checking'/'Savings') to the customer's account of that type."""
+    rows = (db.session.query(Account.customerid, Account.acct_type, func.min(Account.acct_no))
+            .filter(Account.customerid.in_(set(customer_ids)), Account.acct_type.in_(['Checking', 'Savings']))
+            .group_by(Account.customerid, Account.acct_type)
+            .all())
+    return {(customer_id, acct_type): acct_no for customer_id, acct_type, acct_no in rows}
+
+
+def apply_transfer_batch(transfers):
+    """Apply many transfers under one set of row locks and leave them ready for a single commit.
+
+    `transfers` is a list of (from_customer_id, account_type, to_acct_no, amount) tuples that
+    have already been validated. Transfers are applied in order against running balances, so a
+    later item sees the effect of earlier ones. Returns one error message (or None) per item.
+    """
+    # IDs are allocated before any row is locked, so refilling an allocator block never waits on our own locks
+    transaction_ids = [generate_unique_transaction_id() for _ in transfers]
+    sources = source_account_numbers(customer_id for customer_id, _, _, _ in transfers)
+    from_numbers = [sources.get((customer_id, account_type)) for customer_id, account_type, _, _ in transfers]
+    locked, hot = lock_for_transfer(from_numbers, [to_acct_no for _, _, to_acct_no, _ in transfers])
+    hot_credits = {}
+
+    errors = []
+    transaction_rows = []
+    touched = {}
+    now = datetime.utcnow()
+    for t_id, from_acct_no, (_, _, to_acct_no, amount) in zip(transaction_ids, from_numbers, transfers):
+        from_account, from_balance, _ = locked.get(from_acct_no, (None, None, None))
+        to_account, to_balance, _ = locked.get(to_acct_no, (None, None, None))
+        if not from_balance or not to_balance:
+            errors.append('One or more accounts not found')
+            continue
+        if from_account.status == Account.PENDING or to_account.status == Account.PENDING:
+            errors.append('One or more accounts not approved')
+            continue
+        if from_balance.balance < amount:
+            errors.append('Insufficient funds')
+            continue
+
+        from_balance.balance -= amount
+        touched[from_acct_no] = from_balance
+        if to_acct_no in hot:
+            hot_credits[to_acct_no] = hot_credits.get(to_acct_no, 0) + amount
+        else:
+            to_balance.balance += amount
+            touched[to_acct_no] = to_balance
+        invalidate_after_commit(from_account.customerid, to_account.customerid)
+        transaction_rows.append({
+            't_id': t_id,
+            'from_account': from_acct_no,
+            'to_account': to_acct_no,
+            'amount': amount,
+            'timestamp': now
+        })
+        errors.append(None)
+
+    # One slot credit per hot account for the whole batch
+    for acct_no, amount in hot_credits.items():
+        balance_row = credit_hot(acct_no, amount)
+        if balance_row is not None:
+            touched[acct_no] = balance_row
+    if touched:
+        record_balance_snapshots({acct_no: balance_row.balance for acct_no, balance_row in touched.items()})
+    if transaction_rows:
+        db.session.bulk_insert_mappings(Transaction, transaction_rows)
+    return errors
+
+
+def transfer_funds(from_customer_id, account_type, to_acct_no, amount):
+    """Move `amount` from the customer's checking or savings account to `to_acct_no`.
+
+    Both accounts are locked in one canonical-order query, except a hot destination, which is
+    credited through a balance slot. The arguments may come straight from a request: they are
+    validated here. Raises TransferError if the transfer is refused; the caller commits
+    (normally through run_transaction).
+    """
+    from_customer_id = parse_id(from_customer_id, 'customer')
+    to_acct_no = parse_id(to_acct_no, 'destination account')
+    amount = parse_amount(amount)
+    account_type = parse_account_type(account_type)
+    t_id = generate_unique_transaction_id()
+    from_acct_no = source_account_numbers([from_customer_id]).get((from_customer_id, account_type))
+    locked, hot = lock_for_transfer([from_acct_no], [to_acct_no])
+
+    from_account, from_balance, _ = locked.get(from_acct_no, (None, None, None))
+    to_account, to_balance, _ = locked.get(to_acct_no, (None, None, None))
+    if not from_balance or not to_balance:
+        raise TransferError('One or more accounts not found', 404)
+    if from_account.status == Account.PENDING or to_account.status == Account.PENDING:
+        raise TransferError('One or more accounts not approved', 404)
+    if from_balance.balance < amount:
+        raise TransferError('Insufficient funds', 403)
+
+    from_balance.balance -= amount
+    if to_acct_no in hot:
+        # The hot account's snapshot is brought up to date when its slots are folded
+        to_balance = credit_hot(to_acct_no, amount)
+    else:
+        to_balance.balance += amount
+    balances = {from_acct_no: from_balance.balance}
+    if to_balance is not None:
+        balances[to_acct_no] = to_balance.balance
+    record_balance_snapshots(balances)
+    invalidate_after_commit(from_account.customerid, to_account.customerid)
+    db.session.add(Transaction(
+        t_id=t_id,
+        from_account=from_acct_no,
+        to_account=to_acct_no,
+        amount=amount
+    ))
+
+
+def pay_loan_from_account(customer_id, account_type, loan_acct_no, amount):
+    """Pay `amount` towards a loan from the customer's checking or savings account.
+
+    Locks the payment and loan rows together like transfer_funds and returns the
+    remaining loan balance. Arguments are validated like transfer_funds'. Raises
+    TransferError if the payment is refused.
+    """
+    customer_id = parse_id(customer_id, 'customer')
+    loan_acct_no = parse_id(loan_acct_no, 'loan account')
+    amount = parse_amount(amount)
+    account_type = parse_account_type(account_type)
+    # pba_loan.loan_payment holds whole dollars; MySQL would silently round a fractional payment
+    if amount != amount.to_integral_value():
+        raise TransferError('Loan payments must be in whole dollars', 400)
+    t_id = generate_unique_transaction_id()
+    from_acct_no = source_account_numbers([customer_id]).get((customer_id, account_type))
+    locked, _ = lock_for_transfer([from_acct_no], [loan_acct_no])
+
+    loan_account, _, loan = locked.get(loan_acct_no, (None, None, None))
+    if not loan:
+        raise TransferError('Loan account not found', 404)
+    # Check if the loan is already fully paid
+    if loan.loan_amount <= loan.loan_payment:
+        raise TransferError('Loan already fully paid', 400)
+    from_account, payment_account, _ = locked.get(from_acct_no, (None, None, None))
+    if not payment_account:
+        raise TransferError('Payment account not found', 404)
+    if payment_account.balance < amount:
+        raise TransferError('Insufficient funds', 403)
+
+    payment_account.balance -= amount
+    loan.loan_payment += int(amount)
+    record_balance_snapshots({from_acct_no: payment_account.balance})
+    invalidate_after_commit(from_account.customerid, loan_account.customerid)
+    db.session.add(Transaction(
+        t_id=t_id,
+        from_account=from_acct_no,
+        to_account=loan_acct_no,
+        amount=amount
+    ))
+    return Decimal(loan.loan_amount - loan.loan_payment)
@@ -0,0 +1,97 @@
+"""Time the amortization engine over a synthetic loan book against a loop per payment period.
+
+No database is involved: the loans are generated in memory with the same terms datagen uses,
+so this measures only the computation. The loop is what computing each schedule period by
+period in Python costs; it runs on a sample and is scaled up to the whole book.
+
+    python benchmarks/amortization.py [--loans 1000000] [--batch-size 20000]
+"""
+import argparse
+import calendar
+import os
+import sys
+import time
+from datetime import date
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app.utils.amortization import LoanBook, summarize, schedules, level_payments
+
+
+BOOK_FIELDS = ('acct_no', 'customer_id', 'loan_type', 'principal', 'annual_rate', 'months', 'paid', 'opened')
+
+
+def synthetic_book(loans, seed):
+    rng = np.random.default_rng(seed)
+    opened = np.datetime64('2026-01-01') - rng.integers(0, 365 * 30, loans).astype('timedelta64[D]')
+    principal = rng.integers(1000, 500000, loans)
+    return LoanBook(np.arange(loans), np.arange(loans), rng.choice(['Home', 'Personal', 'Student'], loans),
+                    principal, rng.uniform(2.5, 12.0, loans).round(2), rng.choice([36, 60, 120, 180, 360], loans),
+                    rng.integers(0, principal // 2 + 1), opened)
+
+
+def book_slice(book, start, stop):
+    return LoanBook(*(getattr(book, name)[start:stop] for name in BOOK_FIELDS))
+
+
+def loop_schedules(book):
+    """Every schedule one period at a time, the way it would be written without arrays; returns total interest."""
+    payments = level_payments(book.principal, book.monthly_rate, book.months).tolist()
+    total = 0.0
+    for principal, rate, months, payment, opened in zip(book.principal.tolist(), book.monthly_rate.tolist(),
+                                                        book.months.tolist(), payments, book.opened.tolist()):
+        balance = principal
+        schedule = []
+        for period in range(1, months + 1):
+            year, month = divmod(opened.month - 1 + period, 12)
+            year += opened.year
+            due = date(year, month + 1, min(opened.day, calendar.monthrange(year, month + 1)[1]))
+            interest = balance * rate
+            amount = payment if period < months else balance + interest
+            balance += interest - amount
+            schedule.append((period, due, amount, interest, amount - interest, balance))
+            total += interest
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--loans', type=int, default=1000000)
+    parser.add_argument('--batch-size', type=int, default=20000, help='Loans per schedules() call.')
+    parser.add_argument('--loop-sample', type=int, default=5000, help='Loans timed with the Python loop.')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    book = synthetic_book(args.loans, args.seed)
+    as_of = date(2026, 10, 18)
+
+    started = time.perf_counter()
+    summary = summarize(book, as_of)
+    summary_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    periods = 0
+    interest = 0.0
+    for offset in range(0, args.loans, args.batch_size):
+        computed = schedules(book_slice(book, offset, offset + args.batch_size))
+        periods += len(computed['period'])
+        interest += float(computed['interest'].sum())
+    schedule_seconds = time.perf_counter() - started
+
+    sample = book_slice(book, 0, args.loop_sample)
+    started = time.perf_counter()
+    loop_interest = loop_schedules(sample)
+    loop_seconds = (time.perf_counter() - started) * args.loans / args.loop_sample
+    vector_interest = float(summary['total_interest'][:args.loop_sample].sum())
+
+    print(f'{args.loans} loans, {periods} scheduled payments')
+    print(f'summaries (payment, interest to date, payoff dates): {summary_seconds:.2f}s')
+    print(f'full schedules in batches of {args.batch_size}: {schedule_seconds:.2f}s')
+    print(f'Python loop per period, scaled from {args.loop_sample} loans: {loop_seconds:.1f}s')
+    print(f'total interest on the sample, loop vs closed form: {loop_interest:.2f} vs {vector_interest:.2f}')
+    print(f'total scheduled interest: {interest:.2f} (summaries: {summary["total_interest"].sum():.2f})')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,294 @@
+"""Load-test the hot API endpoints against a seeded local database.
+
+Builds the app with create_app() on a local database (a fresh SQLite file by default, or any
+DATABASE_URL such as a local MySQL), seeds customers with checking, savings and loan
+accounts, then drives each scenario from `--concurrency` threads. Requests go through
+Flask's test client in the worker thread, so timings cover the app and the database but not
+the network or a WSGI server.
+
+For every scenario it reports p50/p95/p99 latency, throughput, error count and SQL
+statements per request, and writes the run to a JSON file. Pass `--compare` with an earlier
+result to flag regressions; the exit status is 1 when any are found.
+
+    python benchmarks/endpoints.py --customers 500 --requests 2000 --concurrency 8
+    python benchmarks/endpoints.py --compare benchmarks/results/baseline.json
+
+Instrumentation overhead is the difference between a run and one with `--no-metrics`.
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+SCENARIOS = ['login', 'get_accounts', 'balances', 'transactions', 'transfer_money', 'pay_loan']
+PASSWORD = 'benchmark-password'
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', help='Database to seed and use (default: a new SQLite file in a temp dir).')
+    parser.add_argument('--customers', type=int, default=200, help='Customers to seed.')
+    parser.add_argument('--transactions-per-customer', type=int, default=20)
+    parser.add_argument('--requests', type=int, default=1000, help='Requests per scenario.')
+    parser.add_argument('--concurrency', type=int, default=4, help='Client threads per scenario.')
+    parser.add_argument('--warmup', type=int, default=50, help='Untimed requests per scenario before measuring.')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='Comma-separated subset of: ' + ', '.join(SCENARIOS))
+    parser.add_argument('--bcrypt-rounds', type=int, default=12, help='Work factor for the seeded passwords and /login.')
+    parser.add_argument('--cache-backend', default='none', help="Response cache backend; 'none' measures the database path.")
+    parser.add_argument('--no-metrics', action='store_true',
+                        help='Run without the /metrics request and SQL hooks, to measure their overhead.')
+    parser.add_argument('--output', help='Result file (default: benchmarks/results/<timestamp>.json).')
+    parser.add_argument('--compare', help='Earlier result file to check this run against.')
+    parser.add_argument('--threshold', type=float, default=0.15, help='Relative slowdown counted as a regression.')
+    parser.add_argument('--seed', type=int, default=1)
+    return parser.parse_args()
+
+
+def build_app(args):
+    """Configure the environment before importing the app, since config classes read it at import time."""
+    database_url = args.database_url or 'sqlite:///' + os.path.join(tempfile.mkdtemp(prefix='safe-bench-'), 'bench.db')
+    os.environ['DATABASE_URL'] = database_url
+    os.environ['REPLICA_DATABASE_URL'] = ''
+    os.environ['BCRYPT_ROUNDS'] = str(args.bcrypt_rounds)
+    os.environ['CACHE_BACKEND'] = args.cache_backend
+    os.environ['METRICS_ENABLED'] = '0' if args.no_metrics else '1'
+    os.environ['PAYMENT_GATEWAY'] = 'fake'
+    os.environ['SETTLEMENT_WORKERS'] = '0'
+    os.environ.setdefault('DB_POOL_SIZE', str(max(5, args.concurrency)))
+    from app import create_app
+    return create_app('local'), database_url
+
+
+def seed(app, args):
+    """Create customers with one checking, savings and loan account each, plus some transfer history."""
+    from app import db
+    from app.models import (Auth, Customer, Account, CheckingAccount, SavingsAccount, Loan, PersonalLoan,
+                            Transaction, BalanceSnapshot)
+    from app.utils.passwords import hash_password
+    from app.utils.helpers import generate_unique_transaction_id
+
+    rng = random.Random(args.seed)
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        password_hash = hash_password(PASSWORD)  # One hash shared by every user keeps seeding fast
+        opened = datetime.utcnow() - timedelta(days=90)
+        customers, auths, accounts, checking, savings, loans, personal, snapshots = [], [], [], [], [], [], [], []
+        for customer_id in range(1, args.customers + 1):
+            customers.append({'customerid': customer_id, 'cfname': 'Bench', 'clname': f'User{customer_id}',
+                              'cstreet': '1 Main St', 'ccity': 'Newark', 'cstate': 'NJ', 'czip': 7102})
+            auths.append({'customer_id': customer_id, 'username': f'bench{customer_id}',
+                          'password_hash': password_hash, 'is_admin': 0})
+            base = 10000000 + customer_id * 3
+            for offset, acct_type in enumerate(('Checking', 'Savings', 'Loan')):
+                accounts.append({'acct_no': base + offset, 'acct_name': f'Bench User{customer_id} {acct_type}',
+                                 'acct_street': '1 Main St', 'acct_city': 'Newark', 'acct_state': 'NJ',
+                                 'acct_zip': 7102, 'acct_type': acct_type, 'date_opened': opened,
+                                 'customerid': customer_id, 'status': 'approved'})
+            checking.append({'acct_no': base, 'service_charge': 1.0, 'balance': Decimal('100000.00')})
+            savings.append({'acct_no': base + 1, 'interest_rate': 0.02, 'balance': Decimal('100000.00')})
+            loans.append({'acct_no': base + 2, 'loan_rate': 5.0, 'loan_amount': 10 ** 9, 'loan_payment': 0,
+                          'loan_months': 60, 'loan_type': 'Personal'})
+            personal.append({'acct_no': base + 2})
+            for acct_no in (base, base + 1):
+                snapshots.append({'acct_no': acct_no, 'snapshot_date': opened.date(), 'balance': Decimal('100000.00')})
+
+        transactions = []
+        for customer_id in range(1, args.customers + 1):
+            for n in range(args.transactions_per_customer):
+                to_customer = rng.randint(1, args.customers)
+                transactions.append({'t_id': generate_unique_transaction_id(),
+                                     'from_account': 10000000 + customer_id * 3,
+                                     'to_account': 10000000 + to_customer * 3,
+                                     'amount': Decimal(rng.randint(100, 10000)) / 100,
+                                     'timestamp': opened + timedelta(minutes=n * 60 + customer_id)})
+
+        for model, rows in ((Customer, customers), (Auth, auths), (Account, accounts), (CheckingAccount, checking),
+                            (SavingsAccount, savings), (Loan, loans), (PersonalLoan, personal),
+                            (BalanceSnapshot, snapshots), (Transaction, transactions)):
+            db.session.bulk_insert_mappings(model, rows)
+        db.session.commit()
+
+
+class StatementCounter:
+    """Counts SQL statements per thread, so each request can be charged with its own statements."""
+
+    def __init__(self, engines):
+        from sqlalchemy import event
+        self.local = threading.local()
+        for engine in engines:
+            event.listen(engine, 'before_cursor_execute', self.count)
+
+    def count(self, *args):
+        self.local.count = getattr(self.local, 'count', 0) + 1
+
+    def current(self):
+        return getattr(self.local, 'count', 0)
+
+
+def scenario_request(name, customer_id, args):
+    """(method, url, json body) for one request of a scenario made by `customer_id`."""
+    checking = 10000000 + customer_id * 3
+    if name == 'login':
+        return 'POST', '/login', {'username': f'bench{customer_id}', 'password': PASSWORD}
+    if name == 'get_accounts':
+        return 'GET', f'/get_accounts?customer_id={customer_id}', None
+    if name == 'balances':
+        return 'GET', f'/balances/{customer_id}', None
+    if name == 'transactions':
+        return 'GET', f'/transactions/{customer_id}?limit=50', None
+    if name == 'transfer_money':
+        to_customer = random.randint(1, args.customers)
+        return 'POST', '/transfer_money', {'from_customer_id': customer_id, 'to_acct_no': 10000000 + to_customer * 3,
+                                           'type': 'checking', 'amount': '1.00'}
+    if name == 'pay_loan':
+        return 'POST', '/pay_loan', {'loanAccountNumber': checking + 2, 'paymentAccountType': 'savings',
+                                     'paymentAmount': '1', 'customerId': customer_id}
+    raise ValueError(f'Unknown scenario: {name}')
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def run_scenario(app, name, args, counter):
+    from app.utils.tokens import issue_token
+
+    with app.app_context():
+        tokens = {customer_id: issue_token(customer_id, False) for customer_id in range(1, args.customers + 1)}
+
+    def worker(requests):
+        client = app.test_client()
+        samples = []
+        for customer_id in requests:
+            method, url, body = scenario_request(name, customer_id, args)
+            headers = {} if name == 'login' else {'Authorization': f'Bearer {tokens[customer_id]}'}
+            before = counter.current()
+            started = time.perf_counter()
+            response = client.open(url, method=method, json=body, headers=headers)
+            elapsed = time.perf_counter() - started
+            samples.append((elapsed, counter.current() - before, response.status_code))
+        return samples
+
+    rng = random.Random(args.seed)
+    worker([rng.randint(1, args.customers) for _ in range(args.warmup)])  # Fill pools and caches first
+    customers = [rng.randint(1, args.customers) for _ in range(args.requests)]
+    shares = [customers[i::args.concurrency] for i in range(args.concurrency)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        samples = [sample for part in pool.map(worker, shares) for sample in part]
+    wall = time.perf_counter() - started
+
+    latencies = sorted(elapsed * 1000 for elapsed, _, _ in samples)
+    statuses = {}
+    for _, _, status in samples:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    return {
+        'requests': len(samples),
+        'errors': sum(1 for _, _, status in samples if status >= 400),
+        'statuses': statuses,
+        'throughput_rps': round(len(samples) / wall, 2),
+        'latency_ms': {
+            'mean': round(statistics.fmean(latencies), 3),
+            'p50': round(percentile(latencies, 0.50), 3),
+            'p95': round(percentile(latencies, 0.95), 3),
+            'p99': round(percentile(latencies, 0.99), 3),
+            'max': round(latencies[-1], 3),
+        },
+        'sql_per_request': round(statistics.fmean(statements for _, statements, _ in samples), 2),
+    }
+
+
+def find_regressions(current, baseline, threshold):
+    """Compare two result documents scenario by scenario; returns human-readable findings."""
+    findings = []
+    for name, result in current['scenarios'].items():
+        before = baseline.get('scenarios', {}).get(name)
+        if not before:
+            continue
+        # p99 of a short run is too noisy to gate on; it is still recorded for reading
+        for percentile_name in ('p50', 'p95'):
+            old, new = before['latency_ms'][percentile_name], result['latency_ms'][percentile_name]
+            if old and new > old * (1 + threshold):
+                findings.append(f'{name}: {percentile_name} {old:.2f} ms -> {new:.2f} ms')
+        if result['throughput_rps'] < before['throughput_rps'] * (1 - threshold):
+            findings.append(f"{name}: throughput {before['throughput_rps']:.1f} -> {result['throughput_rps']:.1f} req/s")
+        if result['sql_per_request'] > before['sql_per_request']:
+            findings.append(f"{name}: SQL per request {before['sql_per_request']} -> {result['sql_per_request']}")
+        if result['errors'] > before['errors']:
+            findings.append(f"{name}: errors {before['errors']} -> {result['errors']}")
+    return findings
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    args = parse_args()
+    scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        sys.exit(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+    app, database_url = build_app(args)
+    seed(app, args)
+    from app import db
+    with app.app_context():
+        counter = StatementCounter(db.engines.values())
+
+    results = {}
+    print(f'{"scenario":<16}{"req/s":>9}{"p50 ms":>9}{"p95 ms":>9}{"p99 ms":>9}{"sql/req":>9}{"errors":>8}')
+    for name in scenarios:
+        result = results[name] = run_scenario(app, name, args, counter)
+        latency = result['latency_ms']
+        print(f"{name:<16}{result['throughput_rps']:>9.1f}{latency['p50']:>9.2f}{latency['p95']:>9.2f}"
+              f"{latency['p99']:>9.2f}{result['sql_per_request']:>9.2f}{result['errors']:>8}")
+
+    document = {
+        'created_at': datetime.utcnow().isoformat(timespec='seconds') + 'Z',
+        'git_revision': git_revision(),
+        'database': database_url.split('://')[0],
+        'parameters': {name: getattr(args, name) for name in ('customers', 'transactions_per_customer', 'requests',
+                                                              'concurrency', 'warmup', 'bcrypt_rounds', 'cache_backend',
+                                                              'no_metrics', 'seed')},
+        'scenarios': results,
+    }
+    output = args.output or os.path.join(ROOT, 'benchmarks', 'results',
+                                         datetime.utcnow().strftime('%Y%m%dT%H%M%SZ') + '.json')
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(document, f, indent=2)
+    print(f'Wrote {output}')
+
+    if args.compare:
+        with open(args.compare) as f:
+            findings = find_regressions(document, json.load(f), args.threshold)
+        for finding in findings:
+            print(f'REGRESSION {finding}')
+        if findings:
+            sys.exit(1)
+        print('No regressions against', args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""IDs per second from the snowflake and block allocators under concurrent generation.
+
+Each of `--processes` allocators stands in for one worker process and is shared by its share
+of `--threads` threads, the way a threaded gunicorn worker shares its allocator. Every thread
+draws `--ids` IDs; the run fails if any ID repeats. The block allocator is run with
+`--block-size`, and the reservations it made against pba_id_sequence are reported with it.
+
+    python benchmarks/id_allocation.py --threads 16 --ids 20000
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from endpoints import build_app
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', help='Database to use (default: a new SQLite file in a temp dir).')
+    parser.add_argument('--processes', type=int, default=4, help='Allocators, one per simulated worker process.')
+    parser.add_argument('--threads', type=int, default=8, help='Threads drawing IDs, spread over the allocators.')
+    parser.add_argument('--ids', type=int, default=10000, help='IDs drawn by each thread.')
+    parser.add_argument('--block-size', type=int, default=1000, help='Block size of the block allocator.')
+    return parser.parse_args()
+
+
+def run(app, allocators, args):
+    """Draw the IDs; returns (IDs per second, whether they were all unique)."""
+    def work(allocator):
+        with app.app_context():
+            return [allocator.next_id() for _ in range(args.ids)]
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        batches = list(pool.map(work, [allocators[i % len(allocators)] for i in range(args.threads)]))
+    seconds = time.perf_counter() - started
+    ids = [value for batch in batches for value in batch]
+    return len(ids) / seconds, len(set(ids)) == len(ids)
+
+
+def main():
+    args = parse_args()
+    options = SimpleNamespace(database_url=args.database_url, bcrypt_rounds=4, cache_backend='none',
+                              no_metrics=True, concurrency=args.threads)
+    app, database_url = build_app(options)
+    from app import db
+    from app.models import IdSequence
+    from app.utils.ids import BlockAllocator, SnowflakeAllocator
+    with app.app_context():
+        db.create_all()
+        allocators = {
+            'snowflake': [SnowflakeAllocator() for _ in range(args.processes)],
+            'block': [BlockAllocator('benchmark', block_size=args.block_size) for _ in range(args.processes)],
+        }
+
+    print(f'database: {database_url}, {args.processes} allocators, {args.threads} threads, {args.ids} IDs each')
+    print(f'{"allocator":>10} {"IDs/s":>12} {"reservations":>13}')
+    for name, instances in allocators.items():
+        per_second, unique = run(app, instances, args)
+        if not unique:
+            sys.exit(f'{name}: IDs collided')
+        reservations = '-'
+        if name == 'block':
+            with app.app_context():
+                reservations = (db.session.get(IdSequence, 'benchmark').next_value - 1) // args.block_size
+        print(f'{name:>10} {per_second:>12.0f} {reservations:>13}')
+
+
+if __name__ == '__main__':
+    main()
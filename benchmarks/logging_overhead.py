@@ -0,0 +1,121 @@
+"""Compare request throughput with structured logging at INFO against the old print() calls.
+
+Each mode runs in its own process with stdout sent to a file, the way a container runtime
+captures it:
+
+- prints: no logging, plus the print() calls the hot endpoints used to make (the request
+  payload, the customer id and the account list), reproduced with request hooks
+- info: the JSON logging setup at INFO, so every request writes its access log line
+- off: the JSON logging setup at WARNING, i.e. the cost of the hooks alone
+
+By default stdout is unbuffered, as with PYTHONUNBUFFERED=1 in most container images, so
+each print() is a write() in the request thread; --buffered measures block-buffered stdout.
+
+    python benchmarks/logging_overhead.py [--requests 2000] [--concurrency 8]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+MODES = ['prints', 'info', 'off']
+SCENARIOS = ['get_accounts', 'transfer_money']
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--customers', type=int, default=200)
+    parser.add_argument('--requests', type=int, default=2000, help='Requests per scenario.')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--buffered', action='store_true', help='Leave stdout block-buffered.')
+    parser.add_argument('--mode', choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument('--result', help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def install_prints(app):
+    """Reproduce what create_account, get_accounts_customer and transfer_money used to print()."""
+    from flask import request
+
+    @app.before_request
+    def print_request():
+        if request.endpoint == 'api.create_account':
+            print(request.get_json())
+        elif request.endpoint == 'api.get_accounts_customer':
+            print('get accounts called!!')
+            print(request.args.get('customer_id'))
+
+    @app.after_request
+    def print_result(response):
+        if request.endpoint == 'api.get_accounts_customer' and response.status_code == 200:
+            # The ORM list was printed; its reprs are '<Account name type>'
+            print([f"<Account {account['account_name']} {account['account_type']}>" for account in response.get_json()])
+        elif request.endpoint == 'api.transfer_money':
+            print('approved', 'approved')
+        return response
+
+
+def run_mode(args):
+    """Child process: build the app for one mode, seed it, drive the scenarios and write the results."""
+    import endpoints
+
+    if args.mode == 'prints':
+        os.environ.update(LOG_LEVEL='WARNING', ACCESS_LOG='0')
+    else:
+        os.environ.update(LOG_LEVEL='INFO' if args.mode == 'info' else 'WARNING', ACCESS_LOG='1')
+    run_args = argparse.Namespace(database_url=None, customers=args.customers, transactions_per_customer=5,
+                                  requests=args.requests, concurrency=args.concurrency, warmup=50,
+                                  bcrypt_rounds=4, cache_backend='none', no_metrics=True, seed=1)
+    app, _ = endpoints.build_app(run_args)
+    if args.mode == 'prints':
+        install_prints(app)
+    endpoints.seed(app, run_args)
+    from app import db
+    with app.app_context():
+        counter = endpoints.StatementCounter(db.engines.values())
+    results = {name: endpoints.run_scenario(app, name, run_args, counter) for name in SCENARIOS}
+    handler = app.extensions['log_handler']
+    handler.close()  # Flush the queue before reporting how much was dropped
+    with open(args.result, 'w') as f:
+        json.dump({'scenarios': results, 'dropped': handler.dropped}, f)
+
+
+def main():
+    args = parse_args()
+    if args.mode:
+        if not args.buffered:
+            sys.stdout.reconfigure(write_through=True)
+        run_mode(args)
+        return
+
+    workdir = tempfile.mkdtemp(prefix='safe-logbench-')
+    results = {}
+    for mode in MODES:
+        result_path = os.path.join(workdir, f'{mode}.json')
+        command = [sys.executable, os.path.abspath(__file__), '--mode', mode, '--result', result_path,
+                   '--customers', str(args.customers), '--requests', str(args.requests),
+                   '--concurrency', str(args.concurrency)] + (['--buffered'] if args.buffered else [])
+        with open(os.path.join(workdir, f'{mode}.log'), 'w') as log:
+            subprocess.run(command, stdout=log, check=True)
+        with open(result_path) as f:
+            results[mode] = json.load(f)
+
+    print(f'{"scenario":<16}{"mode":<8}{"req/s":>9}{"p50 ms":>9}{"p99 ms":>9}{"log KiB":>9}')
+    for name in SCENARIOS:
+        for mode in MODES:
+            result = results[mode]['scenarios'][name]
+            log_size = os.path.getsize(os.path.join(workdir, f'{mode}.log')) / 1024
+            print(f"{name:<16}{mode:<8}{result['throughput_rps']:>9.1f}{result['latency_ms']['p50']:>9.2f}"
+                  f"{result['latency_ms']['p99']:>9.2f}{log_size:>9.0f}")
+    dropped = {mode: results[mode]['dropped'] for mode in MODES if results[mode]['dropped']}
+    if dropped:
+        print('Log records dropped on a full queue:', dropped)
+    print(f'Logs and results are in {workdir}')
+
+
+if __name__ == '__main__':
+    main()
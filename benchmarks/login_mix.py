@@ -0,0 +1,120 @@
+"""Read latency while logins run alongside, with bcrypt inline on the request thread and in the bounded pool.
+
+Requests are served by a fixed pool of `--server-threads` threads, standing in for the worker
+threads of a deployment. `--readers` clients loop on /balances and /get_accounts, and
+`--logins` clients loop on /login, each waiting for its response before sending the next
+request. Read latency is measured from submission, so time spent queued behind busy server
+threads counts. Each phase runs for `--seconds`:
+
+- "reads": read traffic alone, the baseline;
+- "inline": with the login clients, bcrypt running on the request thread as it did before;
+- "pool": with the login clients, bcrypt in the HashingPool with its admission limit.
+
+A login turned away by the pool is a 503 and is counted as shed, not as an error.
+
+    python benchmarks/login_mix.py --bcrypt-rounds 12 --logins 16
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault('ACCESS_LOG', '0')  # A line per request would be most of what the phases measure
+
+from endpoints import build_app, seed, percentile, scenario_request
+
+READS = ('balances', 'get_accounts')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', help='Database to seed and use (default: a new SQLite file in a temp dir).')
+    parser.add_argument('--customers', type=int, default=200)
+    parser.add_argument('--server-threads', type=int, default=8, help='Threads serving requests.')
+    parser.add_argument('--readers', type=int, default=4, help='Clients sending reads.')
+    parser.add_argument('--logins', type=int, default=8, help='Clients sending logins.')
+    parser.add_argument('--seconds', type=float, default=10, help='Length of each phase.')
+    parser.add_argument('--bcrypt-rounds', type=int, default=12, help='Work factor of the seeded passwords and /login.')
+    parser.add_argument('--seed', type=int, default=1)
+    return parser.parse_args()
+
+
+class InlinePool:
+    """Runs the hash on the calling thread, as Auth did before the HashingPool."""
+
+    def run(self, fn, *args):
+        return fn(*args)
+
+
+def run_phase(app, server, tokens, args, logins):
+    """Drive reads, and `logins` login clients, for args.seconds; returns the samples of each kind."""
+    deadline = time.perf_counter() + args.seconds
+    samples = {'read': [], 'login': []}
+    lock = threading.Lock()
+
+    def serve(method, url, body, headers):
+        return app.test_client().open(url, method=method, json=body, headers=headers).status_code
+
+    def client(kind, number):
+        rng = random.Random(args.seed + number)
+        while time.perf_counter() < deadline:
+            customer_id = rng.randint(1, args.customers)
+            if kind == 'read':
+                method, url, body = scenario_request(rng.choice(READS), customer_id, args)
+                headers = {'Authorization': f'Bearer {tokens[customer_id]}'}
+            else:
+                method, url, body = scenario_request('login', customer_id, args)
+                headers = {}
+            started = time.perf_counter()
+            status = server.submit(serve, method, url, body, headers).result()
+            with lock:
+                samples[kind].append((time.perf_counter() - started, status))
+
+    clients = [threading.Thread(target=client, args=('read', n)) for n in range(args.readers)]
+    clients += [threading.Thread(target=client, args=('login', args.readers + n)) for n in range(logins)]
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    return samples
+
+
+def main():
+    args = parse_args()
+    options = SimpleNamespace(database_url=args.database_url, bcrypt_rounds=args.bcrypt_rounds, cache_backend='none',
+                              no_metrics=True, concurrency=args.server_threads)
+    app, database_url = build_app(options)
+    seed(app, SimpleNamespace(customers=args.customers, transactions_per_customer=0, seed=args.seed))
+    from app.utils import passwords
+    from app.utils.tokens import issue_token
+    with app.app_context():
+        tokens = {customer_id: issue_token(customer_id, False) for customer_id in range(1, args.customers + 1)}
+        pool_size = app.config['BCRYPT_POOL_SIZE']
+    get_hashing_pool = passwords.get_hashing_pool
+
+    print(f'database: {database_url}, bcrypt rounds {args.bcrypt_rounds}, {args.server_threads} server threads, '
+          f'bcrypt pool of {pool_size}')
+    print(f'{"phase":>7} {"reads/s":>8} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"logins/s":>9} {"shed":>6} '
+          f'{"errors":>6}')
+    with ThreadPoolExecutor(max_workers=args.server_threads) as server:
+        for phase, logins in (('reads', 0), ('inline', args.logins), ('pool', args.logins)):
+            passwords.get_hashing_pool = (lambda: InlinePool()) if phase == 'inline' else get_hashing_pool
+            samples = run_phase(app, server, tokens, args, logins)
+            reads = sorted(elapsed * 1000 for elapsed, _ in samples['read'])
+            logged_in = sum(1 for _, status in samples['login'] if status == 200)
+            shed = sum(1 for _, status in samples['login'] if status == 503)
+            errors = sum(1 for kind in samples.values() for _, status in kind if status not in (200, 503))
+            print(f'{phase:>7} {len(reads) / args.seconds:>8.1f} {statistics.median(reads):>8.2f} '
+                  f'{percentile(reads, 0.95):>8.2f} {percentile(reads, 0.99):>8.2f} '
+                  f'{logged_in / args.seconds:>9.1f} {shed:>6} {errors:>6}')
+    passwords.get_hashing_pool = get_hashing_pool
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""Compare response encoding paths on 10k-row payloads.
+
+The "dict" path is how routes serialized rows before msgspec: a dict per row with
+strftime/str conversions, encoded by Flask's standard-library JSON provider. The "msgspec"
+path builds the typed Structs from app.api.schemas and encodes them with the app's provider.
+For each we report the best wall time over several runs and the peak memory allocated
+while encoding, as measured by tracemalloc.
+
+    python benchmarks/serialization.py [--rows 10000] [--repeat 5]
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from decimal import Decimal
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+from flask.json.provider import DefaultJSONProvider
+from app import create_app
+from app.api.routes import format_transaction
+from app.api.schemas import AccountRecord
+
+
+def make_accounts(rows):
+    opened = datetime(2020, 1, 1)
+    return [SimpleNamespace(acct_no=10000000 + i, acct_name=f'Customer {i} Checking', acct_street='1 Main St',
+                            acct_city='Newark', acct_state='NJ', acct_zip=7102, acct_type='Checking',
+                            date_opened=opened + timedelta(hours=i), customerid=i // 3) for i in range(rows)]
+
+
+def make_transactions(rows):
+    start = datetime(2024, 1, 1)
+    return [SimpleNamespace(t_id=f'{i:020d}', from_account=10000000 + i % 997, to_account=10000000 + i % 991,
+                            amount=Decimal(i % 100000) / 100, timestamp=start + timedelta(seconds=i)) for i in range(rows)]
+
+
+def accounts_as_dicts(accounts):
+    return [{
+        'account_number': acct.acct_no,
+        'account_name': acct.acct_name,
+        'account_street': acct.acct_street,
+        'account_city': acct.acct_city,
+        'account_state': acct.acct_state,
+        'account_zip': acct.acct_zip,
+        'account_type': acct.acct_type,
+        'date_opened': acct.date_opened.strftime('%Y-%m-%d'),
+        'customer_id': acct.customerid
+    } for acct in accounts]
+
+
+def accounts_as_structs(accounts):
+    return [AccountRecord(
+        account_number=acct.acct_no,
+        account_name=acct.acct_name,
+        account_street=acct.acct_street,
+        account_city=acct.acct_city,
+        account_state=acct.acct_state,
+        account_zip=acct.acct_zip,
+        account_type=acct.acct_type,
+        date_opened=acct.date_opened.date(),
+        customer_id=acct.customerid
+    ) for acct in accounts]
+
+
+def transactions_as_dicts(transactions):
+    return {'transactions': [{
+        'transaction_id': transaction.t_id,
+        'from_account': transaction.from_account,
+        'to_account': transaction.to_account,
+        'amount': str(transaction.amount),
+        'timestamp': transaction.timestamp.strftime('%Y-%m-%d %H:%M:%S')
+    } for transaction in transactions], 'next_cursor': None}
+
+
+def transactions_as_structs(transactions):
+    return {'transactions': [format_transaction(transaction) for transaction in transactions], 'next_cursor': None}
+
+
+def measure(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    app = create_app()
+    stdlib = DefaultJSONProvider(app)
+    payloads = {
+        'accounts': (make_accounts(args.rows), accounts_as_dicts, accounts_as_structs),
+        'transactions': (make_transactions(args.rows), transactions_as_dicts, transactions_as_structs),
+    }
+    print(f'{"payload":<14}{"path":<10}{"best ms":>10}{"peak KiB":>12}')
+    with app.app_context():
+        for name, (rows, as_dicts, as_structs) in payloads.items():
+            paths = {
+                'dict': lambda: stdlib.response(as_dicts(rows)),
+                'msgspec': lambda: app.json.response(as_structs(rows)),
+            }
+            results = {path: measure(fn, args.repeat) for path, fn in paths.items()}
+            for path, (seconds, peak) in results.items():
+                print(f'{name:<14}{path:<10}{seconds * 1000:>10.2f}{peak / 1024:>12.0f}')
+            print(f'{"":<14}{"speedup":<10}{results["dict"][0] / results["msgspec"][0]:>10.2f}x')
+
+
+if __name__ == '__main__':
+    main()
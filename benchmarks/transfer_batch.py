@@ -0,0 +1,106 @@
+"""Transfers per second through /transfer_money/batch against one /transfer_money request per transfer.
+
+A payroll run: customer 1 pays `--transfers` transfers of 1.00 from checking, spread over the
+checking accounts of the other customers. It is sent once as one /transfer_money request per
+transfer from `--concurrency` threads, and once as /transfer_money/batch requests of
+`--batch-size` transfers. After each run the payer's balance must have dropped by exactly the
+transfers that succeeded.
+
+The batch endpoint is meant to sustain at least `--target` times (10 by default) the
+per-request throughput; the exit status is 1 when it does not.
+
+    python benchmarks/transfer_batch.py --transfers 20000 --batch-size 1000
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault('ACCESS_LOG', '0')  # A line per request would slow the per-request run most
+
+from endpoints import build_app, seed
+
+PAYER = 1
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', help='Database to seed and use (default: a new SQLite file in a temp dir).')
+    parser.add_argument('--customers', type=int, default=500, help='Customers to seed; all but the payer are paid.')
+    parser.add_argument('--transfers', type=int, default=5000, help='Transfers per run.')
+    parser.add_argument('--batch-size', type=int, default=500, help='Transfers per /transfer_money/batch request.')
+    parser.add_argument('--concurrency', type=int, default=4, help='Client threads in both runs.')
+    parser.add_argument('--target', type=float, default=10, help='Required speedup of the batch endpoint.')
+    parser.add_argument('--seed', type=int, default=1)
+    return parser.parse_args()
+
+
+def payroll(args):
+    return [{'from_customer_id': PAYER, 'to_acct_no': 10000000 + (2 + n % (args.customers - 1)) * 3,
+             'type': 'checking', 'amount': '1.00'} for n in range(args.transfers)]
+
+
+def payer_balance(app):
+    from app.utils.helpers import customer_portfolio
+    with app.app_context():
+        return customer_portfolio(PAYER)['checking_balance']
+
+
+def send(app, headers, requests, concurrency):
+    """POST every (url, body, count) from `concurrency` threads; returns (seconds, transfers that succeeded)."""
+    def worker(share):
+        client = app.test_client()
+        succeeded = 0
+        for url, body, count in share:
+            response = client.post(url, json=body, headers=headers)
+            if response.status_code == 200:
+                succeeded += response.get_json().get('succeeded', count)
+        return succeeded
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        succeeded = sum(pool.map(worker, [requests[i::concurrency] for i in range(concurrency)]))
+    return time.perf_counter() - started, succeeded
+
+
+def main():
+    args = parse_args()
+    options = SimpleNamespace(database_url=args.database_url, bcrypt_rounds=4, cache_backend='none',
+                              no_metrics=True, concurrency=args.concurrency)
+    app, database_url = build_app(options)
+    seed(app, SimpleNamespace(customers=args.customers, transactions_per_customer=0, seed=args.seed))
+    from app.utils.tokens import issue_token
+    with app.app_context():
+        headers = {'Authorization': f'Bearer {issue_token(PAYER, False)}'}
+
+    transfers = payroll(args)
+    runs = {
+        'single': [('/transfer_money', transfer, 1) for transfer in transfers],
+        'batch': [('/transfer_money/batch', {'transfers': transfers[i:i + args.batch_size]},
+                   len(transfers[i:i + args.batch_size])) for i in range(0, len(transfers), args.batch_size)],
+    }
+    print(f'database: {database_url}, {args.transfers} transfers, batches of {args.batch_size}, '
+          f'{args.concurrency} client threads')
+    print(f'{"mode":>7} {"requests":>9} {"seconds":>8} {"transfers/s":>12} {"failed":>7}')
+    throughput = {}
+    for mode, requests in runs.items():
+        before = payer_balance(app)
+        seconds, succeeded = send(app, headers, requests, args.concurrency)
+        paid = before - payer_balance(app)
+        if paid != Decimal(succeeded):
+            sys.exit(f'{mode}: payer paid {paid}, expected {succeeded}.00')
+        throughput[mode] = succeeded / seconds
+        print(f'{mode:>7} {len(requests):>9} {seconds:>8.2f} {throughput[mode]:>12.1f} {args.transfers - succeeded:>7}')
+
+    speedup = throughput['batch'] / throughput['single']
+    print(f'batch is {speedup:.1f}x the per-request throughput (target {args.target:g}x)')
+    if speedup < args.target:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
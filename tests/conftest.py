@@ -0,0 +1,102 @@
+"""Fixtures running the app against a throwaway SQLite file with create_app('local').
+
+The config classes read the environment when they are imported, so it is set here before the
+app package is.
+"""
+import os
+import tempfile
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+
+os.environ.update({
+    'DATABASE_URL': 'sqlite:///' + os.path.join(tempfile.mkdtemp(prefix='safe-tests-'), 'test.db'),
+    'REPLICA_DATABASE_URL': '',
+    'CACHE_BACKEND': 'none',
+    'PAYMENT_GATEWAY': 'fake',
+    'SETTLEMENT_WORKERS': '0',
+    'BCRYPT_ROUNDS': '4',
+    'METRICS_ENABLED': '0',
+    'ACCESS_LOG': '0',
+    'LOG_LEVEL': 'WARNING',
+    'IDEMPOTENCY_SWEEP_SECONDS': '0',
+})
+
+from app import create_app, db
+from app.models import (Account, Customer, CheckingAccount, SavingsAccount, Loan, PersonalLoan, StudentLoan, HomeLoan,
+                        University)
+from app.utils.tokens import issue_token
+
+
+@pytest.fixture(scope='session')
+def app():
+    return create_app('local')
+
+
+@pytest.fixture(autouse=True)
+def database(app):
+    """Fresh tables for every test."""
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        yield db
+        db.session.remove()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def auth_headers(app):
+    def headers(customer_id, is_admin=False):
+        with app.app_context():
+            return {'Authorization': f'Bearer {issue_token(customer_id, is_admin)}'}
+    return headers
+
+
+@pytest.fixture
+def make_customer(app):
+    """Create a customer owning `checking` checking, `savings` savings and `loans` loan accounts.
+
+    Loans cycle through personal, student and home, so every branch of the portfolio is loaded.
+    Returns the new account numbers by type.
+    """
+    next_acct_no = iter(range(20000000, 30000000))
+
+    def make(customer_id, checking=1, savings=1, loans=0, balance=Decimal('1000.00')):
+        opened = datetime(2024, 1, 1)
+        created = {'Checking': [], 'Savings': [], 'Loan': []}
+        with app.app_context():
+            db.session.add(Customer(customerid=customer_id, cfname='Test', clname=f'User{customer_id}',
+                                    cstreet='1 Main St', ccity='Newark', cstate='NJ', czip=7102))
+            university = db.session.get(University, 1) or University(universityid=1, universityname='NJIT')
+            for acct_type, count in (('Checking', checking), ('Savings', savings), ('Loan', loans)):
+                for n in range(count):
+                    acct_no = next(next_acct_no)
+                    created[acct_type].append(acct_no)
+                    db.session.add(Account(acct_no=acct_no, acct_name=f'Test {acct_type} {n}', acct_street='1 Main St',
+                                           acct_city='Newark', acct_state='NJ', acct_zip=7102, acct_type=acct_type,
+                                           date_opened=opened, customerid=customer_id, status='approved'))
+                    if acct_type == 'Checking':
+                        db.session.add(CheckingAccount(acct_no=acct_no, service_charge=1.0, balance=balance))
+                    elif acct_type == 'Savings':
+                        db.session.add(SavingsAccount(acct_no=acct_no, interest_rate=0.02, balance=balance))
+                    else:
+                        loan_type = ('Personal', 'Student', 'Home')[n % 3]
+                        db.session.add(Loan(acct_no=acct_no, loan_rate=5.0, loan_amount=10000, loan_payment=0,
+                                            loan_months=60, loan_type=loan_type))
+                        if loan_type == 'Personal':
+                            db.session.add(PersonalLoan(acct_no=acct_no))
+                        elif loan_type == 'Student':
+                            db.session.add(StudentLoan(acct_no=acct_no, studentid=customer_id, status='Enrolled',
+                                                       expecteddate=opened, university=university))
+                        else:
+                            db.session.add(HomeLoan(acct_no=acct_no, builtyear=2000, hianumber=customer_id,
+                                                    icname='Acme', icstreet='2 Main St', iccity='Newark',
+                                                    icstate='NJ', iczip=7102, premium=1000))
+            db.session.commit()
+        return created
+    return make
@@ -0,0 +1,65 @@
+import threading
+
+import pytest
+from sqlalchemy import event
+
+from app import db
+
+
+class StatementCounter:
+    """Counts the SQL statements this thread sends to any engine while active."""
+
+    def __init__(self, app):
+        with app.app_context():
+            self.engines = list(db.engines.values())
+        self.local = threading.local()
+
+    def count(self, *args):
+        self.local.count = getattr(self.local, 'count', 0) + 1
+
+    def __enter__(self):
+        self.local.count = 0
+        for engine in self.engines:
+            event.listen(engine, 'before_cursor_execute', self.count)
+        return self
+
+    def __exit__(self, *exc):
+        for engine in self.engines:
+            event.remove(engine, 'before_cursor_execute', self.count)
+
+    @property
+    def statements(self):
+        return self.local.count
+
+
+def get_accounts(client, auth_headers, customer_id):
+    response = client.get(f'/get_accounts?customer_id={customer_id}', headers=auth_headers(customer_id))
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def test_get_accounts_query_count_does_not_grow_with_accounts(app, client, auth_headers, make_customer):
+    statements = {}
+    for customer_id, size in ((1, 1), (2, 5), (3, 20)):
+        make_customer(customer_id, checking=size, savings=size, loans=3 * size)
+        get_accounts(client, auth_headers, customer_id)  # Pools and lazily built registries are not the endpoint's cost
+        with StatementCounter(app) as counter:
+            body = get_accounts(client, auth_headers, customer_id)
+        assert len(body) == 5 * size
+        statements[size] = counter.statements
+    assert len(set(statements.values())) == 1, statements
+
+
+def test_get_accounts_includes_loan_details(client, auth_headers, make_customer):
+    make_customer(1, checking=1, savings=1, loans=3)
+    accounts = get_accounts(client, auth_headers, 1)
+    loans = {account['LoanInfo']['loan_type']: account['LoanInfo'] for account in accounts
+             if account['account_type'] == 'Loan'}
+    assert set(loans) == {'Personal', 'Student', 'Home'}
+    assert loans['Student']['StudentInfo']['university_name'] == 'NJIT'
+    assert loans['Home']['HomeInfo']['icname'] == 'Acme'
+
+
+@pytest.mark.parametrize('customer_id, status', [('x', 400), ('', 400)])
+def test_get_accounts_rejects_bad_customer_ids(client, auth_headers, customer_id, status):
+    assert client.get(f'/get_accounts?customer_id={customer_id}', headers=auth_headers(1)).status_code == status
@@ -0,0 +1,57 @@
+import random
+from datetime import date, timedelta
+from decimal import Decimal
+
+import pytest
+
+from app import db
+from app.models import BalanceSnapshot
+from app.utils.helpers import calculate_balances, count_balance_points
+
+
+@pytest.fixture
+def snapshots(app, make_customer):
+    """Closing balances for a customer's checking account on random days of 2025, with gaps between them."""
+    checking = make_customer(1)['Checking'][0]
+    rng = random.Random(1)
+    days = sorted(rng.sample(range(365), 120))
+    with app.app_context():
+        for day in days:
+            db.session.add(BalanceSnapshot(acct_no=checking, snapshot_date=date(2025, 1, 1) + timedelta(days=day),
+                                           balance=Decimal(rng.randint(0, 10 ** 6)) / 100))
+        db.session.commit()
+    return checking
+
+
+@pytest.mark.parametrize('interval', ['weekly', 'monthly'])
+def test_bucketed_balances_match_the_daily_curve(app, snapshots, interval):
+    start, end = date(2025, 1, 15), date(2025, 11, 20)
+    with app.app_context():
+        daily = {point['date']: point['balance'] for point in calculate_balances(snapshots, start, end, 'daily')}
+        points = calculate_balances(snapshots, start, end, interval)
+    assert points
+    assert len(points) <= count_balance_points(start, end, interval)
+    for point in points:
+        assert point['balance'] == daily[point['date']]
+
+
+@pytest.mark.parametrize('start, end, interval, expected', [
+    (date(2025, 1, 1), date(2025, 1, 31), 'daily', 31),
+    (date(2025, 1, 1), date(2025, 1, 31), 'weekly', 5),  # 2025-01-01 is a Wednesday
+    (date(2025, 1, 6), date(2025, 1, 12), 'weekly', 1),
+    (date(2025, 1, 31), date(2025, 3, 1), 'monthly', 3),
+])
+def test_count_balance_points(start, end, interval, expected):
+    assert count_balance_points(start, end, interval) == expected
+
+
+@pytest.mark.parametrize('query, status', [
+    ('start=0001-01-01&end=2025-12-31&interval=daily', 400),
+    ('start=2020-01-01&end=2025-12-31&interval=daily', 400),
+    ('start=2020-01-01&end=2025-12-31&interval=weekly', 200),
+    ('start=0001-01-01&end=2025-12-31&interval=monthly', 400),
+    ('start=1950-01-01&end=2025-12-31&interval=monthly', 200),
+])
+def test_balance_history_range_is_capped(client, auth_headers, snapshots, query, status):
+    response = client.get(f'/account_balance_over_time/1?{query}', headers=auth_headers(1))
+    assert response.status_code == status
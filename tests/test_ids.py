@@ -0,0 +1,109 @@
+import time
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from app import db
+from app.models import Account, IdSequence
+from app.utils import ids as id_allocators
+from app.utils.helpers import generate_unique_account_numbers
+from app.utils.ids import BlockAllocator, SnowflakeAllocator, WorkerIdsExhausted, lease_worker_id
+
+THREADS = 8
+IDS_PER_THREAD = 5000
+
+
+def generate_concurrently(app, allocators, per_thread=IDS_PER_THREAD):
+    """Draw IDs from every allocator on THREADS threads; returns each thread's IDs in order.
+
+    Throughput is measured by benchmarks/id_allocation.py, not here, where a busy machine would fail it.
+    """
+    def work(allocator):
+        with app.app_context():
+            return [allocator.next_id() for _ in range(per_thread)]
+
+    with ThreadPoolExecutor(max_workers=THREADS) as pool:
+        return list(pool.map(work, [allocators[i % len(allocators)] for i in range(THREADS)]))
+
+
+def assert_unique_and_increasing(batches):
+    ids = [value for batch in batches for value in batch]
+    assert len(set(ids)) == len(ids)
+    for batch in batches:
+        assert batch == sorted(batch) and len(set(batch)) == len(batch)
+
+
+def test_snowflake_ids_do_not_collide_across_threads_and_processes(app):
+    with app.app_context():
+        # One allocator per simulated worker process, each leasing its own worker id
+        allocators = [SnowflakeAllocator() for _ in range(4)]
+    assert len({allocator.worker_id for allocator in allocators}) == 4
+    batches = generate_concurrently(app, allocators)
+    assert_unique_and_increasing(batches)
+
+
+def test_block_ids_do_not_collide_across_threads_and_processes(app):
+    with app.app_context():
+        allocators = [BlockAllocator('test', block_size=100) for _ in range(4)]
+        batches = generate_concurrently(app, allocators)
+        reserved = db.session.get(IdSequence, 'test').next_value
+    assert_unique_and_increasing(batches)
+    # Only a block reservation touches the database: at most one per 100 IDs, plus the sequence's first row
+    assert reserved - 1 <= THREADS * IDS_PER_THREAD + 100 * len(allocators)
+
+
+def test_next_ids_reserves_one_block_for_a_large_request(app):
+    with app.app_context():
+        allocator = BlockAllocator('bulk', block_size=10)
+        ids = allocator.next_ids(1000)
+        assert ids == list(range(1, 1001))
+        assert db.session.get(IdSequence, 'bulk').next_value == 1001
+
+
+def test_account_numbers_skip_numbers_issued_before_the_sequence(app, make_customer, monkeypatch):
+    monkeypatch.setattr(id_allocators, '_allocators', {})  # No block left over from an earlier test
+    make_customer(1, checking=0, savings=0)
+    # The baseline drew account numbers at random from the whole 8-digit range
+    legacy = [10000000, 10000002, 10000003, 10000019, 10000020, 99999999]
+    with app.app_context():
+        for acct_no in legacy:
+            db.session.add(Account(acct_no=acct_no, acct_name='Legacy', acct_street='1 Main St', acct_city='Newark',
+                                   acct_state='NJ', acct_zip=7102, acct_type='Checking',
+                                   date_opened=datetime(2020, 1, 1), customerid=1, status='approved'))
+        db.session.commit()
+
+        numbers = generate_unique_account_numbers(5) + generate_unique_account_numbers(30)
+    assert numbers[:5] == [10000001, 10000004, 10000005, 10000006, 10000007]
+    assert len(set(numbers)) == 35 and not set(numbers) & set(legacy)
+    assert max(numbers) < 10000040
+
+
+def test_worker_ids_are_reused_after_their_lease_expires(app):
+    with app.app_context():
+        assert [lease_worker_id(owner, 60, 3) for owner in ('a', 'b')] == [0, 1]
+        assert lease_worker_id('exited', 0, 3) == 2
+        time.sleep(0.01)
+        assert lease_worker_id('new', 60, 3) == 2
+
+
+def test_leasing_fails_loudly_when_every_worker_id_is_taken(app):
+    with app.app_context():
+        lease_worker_id('a', 60, 2)
+        lease_worker_id('b', 60, 2)
+        with pytest.raises(WorkerIdsExhausted):
+            lease_worker_id('c', 60, 2)
+
+
+def test_allocator_leases_again_once_its_lease_is_lost(app):
+    with app.app_context():
+        allocator = SnowflakeAllocator()
+        first = allocator.worker_id
+        allocator.lease_valid_until = 0  # As if the heartbeat had found the lease taken over
+        allocator.next_id()
+        assert allocator.worker_id != first
+
+
+def test_configured_worker_ids_must_fit_in_ten_bits():
+    with pytest.raises(ValueError):
+        SnowflakeAllocator(worker_id=1024)
@@ -0,0 +1,55 @@
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import pytest
+
+from app import db
+from app.models import CheckingAccount, FundingIntent, Transaction
+from app.utils.payments import PaymentResult
+from app.utils.settlement import settle_funding_intent, settle_pending_intents
+
+
+class SlowWorkerGateway:
+    """The first confirmation outlives the stale timeout: the sweep settles the intent during it, then it ends in `outcome`."""
+
+    def __init__(self, outcome):
+        self.outcome = outcome
+        self.calls = 0
+
+    def confirm_payment(self, amount_in_cents, payment_method_id, idempotency_key):
+        self.calls += 1
+        if self.calls == 1:
+            settle_funding_intent(idempotency_key, stale_before=datetime.utcnow() + timedelta(minutes=1))
+            if self.outcome == 'error':
+                raise TimeoutError('Gateway timed out')
+            return PaymentResult('failed', 'late', 'Declined late')
+        # Idempotent replay of the payment the sweep confirmed
+        return PaymentResult('succeeded', f'ref_{idempotency_key}', None)
+
+
+@pytest.fixture
+def gateway(app):
+    def install(outcome):
+        app.extensions['payment_gateway'] = SlowWorkerGateway(outcome)
+    yield install
+    app.extensions.pop('payment_gateway', None)
+
+
+@pytest.mark.parametrize('outcome', ['error', 'failed'])
+def test_stale_worker_cannot_reopen_a_settled_intent(app, make_customer, gateway, outcome):
+    checking = make_customer(1)['Checking'][0]
+    gateway(outcome)
+    with app.app_context():
+        db.session.add(FundingIntent(intent_id='a' * 32, customer_id=1, acct_no=checking, amount=Decimal('25.00'),
+                                     payment_method_id='pm_card_visa', status='pending'))
+        db.session.commit()
+
+        assert settle_funding_intent('a' * 32) == 'succeeded'
+        # Later sweeps find nothing left to settle
+        assert settle_pending_intents() == {}
+        assert settle_funding_intent('a' * 32, stale_before=datetime.utcnow() + timedelta(minutes=1)) is None
+
+        db.session.expire_all()
+        assert db.session.get(FundingIntent, 'a' * 32).status == 'succeeded'
+        assert db.session.get(CheckingAccount, checking).balance == Decimal('1025.00')
+        assert Transaction.query.count() == 1
@@ -0,0 +1,96 @@
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+import pytest
+
+from app import db
+from app.models import CheckingAccount, Loan, SavingsAccount, Transaction
+
+THREADS = 8
+TRANSFERS_PER_THREAD = 25
+
+
+def balance(app, model, acct_no):
+    with app.app_context():
+        return db.session.get(model, acct_no).balance
+
+
+def test_opposing_transfers_never_fail(app, auth_headers, make_customer):
+    a = make_customer(1)['Checking'][0]
+    b = make_customer(2)['Checking'][0]
+    # Half the threads send A -> B and half B -> A, the order that used to deadlock
+    directions = [(1, b), (2, a)] * (THREADS // 2)
+
+    def send(direction):
+        customer_id, to_acct_no = direction
+        client, headers = app.test_client(), auth_headers(customer_id)
+        body = {'from_customer_id': customer_id, 'to_acct_no': to_acct_no, 'type': 'checking', 'amount': '1.00'}
+        return [client.post('/transfer_money', json=body, headers=headers).status_code
+                for _ in range(TRANSFERS_PER_THREAD)]
+
+    with ThreadPoolExecutor(max_workers=THREADS) as pool:
+        statuses = [status for batch in pool.map(send, directions) for status in batch]
+
+    assert statuses == [200] * THREADS * TRANSFERS_PER_THREAD
+    # Every transfer is matched by one the other way, so both balances end where they started
+    assert balance(app, CheckingAccount, a) == balance(app, CheckingAccount, b) == Decimal('1000.00')
+    with app.app_context():
+        assert Transaction.query.count() == THREADS * TRANSFERS_PER_THREAD
+
+
+def test_transfer_between_own_accounts(app, client, auth_headers, make_customer):
+    accounts = make_customer(1)
+    response = client.post('/transfer_money', headers=auth_headers(1), json={
+        'from_customer_id': 1, 'to_acct_no': accounts['Savings'][0], 'type': 'checking', 'amount': '250.50'})
+    assert response.status_code == 200
+    assert balance(app, CheckingAccount, accounts['Checking'][0]) == Decimal('749.50')
+    assert balance(app, SavingsAccount, accounts['Savings'][0]) == Decimal('1250.50')
+
+
+@pytest.mark.parametrize('changes', [
+    {'amount': '-100'},
+    {'amount': '0'},
+    {'amount': 'NaN'},
+    {'amount': 'abc'},
+    {'amount': '0.001'},
+    {'amount': '5000'},
+    {'to_acct_no': 'x'},
+    {'to_acct_no': 1.5},
+    {'to_acct_no': 99999999},
+    {'type': 'loan'},
+])
+def test_bad_transfers_are_refused_without_moving_money(app, client, auth_headers, make_customer, changes):
+    make_customer(1)
+    b = make_customer(2)['Checking'][0]
+    body = {'from_customer_id': 1, 'to_acct_no': b, 'type': 'checking', 'amount': '10', **changes}
+    response = client.post('/transfer_money', json=body, headers=auth_headers(1))
+    assert 400 <= response.status_code < 500
+    assert balance(app, CheckingAccount, b) == Decimal('1000.00')
+
+
+def test_loan_payments_from_concurrent_threads_all_apply(app, auth_headers, make_customer):
+    accounts = make_customer(1, loans=1)
+    loan = accounts['Loan'][0]
+
+    def pay(_):
+        client, headers = app.test_client(), auth_headers(1)
+        body = {'loanAccountNumber': loan, 'paymentAccountType': 'savings', 'paymentAmount': '1', 'customerId': 1}
+        return [client.post('/pay_loan', json=body, headers=headers).status_code for _ in range(10)]
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        statuses = [status for batch in pool.map(pay, range(4)) for status in batch]
+
+    assert statuses == [200] * 40
+    assert balance(app, SavingsAccount, accounts['Savings'][0]) == Decimal('960.00')
+    with app.app_context():
+        assert db.session.get(Loan, loan).loan_payment == 40
+
+
+@pytest.mark.parametrize('amount', ['-100', 'x', '1.5', None])
+def test_bad_loan_payments_are_refused(app, client, auth_headers, make_customer, amount):
+    accounts = make_customer(1, loans=1)
+    response = client.post('/pay_loan', headers=auth_headers(1), json={
+        'loanAccountNumber': accounts['Loan'][0], 'paymentAccountType': 'savings', 'paymentAmount': amount,
+        'customerId': 1})
+    assert response.status_code == 400
+    assert balance(app, SavingsAccount, accounts['Savings'][0]) == Decimal('1000.00')